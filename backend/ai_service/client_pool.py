@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import importlib.util
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+from django.conf import settings
+from google import genai
+from google.genai import types
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def as_dict(self):
+        with self.lock:
+            return {"created": self.created, "reused": self.reused, "evicted": self.evicted}
+
+
+stats = _Stats()
+
+
+def _http_options():
+    """Keep-alive connection pooling for the SDK's httpx clients"""
+    limits = httpx.Limits(
+        max_connections=settings.GEMINI_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GEMINI_CLIENT_MAX_CONNECTIONS,
+        keepalive_expiry=settings.GEMINI_CLIENT_KEEPALIVE_SECONDS,
+    )
+    # The SDK hands async_client_args to aiohttp instead when it is installed.
+    async_args = None if importlib.util.find_spec("aiohttp") else {"limits": limits}
+    return types.HttpOptions(client_args={"limits": limits}, async_client_args=async_args)
+
+
+# Pending async close tasks, referenced so they are not garbage collected.
+_closing = set()
+
+
+async def _aclose_quietly(closers):
+    for aclose in closers:
+        # Connections opened on an event loop that has since closed cannot
+        # be shut down cleanly; they are released with the client anyway.
+        with contextlib.suppress(Exception):
+            await aclose()
+
+
+def _close(client):
+    """
+    Close the sync and async HTTP clients of a client dropped from the pool.
+    The pinned google-genai has no public close, so its transports are
+    closed directly.
+    """
+    api_client = getattr(client, "_api_client", None)
+    if api_client is None:
+        return
+    sync_client = getattr(api_client, "_httpx_client", None)
+    if sync_client is not None:
+        sync_client.close()
+
+    closers = [
+        aclose for aclose in (
+            getattr(getattr(api_client, "_async_httpx_client", None), "aclose", None),
+            getattr(getattr(api_client, "_aiohttp_session", None), "close", None),
+        )
+        if aclose is not None
+    ]
+    if not closers:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(_aclose_quietly(closers))
+        return
+    task = loop.create_task(_aclose_quietly(closers))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+class ClientPool:
+    """
+    One genai.Client per API key, shared by every request using that key so
+    its HTTP connections are reused. At most GEMINI_CLIENT_POOL_SIZE clients
+    are kept, least recently used first out, and a client unused for
+    GEMINI_CLIENT_IDLE_SECONDS is dropped. Dropped clients have their sync
+    and async HTTP clients closed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = OrderedDict()
+
+    def get(self, api_key):
+        """The pooled client for `api_key`, created on first use"""
+        now = time.monotonic()
+        with self.lock:
+            dropped = self._expire(now)
+            entry = self.clients.get(api_key)
+            if entry is not None:
+                client = entry[0]
+                self.clients[api_key] = (client, now)
+                self.clients.move_to_end(api_key)
+                with stats.lock:
+                    stats.reused += 1
+            else:
+                client = genai.Client(api_key=api_key, http_options=_http_options())
+                self.clients[api_key] = (client, now)
+                with stats.lock:
+                    stats.created += 1
+                while len(self.clients) > settings.GEMINI_CLIENT_POOL_SIZE:
+                    dropped.append(self.clients.popitem(last=False)[1][0])
+                    with stats.lock:
+                        stats.evicted += 1
+        # Closed outside the lock; closing can wait on the network.
+        for evicted in dropped:
+            _close(evicted)
+        return client
+
+    def get_async(self, api_key):
+        """The pooled client's async interface (`client.aio`) for `api_key`"""
+        return self.get(api_key).aio
+
+    def _expire(self, now):
+        """Drop clients idle for GEMINI_CLIENT_IDLE_SECONDS and return them; caller holds the lock"""
+        idle = settings.GEMINI_CLIENT_IDLE_SECONDS
+        expired = []
+        while self.clients:
+            api_key, (client, last_used) = next(iter(self.clients.items()))
+            if now - last_used < idle:
+                break
+            del self.clients[api_key]
+            expired.append(client)
+            with stats.lock:
+                stats.evicted += 1
+        return expired
+
+    def clear(self):
+        with self.lock:
+            dropped = [client for client, _ in self.clients.values()]
+            self.clients.clear()
+        for client in dropped:
+            _close(client)
+
+
+pool = ClientPool()
+
+
+def get_client(api_key):
+    return pool.get(api_key)
+
+
+def get_async_client(api_key):
+    return pool.get_async(api_key)
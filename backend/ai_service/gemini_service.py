@@ -3,12 +3,14 @@ import base64
 import mimetypes
 from google.genai import types
 import logging
+from ai_service import response_cache, single_flight
+from ai_service.client_pool import get_async_client, get_client
 
 logger = logging.getLogger(__name__)
 
 def test_api_key(api_key: str):
     try:
-        client = genai.Client(api_key=api_key)
+        client = get_client(api_key)
 
         response = client.models.generate_content(
             model="gemini-2.5-flash-lite",
@@ -20,6 +22,72 @@ def test_api_key(api_key: str):
         logger.error(f"API key validation failed: {e}")
         return False
 
+async def atest_api_key(api_key: str):
+    try:
+        client = get_async_client(api_key)
+
+        response = await client.models.generate_content(
+            model="gemini-2.5-flash-lite",
+            contents="test"
+        )
+
+        return response.text
+    except Exception as e:
+        logger.error(f"API key validation failed: {e}")
+        return False
+
+def _generation_request(
+    api_key: str,
+    prompt: str,
+    system_instruction_string: str,
+    response_schema_param: list,
+    response_mime_type_param: str,
+):
+    """
+    Contents, config and cache request for a structured generation. The
+    request includes the API key, so answers are never shared across keys.
+    """
+    response_schema_properties = {
+        param: genai.types.Schema(
+            type=genai.types.Type.STRING,
+        )
+        for param in response_schema_param
+    }
+
+    model = "gemini-2.5-flash-lite"
+    contents = [
+        genai.types.Content(
+            role="user",
+            parts=[
+                genai.types.Part.from_text(text=prompt),
+            ],
+        ),
+    ]
+    generate_content_config = genai.types.GenerateContentConfig(
+        thinking_config=genai.types.ThinkingConfig(
+            thinking_budget=-1,
+        ),
+        response_mime_type=response_mime_type_param,
+        response_schema=genai.types.Schema(
+            type=genai.types.Type.OBJECT,
+            required=response_schema_param,
+            properties=response_schema_properties,
+        ),
+        system_instruction=[
+            genai.types.Part.from_text(text=system_instruction_string),
+        ],
+    )
+
+    request = {
+        "api_key": api_key,
+        "model": model,
+        "system_instruction": system_instruction_string,
+        "prompt": prompt,
+        "response_schema": list(response_schema_param),
+        "response_mime_type": response_mime_type_param,
+    }
+    return model, contents, generate_content_config, request
+
 def generate_response(
     api_key: str,
     prompt: str,
@@ -27,98 +95,196 @@ def generate_response(
     system_instruction_string: str = "Answer this prompt make sure answer that",
     response_schema_param: list = ["response"],
     response_mime_type_param: str = "application/json",
+    cache_method: str = None,
+    bypass_cache: bool = False,
 ) -> str:
         """
         Generates a response using the Gemini API.
 
         This method encapsulates the logic for interacting with the external
         Gemini API. It is designed to be called by the `post` method.
+        `cache_method` names the calling view method for the response cache
+        (see ai_service.response_cache); `bypass_cache` forces a fresh answer.
+        Identical requests made with the same key while one is in flight
+        share its upstream call (see ai_service.single_flight).
         """
         try:
-
-            response_schema_properties = {
-                param: genai.types.Schema(
-                    type=genai.types.Type.STRING,
-                )
-                for param in response_schema_param
-            }
-
-            client = genai.Client(api_key=api_key)
-            model = "gemini-2.5-flash-lite"
-            contents = [
-                genai.types.Content(
-                    role="user",
-                    parts=[
-                        genai.types.Part.from_text(text=prompt),
-                    ],
-                ),
-            ]
-            generate_content_config = genai.types.GenerateContentConfig(
-                thinking_config=genai.types.ThinkingConfig(
-                    thinking_budget=-1,
-                ),
-                response_mime_type=response_mime_type_param,
-                response_schema=genai.types.Schema(
-                    type=genai.types.Type.OBJECT,
-                    required=response_schema_param,
-                    properties=response_schema_properties,
+            client = get_client(api_key)
+            model, contents, generate_content_config, request = _generation_request(
+                api_key, prompt, system_instruction_string, response_schema_param, response_mime_type_param
+            )
+            key = response_cache.fingerprint(**request)
+            return response_cache.get_or_generate(
+                cache_method,
+                request,
+                lambda: single_flight.flights.do(
+                    key,
+                    lambda: client.models.generate_content(
+                        model=model,
+                        contents=contents,
+                        config=generate_content_config,
+                    ).text,
                 ),
-                system_instruction=[
-                    genai.types.Part.from_text(text=system_instruction_string),
-                ],
+                bypass=bypass_cache,
             )
+        except Exception as e:
+            logger.error(f"An error occurred during Gemini API call: {e}")
+            raise
+
 
-            response = client.models.generate_content(
+async def agenerate_response(
+    api_key: str,
+    prompt: str,
+    model: str = "gemini-2.5-flash-lite",
+    system_instruction_string: str = "Answer this prompt make sure answer that",
+    response_schema_param: list = ["response"],
+    response_mime_type_param: str = "application/json",
+    cache_method: str = None,
+    bypass_cache: bool = False,
+) -> str:
+    """
+    Async generate_response, on the pooled client's async interface, so
+    waiting for Gemini does not hold a thread.
+    """
+    try:
+        client = get_async_client(api_key)
+        model, contents, generate_content_config, request = _generation_request(
+            api_key, prompt, system_instruction_string, response_schema_param, response_mime_type_param
+        )
+
+        async def generate():
+            response = await client.models.generate_content(
                 model=model,
                 contents=contents,
                 config=generate_content_config,
             )
             return response.text
-        except Exception as e:
-            logger.error(f"An error occurred during Gemini API call: {e}")
-            raise
 
+        key = response_cache.fingerprint(**request)
+        return await response_cache.aget_or_generate(
+            cache_method,
+            request,
+            lambda: single_flight.flights.ado(key, generate),
+            bypass=bypass_cache,
+        )
+    except Exception as e:
+        logger.error(f"An error occurred during Gemini API call: {e}")
+        raise
 
-def generate_image(self, prompt: str, api_key: str):
+
+async def stream_response(
+    api_key: str,
+    prompt: str,
+    model: str = "gemini-2.5-flash-lite",
+    system_instruction_string: str = "Answer this prompt make sure answer that",
+):
     """
-    Generates an image using Gemini's image model.
+    Streams a plain-text response from the Gemini API, yielding text chunks
+    as they are generated. Uses the pooled client's async interface.
     """
     try:
-        client = genai.Client(api_key=api_key)
-        model = "gemini-2.5-flash-image"
-        
+        client = get_async_client(api_key)
         contents = [
-            types.Content(
+            genai.types.Content(
                 role="user",
-                parts=[types.Part.from_text(text=prompt)],
-            )
+                parts=[
+                    genai.types.Part.from_text(text=prompt),
+                ],
+            ),
         ]
+        generate_content_config = genai.types.GenerateContentConfig(
+            thinking_config=genai.types.ThinkingConfig(
+                thinking_budget=-1,
+            ),
+            system_instruction=[
+                genai.types.Part.from_text(text=system_instruction_string),
+            ],
+        )
+
+        stream = await client.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+    except Exception as e:
+        logger.error(f"An error occurred during Gemini streaming call: {e}")
+        raise
+
 
-        generate_content_config = types.GenerateContentConfig(
-            response_modalities=["IMAGE", "TEXT"],
+def _image_request(prompt: str):
+    contents = [
+        types.Content(
+            role="user",
+            parts=[types.Part.from_text(text=prompt)],
         )
+    ]
+
+    generate_content_config = types.GenerateContentConfig(
+        response_modalities=["IMAGE", "TEXT"],
+    )
+    return "gemini-2.5-flash-image", contents, generate_content_config
+
+def _image_from_chunk(chunk):
+    """The image carried by a streamed chunk, or None if it has none"""
+    if (
+        chunk.candidates
+        and chunk.candidates[0].content
+        and chunk.candidates[0].content.parts
+    ):
+        part = chunk.candidates[0].content.parts[0]
+        if hasattr(part, "inline_data") and part.inline_data and part.inline_data.data:
+            mime_type = part.inline_data.mime_type
+            image_data = part.inline_data.data
+            base64_str = base64.b64encode(image_data).decode("utf-8")
+            extension = mimetypes.guess_extension(mime_type) or ".png"
+            return {
+                "mime_type": mime_type,
+                "extension": extension,
+                "base64_image": base64_str,
+            }
+    return None
+
+def generate_image(prompt: str, api_key: str):
+    """
+    Generates an image using Gemini's image model.
+    """
+    try:
+        client = get_client(api_key)
+        model, contents, generate_content_config = _image_request(prompt)
 
         for chunk in client.models.generate_content_stream(
             model=model,
             contents=contents,
             config=generate_content_config,
         ):
-            if (
-                chunk.candidates
-                and chunk.candidates[0].content
-                and chunk.candidates[0].content.parts
-            ):
-                part = chunk.candidates[0].content.parts[0]
-                if hasattr(part, "inline_data") and part.inline_data and part.inline_data.data:
-                    mime_type = part.inline_data.mime_type
-                    image_data = part.inline_data.data
-                    base64_str = base64.b64encode(image_data).decode("utf-8")
-                    extension = mimetypes.guess_extension(mime_type) or ".png"
-                    return {
-                        "mime_type": mime_type,
-                        "extension": extension,
-                        "base64_image": base64_str,
-                    }
+            image = _image_from_chunk(chunk)
+            if image is not None:
+                return image
+        raise Exception("No image data returned from Gemini API.")
+    except Exception as e:
+        logger.error(f"Error during image generation: {e}")
+        raise
+
+async def agenerate_image(prompt: str, api_key: str):
+    """
+    Async generate_image, on the pooled client's async interface.
+    """
+    try:
+        client = get_async_client(api_key)
+        model, contents, generate_content_config = _image_request(prompt)
+
+        stream = await client.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
+        async for chunk in stream:
+            image = _image_from_chunk(chunk)
+            if image is not None:
+                return image
         raise Exception("No image data returned from Gemini API.")
     except Exception as e:
         logger.error(f"Error during image generation: {e}")
@@ -137,13 +303,8 @@ def determine_topic(topic: str, keywords: list[str]):
     return {"status": "success", "topic_analysis": {"main_topic": topic, "keywords": keywords}}
 
 
-def process_text_with_function_calling_vertex(prompt: str, api_key: str):
-    """
-    Orchestrates the multi-turn conversation with Gemini for function calling
-    using the Vertex AI SDK (google.genai).
-    """
-    client = genai.Client(api_key=api_key)
-
+def _function_calling_request(prompt: str):
+    """The model, opening contents and tool config of a function-calling analysis"""
     tools = [
         types.Tool(
             function_declarations=[
@@ -201,17 +362,54 @@ def process_text_with_function_calling_vertex(prompt: str, api_key: str):
         )
     ]
 
-    available_functions = {
-        "classify_text": classify_text,
-        "analyze_sentiment": analyze_sentiment,
-        "determine_topic": determine_topic,
-    }
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+    return "gemini-2.5-flash-lite", contents, types.GenerateContentConfig(tools=tools)
 
-    model_name = "gemini-2.5-flash-lite"
 
-    contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
-    
-    config = types.GenerateContentConfig(tools=tools)
+_ANALYSIS_FUNCTIONS = {
+    "classify_text": classify_text,
+    "analyze_sentiment": analyze_sentiment,
+    "determine_topic": determine_topic,
+}
+
+
+def _requested_function(response):
+    """The function call the model answered with, or None for a plain text answer"""
+    try:
+        return response.candidates[0].content.parts[0].function_call
+    except (IndexError, AttributeError, TypeError):
+        return None
+
+
+def _call_requested_function(function_call, response, contents):
+    """
+    Run the function the model asked for and append the exchange to
+    `contents` for the follow-up turn; returns the function's result.
+    """
+    function_to_call = _ANALYSIS_FUNCTIONS.get(function_call.name)
+    if function_to_call is None:
+        logger.error(f"Model requested an unknown function: {function_call.name}")
+        raise ValueError(f"Model requested an unknown function: {function_call.name}")
+
+    args_dict = {key: value for key, value in function_call.args.items()}
+    function_response_data = function_to_call(**args_dict)
+
+    function_response_part = types.Part.from_function_response(
+        name=function_call.name,
+        response={"result": function_response_data}
+    )
+    contents.append(response.candidates[0].content)
+    contents.append(types.Content(parts=[function_response_part]))
+    return function_response_data
+
+
+def process_text_with_function_calling_vertex(prompt: str, api_key: str):
+    """
+    Orchestrates the multi-turn conversation with Gemini for function calling
+    using the Vertex AI SDK (google.genai).
+    """
+    client = get_client(api_key)
+    model_name, contents, config = _function_calling_request(prompt)
 
     response = client.models.generate_content(
         model=model_name,
@@ -219,39 +417,53 @@ def process_text_with_function_calling_vertex(prompt: str, api_key: str):
         config=config,
     )
 
-    try:
-        function_call = response.candidates[0].content.parts[0].function_call
-    except (IndexError, AttributeError):
+    function_call = _requested_function(response)
+    if function_call is None:
         return {
             "natural_language_response": response.text,
             "function_data": None
         }
 
-    function_name = function_call.name
-    function_args = function_call.args
+    function_response_data = _call_requested_function(function_call, response, contents)
+    final_response = client.models.generate_content(
+        model=model_name,
+        contents=contents,
+    )
 
-    if function_name in available_functions:
-        function_to_call = available_functions[function_name]
-        args_dict = {key: value for key, value in function_args.items()}
-        function_response_data = function_to_call(**args_dict)
+    return {
+        "natural_language_response": final_response.text,
+        "function_data": function_response_data
+    }
 
-        function_response_part = types.Part.from_function_response(
-            name=function_name,
-            response={"result": function_response_data}
-        )
 
-        contents.append(response.candidates[0].content)
-        contents.append(types.Content(parts=[function_response_part]))
+async def aprocess_text_with_function_calling_vertex(prompt: str, api_key: str):
+    """
+    Async process_text_with_function_calling_vertex, on the pooled client's
+    async interface.
+    """
+    client = get_async_client(api_key)
+    model_name, contents, config = _function_calling_request(prompt)
 
-        final_response = client.models.generate_content(
-            model=model_name,
-            contents=contents,
-        )
+    response = await client.models.generate_content(
+        model=model_name,
+        contents=contents,
+        config=config,
+    )
 
+    function_call = _requested_function(response)
+    if function_call is None:
         return {
-            "natural_language_response": final_response.text,
-            "function_data": function_response_data
+            "natural_language_response": response.text,
+            "function_data": None
         }
-    else:
-        logger.error(f"Model requested an unknown function: {function_name}")
-        raise ValueError(f"Model requested an unknown function: {function_name}")
\ No newline at end of file
+
+    function_response_data = _call_requested_function(function_call, response, contents)
+    final_response = await client.models.generate_content(
+        model=model_name,
+        contents=contents,
+    )
+
+    return {
+        "natural_language_response": final_response.text,
+        "function_data": function_response_data
+    }
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def record(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self):
+        with self.lock:
+            hits = self.local_hits + self.shared_hits
+            total = hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+stats = _Stats()
+
+
+def fingerprint(**request):
+    """Cache key of a generation request: a hash of every parameter that shapes the answer"""
+    payload = json.dumps(request, sort_keys=True, default=str)
+    return "gemini-response:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _LocalTier:
+    """Bounded LRU of responses, each with its own expiry time"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = settings.GEMINI_RESPONSE_CACHE_SIZE
+        if size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local = _LocalTier()
+
+
+def _shared_tier():
+    alias = settings.GEMINI_RESPONSE_CACHE_BACKEND
+    return caches[alias] if alias else None
+
+
+def get_or_generate(method, request, generate, bypass=False):
+    """
+    Return the cached response to `request` for view method `method`, or
+    call `generate()` and cache its result.
+
+    Only methods listed in GEMINI_RESPONSE_CACHE_TTLS are cached, for their
+    TTL in seconds. Lookups try this process's LRU first, then the shared
+    Django cache named by GEMINI_RESPONSE_CACHE_BACKEND. With `bypass`, the
+    cache is not read but the fresh response still replaces the cached one.
+    """
+    ttl = settings.GEMINI_RESPONSE_CACHE_TTLS.get(method) if method else None
+    if not ttl:
+        return generate()
+
+    key = fingerprint(**request)
+    shared = _shared_tier()
+    if bypass:
+        stats.record("bypassed")
+    else:
+        value = local.get(key)
+        if value is not None:
+            stats.record("local_hits")
+            return value
+        if shared is not None:
+            value = shared.get(key)
+            if value is not None:
+                stats.record("shared_hits")
+                local.set(key, value, ttl)
+                return value
+        stats.record("misses")
+
+    value = generate()
+    local.set(key, value, ttl)
+    if shared is not None:
+        shared.set(key, value, timeout=ttl)
+    return value
+
+
+async def aget_or_generate(method, request, generate, bypass=False):
+    """Async get_or_generate: `generate` is a coroutine function"""
+    ttl = settings.GEMINI_RESPONSE_CACHE_TTLS.get(method) if method else None
+    if not ttl:
+        return await generate()
+
+    key = fingerprint(**request)
+    shared = _shared_tier()
+    if bypass:
+        stats.record("bypassed")
+    else:
+        value = local.get(key)
+        if value is not None:
+            stats.record("local_hits")
+            return value
+        if shared is not None:
+            value = await shared.aget(key)
+            if value is not None:
+                stats.record("shared_hits")
+                local.set(key, value, ttl)
+                return value
+        stats.record("misses")
+
+    value = await generate()
+    local.set(key, value, ttl)
+    if shared is not None:
+        await shared.aset(key, value, timeout=ttl)
+    return value
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+
+from django.conf import settings
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def record(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self):
+        with self.lock:
+            total = self.leaders + self.coalesced
+            return {
+                "upstream_calls": self.leaders,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+                "coalesced_rate": self.coalesced / total if total else 0.0,
+            }
+
+
+stats = _Stats()
+
+
+class CoalescedCallCancelled(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        # (event loop, future) of async callers waiting for this call.
+        self.waiters = []
+        # Upstream task of an async leader that stopped waiting for it.
+        self.orphan = None
+
+
+def _resolve(future, call):
+    if future.done():
+        return
+    if call.error is not None:
+        future.set_exception(call.error)
+    else:
+        future.set_result(call.result)
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: while a call for `key` is running,
+    callers with the same key wait for it and share its result or error
+    instead of starting their own.
+
+    Threads (`do`) and asyncio tasks (`ado`), on any event loop, share the
+    same in-flight calls. Nothing is kept once a call finishes, so this only
+    merges concurrent requests; remembering answers is the response cache's
+    job. GEMINI_COALESCE_REQUESTS = False turns coalescing off.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _join(self, key):
+        """The in-flight call for `key` and whether this caller leads it"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.followers += 1
+                stats.record("coalesced")
+                return call, False
+            call = self.calls[key] = _Call()
+            stats.record("leaders")
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+            call.result = result
+            call.error = error
+            waiters, call.waiters = call.waiters, []
+            call.done.set()
+        if error is not None:
+            stats.record("failures")
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, call)
+            except RuntimeError:
+                # That waiter's event loop has already closed.
+                pass
+
+    def do(self, key, fn):
+        """Return `fn()`, or the result of an identical call already in flight"""
+        if not settings.GEMINI_COALESCE_REQUESTS:
+            return fn()
+
+        call, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result=result)
+            return result
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def ado(self, key, fn):
+        """Async `do`: `fn` is a coroutine function"""
+        if not settings.GEMINI_COALESCE_REQUESTS:
+            return await fn()
+
+        call, leader = self._join(key)
+        if leader:
+            # The upstream call runs as its own task, so followers still get
+            # an answer if the leading request is cancelled (e.g. the client
+            # disconnected); it is only abandoned when nobody else waits.
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda task: self._settle(key, call, task))
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                with self.lock:
+                    alone = not call.followers
+                    if not alone:
+                        call.orphan = task
+                if alone:
+                    task.cancel()
+                raise
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            finished = call.done.is_set()
+            if not finished:
+                call.waiters.append((loop, future))
+        if finished:
+            _resolve(future, call)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            with self.lock:
+                call.followers -= 1
+                if (loop, future) in call.waiters:
+                    call.waiters.remove((loop, future))
+                orphan = call.orphan if not call.followers else None
+            if orphan is not None:
+                # The leader left earlier, so nobody waits for the upstream call.
+                orphan.get_loop().call_soon_threadsafe(orphan.cancel)
+            raise
+
+    def _settle(self, key, call, task):
+        if task.cancelled():
+            self._finish(key, call, error=CoalescedCallCancelled(
+                "The shared upstream call was cancelled."
+            ))
+        elif task.exception() is not None:
+            self._finish(key, call, error=task.exception())
+        else:
+            self._finish(key, call, result=task.result())
+
+    def clear(self):
+        with self.lock:
+            self.calls.clear()
+
+
+flights = SingleFlight()
@@ -1,8 +1,7 @@
 import PyPDF2
-import io
-from typing import Optional
+from typing import Iterator, Optional
 import os
-from nevatal_settings import settings
+from django.conf import settings
 
 def strip_authentication_header(header: str) -> str:
     try:
@@ -12,6 +11,39 @@ def strip_authentication_header(header: str) -> str:
     except Exception as e:
         return header
 
+def bypass_response_cache(request) -> bool:
+    """
+    Whether the caller asked for a fresh answer, with `X-Cache-Bypass: 1`
+    or `Cache-Control: no-cache` / `no-store`.
+    """
+    if request.headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes"):
+        return True
+    cache_control = request.headers.get("Cache-Control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+def rag_chat_prompt(question: str, chunks) -> str:
+    """The rag-chat/ prompt: the user's question followed by the retrieved chunks"""
+    return (
+        f"User Question: {question}\n"
+        "Context Information:\n"
+        + "\n".join(f"Document {i+1}: {chunk}" for i, chunk in enumerate(chunks))
+    )
+
+def iter_pdf_pages(pdf_file) -> Iterator[str]:
+    """
+    Yield the text of a PDF one page at a time.
+
+    The reader works on the upload's own file handle (spooled to disk for
+    large uploads), so only the page being extracted is held in memory.
+
+    Args:
+        pdf_file: Django UploadedFile or file-like object
+    """
+    pdf_file.seek(0)
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    for page in pdf_reader.pages:
+        yield page.extract_text() or ""
+
 def extract_text_from_pdf(pdf_file) -> Optional[str]:
     """
     Extract text content from a PDF file.
@@ -23,17 +55,7 @@ def extract_text_from_pdf(pdf_file) -> Optional[str]:
         str: Extracted text from PDF, or None if extraction fails
     """
     try:
-        pdf_file.seek(0)
-        
-
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_file.read()))
-
-        text = ""
-        for page in pdf_reader.pages:
-            extracted = page.extract_text() or ""
-            text += extracted
-
-        text = text.strip()
+        text = "".join(iter_pdf_pages(pdf_file)).strip()
         if not text:
             print("⚠️ No text extracted — PDF may be scanned or image-based.")
             return None
@@ -45,14 +67,16 @@ def extract_text_from_pdf(pdf_file) -> Optional[str]:
         print(f"❌ Error extracting text from PDF: {e}")
         return None
 
-def save_file(file) -> Optional[str]:
+def save_file(file, directory: str = "", file_name: Optional[str] = None) -> Optional[str]:
     """
-    Save a file to the media directory.
+    Save a file to the media directory, or to `directory` inside it, under
+    `file_name` (default: the upload's own name).
     """
     try:
-        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        target_dir = os.path.join(settings.MEDIA_ROOT, directory)
+        os.makedirs(target_dir, exist_ok=True)
 
-        file_path = os.path.join(settings.MEDIA_ROOT, file.name)
+        file_path = os.path.join(target_dir, file_name or file.name)
         with open(file_path, "wb") as f:
             for chunk in file.chunks() if hasattr(file, "chunks") else [file.read()]:
                 f.write(chunk)
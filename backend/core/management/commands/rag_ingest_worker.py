@@ -0,0 +1,53 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rag_service import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued PDF ingestion jobs from the database, oldest first. Start as many "
+        "workers as needed; each job is claimed by exactly one of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.RAG_INGEST_POLL_SECONDS,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # A long-lived worker outlives CONN_MAX_AGE and database restarts,
+            # so drop broken or expired connections before touching the queue.
+            close_old_connections()
+            try:
+                job = jobs.claim_next()
+                if job is None:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                self.stdout.write(f"Job {job.id}: ingesting {job.source}")
+                job = jobs.run(job)
+            except Exception:
+                # A claimed job whose worker stops heartbeating is reclaimed
+                # once its lease expires, so the loop only has to survive.
+                logger.exception("RAG ingest worker iteration failed")
+                time.sleep(options["poll_interval"])
+                continue
+
+            message = f"Job {job.id}: {job.status}, {job.chunks_indexed} chunks from {job.pages_parsed} pages"
+            if job.error:
+                message += f" ({job.error})"
+            self.stdout.write(message)
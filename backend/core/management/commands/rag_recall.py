@@ -0,0 +1,73 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import RagChunk
+from rag_service.index_factory import CODECS, recall_report
+from rag_service.rag_service import _decode_embeddings
+
+
+class Command(BaseCommand):
+    help = (
+        "Report recall@k, query latency and size of each RAG index type and codec against exact "
+        "search, separately for each namespace and embedding dimension."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=200, help="Number of corpus vectors used as queries.")
+        parser.add_argument("--limit", type=int, default=0, help="Only use the first N chunks of each group (0 = all).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--namespace", default=None, help="Only use chunks from this namespace.")
+        parser.add_argument("--codec", action="append", choices=CODECS, help="Codec to measure (repeatable, default all).")
+        parser.add_argument("--rerank-factor", type=int, default=settings.RAG_RERANK_FACTOR)
+
+    def handle(self, *args, **options):
+        chunks = RagChunk.objects.filter(pending=False)
+        if options["namespace"] is not None:
+            chunks = chunks.filter(namespace=options["namespace"])
+        # Vectors of different namespaces or dimensions cannot share an index.
+        groups = list(
+            chunks.values_list("namespace", "embedding_dimension")
+            .distinct()
+            .order_by("namespace", "embedding_dimension")
+        )
+        if not groups:
+            raise CommandError("No RAG chunks found in the database.")
+
+        for namespace, dimension in groups:
+            group = chunks.filter(namespace=namespace, embedding_dimension=dimension).order_by("id")
+            group = group.values_list("embedding", "embedding_dtype")
+            if options["limit"]:
+                group = group[:options["limit"]]
+            self.stdout.write(f"namespace {namespace or '(default)'}:")
+            self.report(list(group), options)
+
+    def report(self, chunks, options):
+        vectors = _decode_embeddings([c[0] for c in chunks], [c[1] for c in chunks])
+        rng = np.random.default_rng(options["seed"])
+        sample = rng.choice(len(vectors), size=min(options["queries"], len(vectors)), replace=False)
+        # Perturb the sampled vectors so queries are near, not identical to, corpus points.
+        noise = rng.normal(scale=vectors.std() * 0.1, size=(len(sample), vectors.shape[1]))
+        queries = np.ascontiguousarray(vectors[sample] + noise, dtype=np.float32)
+
+        k = options["k"]
+        self.stdout.write(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {len(queries)} queries, k={k}")
+        self.stdout.write(
+            f"{'index':<10} {'codec':<5} {'factory':<22} {'param':<9} {'value':>6} "
+            f"{'recall@k':>9} {'reranked':>9} {'ms/query':>9} {'build s':>8} {'MB':>9} {'B/vec':>8}"
+        )
+        rows = recall_report(
+            vectors,
+            queries,
+            k=k,
+            codecs=options["codec"] or CODECS,
+            rerank_factor=options["rerank_factor"],
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['index_type']:<10} {row['codec']:<5} {row['factory']:<22} {row['param']:<9} "
+                f"{str(row['value']):>6} {row['recall']:>9.3f} {row['reranked_recall']:>9.3f} "
+                f"{row['latency_ms']:>9.3f} {row['build_seconds']:>8.2f} "
+                f"{row['size_bytes'] / 2 ** 20:>9.2f} {row['bytes_per_vector']:>8.0f}"
+            )
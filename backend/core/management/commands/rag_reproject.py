@@ -0,0 +1,62 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import RagChunk, RagCorpusVersion
+from rag_service import snapshot
+from rag_service.embedder import project
+from rag_service.rag_service import _bump_corpus_version, _encode_embedding
+
+
+class Command(BaseCommand):
+    help = (
+        "Shrink stored RAG embeddings to a smaller dimension by Matryoshka truncation "
+        "and renormalization, without calling the embedding API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dimension", type=int, required=True)
+        parser.add_argument("--namespace", default=None, help="Only re-project this namespace (default: all).")
+        parser.add_argument("--batch-size", type=int, default=settings.RAG_BULK_CREATE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        dimension = options["dimension"]
+        if dimension <= 0:
+            raise CommandError("--dimension must be positive.")
+
+        if options["namespace"] is not None:
+            namespaces = [options["namespace"]]
+        else:
+            namespaces = list(RagChunk.objects.values_list("namespace", flat=True).distinct())
+
+        for namespace in namespaces:
+            try:
+                updated = self.reproject(namespace, dimension, options["batch_size"])
+            except ValueError as e:
+                raise CommandError(f"Namespace {namespace or 'default'}: {e}")
+            self.stdout.write(f"{namespace or 'default'}: {updated} chunks re-projected to {dimension} dimensions")
+
+    def reproject(self, namespace, dimension, batch_size):
+        chunks = RagChunk.objects.filter(namespace=namespace)
+        # Collect ids up front rather than iterating a cursor over rows being updated.
+        ids = list(chunks.exclude(embedding_dimension=dimension).values_list("id", flat=True))
+
+        with transaction.atomic():
+            for start in range(0, len(ids), batch_size):
+                batch = list(
+                    chunks.filter(id__in=ids[start:start + batch_size])
+                    .only("id", "embedding", "embedding_dtype")
+                )
+                for chunk in batch:
+                    vector = np.frombuffer(bytes(chunk.embedding), dtype=chunk.embedding_dtype)
+                    chunk.embedding = _encode_embedding(project(vector, dimension), chunk.embedding_dtype)
+                    chunk.embedding_dimension = dimension
+                RagChunk.objects.bulk_update(batch, ["embedding", "embedding_dimension"])
+
+            _bump_corpus_version(namespace)
+            RagCorpusVersion.objects.filter(namespace=namespace).update(embedding_dimension=dimension)
+
+        # Workers see the new version and dimension and rebuild from the table.
+        snapshot.clear_snapshots(namespace)
+        return len(ids)
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:48
+
+import numpy as np
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    RagChunk = apps.get_model("core", "RagChunk")
+    batch = []
+    for chunk in RagChunk.objects.only("id", "embedding_json").iterator(chunk_size=BATCH_SIZE):
+        chunk.embedding = np.asarray(chunk.embedding_json or [], dtype=np.float32).tobytes()
+        chunk.embedding_dtype = "float32"
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            RagChunk.objects.bulk_update(batch, ["embedding", "embedding_dtype"])
+            batch = []
+    if batch:
+        RagChunk.objects.bulk_update(batch, ["embedding", "embedding_dtype"])
+
+
+def binary_to_json(apps, schema_editor):
+    RagChunk = apps.get_model("core", "RagChunk")
+    batch = []
+    for chunk in RagChunk.objects.only("id", "embedding", "embedding_dtype").iterator(chunk_size=BATCH_SIZE):
+        vector = np.frombuffer(bytes(chunk.embedding), dtype=chunk.embedding_dtype)
+        chunk.embedding_json = vector.astype(np.float32).tolist()
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            RagChunk.objects.bulk_update(batch, ["embedding_json"])
+            batch = []
+    if batch:
+        RagChunk.objects.bulk_update(batch, ["embedding_json"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_ragcorpusversion"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="ragchunk",
+            old_name="embedding",
+            new_name="embedding_json",
+        ),
+        migrations.AddField(
+            model_name="ragchunk",
+            name="embedding",
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name="ragchunk",
+            name="embedding_dtype",
+            field=models.CharField(
+                choices=[("float32", "Float32"), ("float16", "Float16")],
+                default="float32",
+                max_length=8,
+            ),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name="ragchunk",
+            name="embedding_json",
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_ragchunk_binary_embedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ragchunk",
+            name="namespace",
+            field=models.CharField(default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="ragcorpusversion",
+            name="namespace",
+            field=models.CharField(default="", max_length=64, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="ragchunk",
+            index=models.Index(
+                fields=["namespace", "id"], name="core_ragchu_namespa_948209_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ragchunk",
+            index=models.Index(
+                fields=["namespace", "source"], name="core_ragchu_namespa_7036b4_idx"
+            ),
+        ),
+    ]
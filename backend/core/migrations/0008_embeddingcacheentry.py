@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_rag_namespaces"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_name", models.CharField(max_length=255)),
+                ("task_type", models.CharField(max_length=64)),
+                ("dimension", models.IntegerField(default=0)),
+                ("text_hash", models.CharField(max_length=64)),
+                ("embedding", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("model_name", "task_type", "dimension", "text_hash"),
+                        name="unique_embedding_cache_key",
+                    )
+                ],
+            },
+        ),
+    ]
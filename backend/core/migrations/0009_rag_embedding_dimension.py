@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:33
+
+import numpy as np
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def record_dimensions(apps, schema_editor):
+    RagChunk = apps.get_model("core", "RagChunk")
+    batch = []
+    for chunk in RagChunk.objects.only("id", "embedding", "embedding_dtype").iterator(chunk_size=BATCH_SIZE):
+        chunk.embedding_dimension = len(chunk.embedding) // np.dtype(chunk.embedding_dtype).itemsize
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            RagChunk.objects.bulk_update(batch, ["embedding_dimension"])
+            batch = []
+    if batch:
+        RagChunk.objects.bulk_update(batch, ["embedding_dimension"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_embeddingcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragchunk',
+            name='embedding_dimension',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ragcorpusversion',
+            name='embedding_dimension',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(record_dimensions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 23:40
+
+from django.db import migrations
+
+
+def drop_unnamespaced_chunks(apps, schema_editor):
+    """
+    Chunks stored before 0007_rag_namespaces got namespace='', which no API
+    key maps to, and they do not record whose key uploaded them. They can
+    never be retrieved or reassigned, so drop them; their documents have to
+    be uploaded again.
+    """
+    RagChunk = apps.get_model("core", "RagChunk")
+    RagCorpusVersion = apps.get_model("core", "RagCorpusVersion")
+    deleted, _ = RagChunk.objects.filter(namespace="").delete()
+    RagCorpusVersion.objects.filter(namespace="").delete()
+    if deleted:
+        print(f"\n  Deleted {deleted} RAG chunks stored before namespaces; re-upload their PDFs.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_ingestionjob_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_unnamespaced_chunks, migrations.RunPython.noop),
+    ]
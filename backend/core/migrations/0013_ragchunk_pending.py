@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_drop_unnamespaced_rag_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragchunk',
+            name='pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -29,11 +29,93 @@ class ChatRecord(models.Model):
         return self.method
 
 class RagChunk(models.Model):
+
+    EMBEDDING_DTYPE_CHOICES = [
+        ('float32', 'Float32'),
+        ('float16', 'Float16'),
+    ]
+
+    namespace = models.CharField(max_length=64, default='')
     source = models.CharField(max_length=255)       
     text = models.TextField()                       
-    embedding = models.JSONField(default=list) 
+    embedding = models.BinaryField(default=bytes)
+    embedding_dtype = models.CharField(max_length=8, choices=EMBEDDING_DTYPE_CHOICES, default='float32')
+    embedding_dimension = models.PositiveIntegerField(default=0)
+    # Set while the ingest that wrote the row is still running; pending rows
+    # are invisible to retrieval and index syncs until it publishes them.
+    pending = models.BooleanField(default=False)
     metadata = JSONField(default=dict, blank=True) 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['namespace', 'id']),
+            models.Index(fields=['namespace', 'source']),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.id} ({self.source})"
+
+class RagCorpusVersion(models.Model):
+    namespace = models.CharField(max_length=64, unique=True, default='')
+    version = models.BigIntegerField(default=0)
+    # 0 keeps the embedding model's full output size.
+    embedding_dimension = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Corpus version {self.version} ({self.namespace})"
+
+
+class EmbeddingCacheEntry(models.Model):
+    model_name = models.CharField(max_length=255)
+    task_type = models.CharField(max_length=64)
+    dimension = models.IntegerField(default=0)
+    text_hash = models.CharField(max_length=64)
+    embedding = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model_name', 'task_type', 'dimension', 'text_hash'],
+                name='unique_embedding_cache_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} {self.task_type} {self.text_hash[:12]}"
+
+
+class IngestionJob(models.Model):
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    api_key = models.CharField(max_length=255, default='')
+    source = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=1024)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+    cancel_requested = models.BooleanField(default=False)
+    pages_parsed = models.PositiveIntegerField(default=0)
+    chunks_embedded = models.PositiveIntegerField(default=0)
+    chunks_indexed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
     def __str__(self):
-        return f"Chunk {self.id} ({self.source})"
\ No newline at end of file
+        return f"Ingestion job {self.id} ({self.source}, {self.status})"
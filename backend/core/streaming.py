@@ -0,0 +1,89 @@
+import json
+import logging
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from core.models import ChatRecord
+from ai_service.gemini_service import stream_response
+
+logger = logging.getLogger(__name__)
+
+
+def wants_stream(request) -> bool:
+    """Whether the caller asked for server-sent events, with ?stream=1 or an Accept header"""
+    if request.query_params.get("stream", "").lower() in ("1", "true"):
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def sse_event(data, event=None) -> str:
+    """Format one server-sent event carrying `data` as JSON"""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views negotiate `Accept: text/event-stream`. Replies that are not
+    streamed, such as validation errors, are sent as a single event.
+    """
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        event = "error" if response is not None and response.status_code >= 400 else "done"
+        return sse_event(data, event=event).encode(self.charset)
+
+
+def _event_stream(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def stream_generation(method, api_key, prompt, on_complete=None, wrap=None, **generate_kwargs):
+    """
+    Relay a Gemini answer as server-sent events: one unnamed event per text
+    chunk ({"text": ...}), then a `done` event with the view's usual response
+    body. Its "data" is the {"response": ...} JSON generate_response returns,
+    passed through `wrap(data)` for views that nest it, e.g. under
+    "written_text". The ChatRecord is saved, and `on_complete(data)` called,
+    once the stream has ended. Failures end the stream with an `error` event.
+    """
+    async def events():
+        chunks = []
+        try:
+            async for text in stream_response(api_key=api_key, prompt=prompt, **generate_kwargs):
+                chunks.append(text)
+                yield sse_event({"text": text})
+        except Exception as e:
+            logger.error(f"Streaming {method} failed: {e}")
+            yield sse_event({
+                "status": 500,
+                "message": "error",
+                "data": "An unexpected error occurred while processing your request."
+            }, event="error")
+            return
+
+        response_data = json.dumps({"response": "".join(chunks)})
+        await ChatRecord.objects.acreate(method=method, prompt=prompt, response=response_data, api_key=api_key)
+        if on_complete is not None:
+            on_complete(response_data)
+        payload = response_data if wrap is None else wrap(response_data)
+        yield sse_event({"status": 200, "message": "success", "data": payload}, event="done")
+
+    return _event_stream(events())
+
+
+def stream_cached(response_data):
+    """Send an already known answer as a single `done` event"""
+    async def events():
+        yield sse_event({"status": 200, "message": "success", "data": response_data}, event="done")
+
+    return _event_stream(events())
@@ -1,15 +1,46 @@
+import asyncio
 import json
-from unittest.mock import patch, MagicMock
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock, MagicMock
 
-from django.test import TestCase, Client
+from asgiref.sync import async_to_sync
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.management import call_command
 from django.urls import reverse
 from django.conf import settings
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from core.views import SummarizerView
+from core.views import HistoryView, SummarizerView, WriterView
+from document_function.views import AnalyzeTextView, DirectExtractionView
+from core.models import ChatRecord, EmbeddingCacheEntry, IngestionJob, RagChunk
+from rag_service.rag_service import (
+    RAGIndex, _registry, _chunk_text_cache, _bump_corpus_version, _stored_vectors, namespace_for
+)
+from rag_service.index_factory import choose_index_type, index_type_of
+from rag_service.embedder import embed_in_batches, estimate_tokens
+from rag_service.chunker import iter_chunks
+from rag_service.diversity import mmr_order
+from rag_service.bm25 import BM25Index
+from rag_service.pipeline import staged
+from rag_service import answer_cache, embedding_cache, index_factory, jobs, snapshot
+from ai_service import client_pool, response_cache, single_flight
+from ai_service.gemini_service import agenerate_response
 from google.genai import types  # real types
+from google.genai import errors as genai_errors
 
 import os
+import tempfile
+import threading
 import unittest
+import faiss
+import httpx
+import numpy as np
 from rest_framework.test import APITestCase
 from django.urls import reverse
 
@@ -123,3 +154,1112 @@ class SummarizerIntegrationTests(TestCase):
             "An unexpected error occurred while processing your request."
         )
 
+
+
+class GeminiResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.enterContext(override_settings(GEMINI_RESPONSE_CACHE_TTLS={"translator": 3600}))
+        client_pool.pool.clear()
+        response_cache.local.clear()
+        patcher = patch("ai_service.client_pool.genai.Client")
+        self.mock_client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.generate_content = AsyncMock(return_value=SimpleNamespace(text='{"response": "Hola"}'))
+        self.mock_client_class.return_value.aio.models.generate_content = self.generate_content
+
+    def translate(self, prompt="Hello", api_key="key", **headers):
+        return self.client.post(
+            reverse("translator"),
+            {"prompt": prompt, "target_language": "Spanish"},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {api_key}",
+            **headers,
+        )
+
+    def test_repeated_requests_are_served_from_cache(self):
+        """Identical requests to a cached method should reach Gemini once per API key, unless bypassed."""
+        before = response_cache.stats.as_dict()
+        self.assertEqual(self.translate().data["data"], '{"response": "Hola"}')
+        self.assertEqual(self.translate().data["data"], '{"response": "Hola"}')
+        self.assertEqual(self.generate_content.call_count, 1)
+        self.assertEqual(response_cache.stats.as_dict()["local_hits"] - before["local_hits"], 1)
+
+        self.translate(api_key="other")
+        self.assertEqual(self.generate_content.call_count, 2)
+
+        self.translate(HTTP_X_CACHE_BYPASS="1")
+        self.translate(prompt="Goodbye")
+        self.assertEqual(self.generate_content.call_count, 4)
+
+        with override_settings(GEMINI_RESPONSE_CACHE_TTLS={}):
+            self.translate()
+        self.assertEqual(self.generate_content.call_count, 5)
+
+
+class GenerationStreamingTests(TestCase):
+
+    def setUp(self):
+        client_pool.pool.clear()
+        patcher = patch("ai_service.client_pool.genai.Client")
+        self.mock_client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        async def generate_content_stream(model, contents, config):
+            async def chunks():
+                for text in ("Once ", "upon ", "a time."):
+                    yield SimpleNamespace(text=text)
+            return chunks()
+
+        self.mock_client_class.return_value.aio.models.generate_content_stream = generate_content_stream
+
+    async def _read(self, response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    def test_stream_relays_chunks_and_records_the_answer(self):
+        """?stream=1 and Accept: text/event-stream should relay SSE chunks, then save the ChatRecord."""
+        for query, headers in (("?stream=1", {}), ("", {"HTTP_ACCEPT": "text/event-stream"})):
+            response = self.client.post(
+                reverse("writer") + query, {"prompt": "A story"}, content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer key", **headers,
+            )
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            body = async_to_sync(self._read)(response).decode()
+            events = [e for e in body.split("\n\n") if e]
+
+            self.assertEqual([json.loads(e[len("data: "):])["text"] for e in events[:3]], ["Once ", "upon ", "a time."])
+            self.assertTrue(events[-1].startswith("event: done"))
+            expected = json.dumps({"response": "Once upon a time."})
+            # The same body as the non-streamed WriterView reply.
+            self.assertEqual(json.loads(events[-1].split("data: ", 1)[1])["data"], {"written_text": expected})
+            self.assertEqual(ChatRecord.objects.filter(method="writer").last().response, expected)
+
+        self.assertEqual(ChatRecord.objects.filter(method="writer").count(), 2)
+        response = self.client.post(reverse("writer"), {}, content_type="application/json", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith(b"event: error"))
+
+
+class AsyncGenerationTests(TestCase):
+
+    def setUp(self):
+        client_pool.pool.clear()
+        response_cache.local.clear()
+        patcher = patch("ai_service.client_pool.genai.Client")
+        self.mock_client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.in_flight = self.most_in_flight = 0
+
+        async def generate_content(model, contents, config):
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            await asyncio.sleep(0.05)
+            self.in_flight -= 1
+            return SimpleNamespace(text='{"response": "Done"}')
+
+        self.mock_client_class.return_value.aio.models.generate_content = generate_content
+
+    def test_concurrent_generations_share_one_event_loop(self):
+        """Async generations should overlap on one thread instead of queueing behind each other."""
+        async def burst():
+            return await asyncio.gather(*(
+                agenerate_response(api_key="key", prompt=f"Prompt {i}") for i in range(20)
+            ))
+
+        started = time.monotonic()
+        results = async_to_sync(burst)()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(results, ['{"response": "Done"}'] * 20)
+        self.assertEqual(self.most_in_flight, 20)
+
+    def test_async_views_answer_and_record_history(self):
+        """Generation and history views should run as coroutine views on the async ORM."""
+        self.assertTrue(WriterView.view_is_async)
+        self.assertTrue(HistoryView.view_is_async)
+
+        response = self.client.post(
+            reverse("writer"), {"prompt": "A story"}, content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer key",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"], {"written_text": '{"response": "Done"}'})
+
+        history = self.client.get(reverse("history"), HTTP_AUTHORIZATION="Bearer key").data["data"]
+        self.assertEqual([record["method"] for record in history], ["writer"])
+
+
+    def test_document_views_run_on_the_async_client(self):
+        """Direct extraction and function-calling analysis should await Gemini like the other views."""
+        self.assertTrue(DirectExtractionView.view_is_async)
+        self.assertTrue(AnalyzeTextView.view_is_async)
+
+        upload = SimpleUploadedFile("rows.csv", b"name,total\nalpha,1\nbravo,2\n", content_type="text/csv")
+        response = self.client.post(
+            reverse("direct-extraction"), {"file": upload, "prompt": "List the totals"},
+            HTTP_AUTHORIZATION="Bearer key",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"], '{"response": "Done"}')
+
+        call = SimpleNamespace(name="classify_text", args={"category": "Finance"})
+        turns = [
+            SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(function_call=call)]))]),
+            SimpleNamespace(text="It is about finance."),
+        ]
+        self.mock_client_class.return_value.aio.models.generate_content = AsyncMock(side_effect=turns)
+        response = self.client.post(
+            reverse("analyze-text"), {"text": "Rates rose."}, content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer key",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"]["natural_language_response"], "It is about finance.")
+        self.assertEqual(response.data["data"]["function_data"]["status"], "success")
+        self.assertEqual(
+            [r.method for r in ChatRecord.objects.order_by("id")], ["direct_extraction", "analyze_text"]
+        )
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.flights = single_flight.SingleFlight()
+        self.before = single_flight.stats.as_dict()
+
+    def stats_delta(self, field):
+        return single_flight.stats.as_dict()[field] - self.before[field]
+
+    def wait_for_followers(self, key, count):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with self.flights.lock:
+                call = self.flights.calls.get(key)
+                if call is not None and call.followers >= count:
+                    return
+            time.sleep(0.001)
+        self.fail(f"{count} followers never joined {key}")
+
+    def test_threads_share_one_call_and_its_errors(self):
+        """Concurrent identical calls from threads should reach upstream once and share the outcome."""
+        release = threading.Event()
+        upstream = []
+
+        def generate(outcome):
+            upstream.append(outcome)
+            release.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        for key, outcome in (("answer", "shared"), ("failure", ValueError("quota exceeded"))):
+            release.clear()
+            results = []
+
+            def call():
+                try:
+                    results.append(self.flights.do(key, lambda: generate(outcome)))
+                except ValueError as e:
+                    results.append(e)
+
+            threads = [threading.Thread(target=call) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            self.wait_for_followers(key, 7)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(results, [outcome] * 8)
+
+        self.assertEqual(len(upstream), 2)
+        self.assertEqual(self.stats_delta("coalesced"), 14)
+        self.assertEqual(self.stats_delta("failures"), 1)
+        self.assertEqual(self.flights.calls, {})
+
+        with override_settings(GEMINI_COALESCE_REQUESTS=False):
+            self.flights.do("answer", lambda: generate("fresh"))
+        self.assertEqual(len(upstream), 3)
+
+    def test_tasks_and_threads_share_calls_and_survive_leader_cancellation(self):
+        """Async followers and a thread should get the answer even if the leading task is cancelled."""
+        upstream = []
+        thread_result = []
+
+        async def generate():
+            upstream.append(1)
+            await asyncio.sleep(0.1)
+            return "shared"
+
+        async def scenario():
+            leader = asyncio.ensure_future(self.flights.ado("key", generate))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(self.flights.ado("key", generate)) for _ in range(5)]
+            other = asyncio.ensure_future(self.flights.ado("other", generate))
+            thread = threading.Thread(target=lambda: thread_result.append(self.flights.do("key", lambda: "own")))
+            thread.start()
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            results = await asyncio.gather(*followers, other)
+            await asyncio.to_thread(thread.join, 5)
+            return leader, results
+
+        leader, results = async_to_sync(scenario)()
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(results, ["shared"] * 6)
+        self.assertEqual(thread_result, ["shared"])
+        self.assertEqual(len(upstream), 2)
+        self.assertEqual(self.stats_delta("coalesced"), 6)
+
+    def test_cancelled_followers_stop_waiting(self):
+        """Cancelled followers should leave the call, so the upstream call ends once nobody waits."""
+        cancelled = []
+
+        async def generate():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "shared"
+
+        async def scenario(leader_first):
+            leader = asyncio.ensure_future(self.flights.ado("key", generate))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.flights.ado("key", generate))
+            await asyncio.sleep(0)
+            call = self.flights.calls["key"]
+            first, second = (leader, follower) if leader_first else (follower, leader)
+            first.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(cancelled, [])
+            self.assertEqual(call.followers, 1 if leader_first else 0)
+            second.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual((call.followers, call.waiters), (0, []))
+            return leader, follower
+
+        for leader_first in (True, False):
+            cancelled.clear()
+            leader, follower = async_to_sync(scenario)(leader_first)
+            self.assertTrue(leader.cancelled() and follower.cancelled())
+            self.assertEqual(cancelled, [1])
+            self.assertEqual(self.flights.calls, {})
+
+    @patch("ai_service.client_pool.genai.Client")
+    def test_identical_generations_are_coalesced_per_api_key(self, mock_client_class):
+        """Concurrent agenerate_response calls should share upstream calls only within one API key."""
+        client_pool.pool.clear()
+        calls = []
+
+        async def generate_content(model, contents, config):
+            calls.append(contents)
+            await asyncio.sleep(0.05)
+            return SimpleNamespace(text='{"response": "Done"}')
+
+        mock_client_class.return_value.aio.models.generate_content = generate_content
+
+        async def burst():
+            return await asyncio.gather(*(
+                agenerate_response(api_key=api_key, prompt="Same prompt")
+                for api_key in ["a"] * 5 + ["b"] * 5
+            ))
+
+        self.assertEqual(async_to_sync(burst)(), ['{"response": "Done"}'] * 10)
+        self.assertEqual(len(calls), 2)
+
+
+def _fake_embeddings(texts, dim=8):
+    """Deterministic stand-in for Gemini embeddings, one vector per text."""
+    embeddings = []
+    for text in texts:
+        rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+        embeddings.append(SimpleNamespace(values=rng.random(dim).tolist()))
+    return SimpleNamespace(embeddings=embeddings)
+
+
+class RAGIndexSharedTests(TestCase):
+
+    def setUp(self):
+        _registry.clear()
+        # Nothing left for the shutdown snapshot flush once the index dir is gone.
+        self.addCleanup(_registry.clear)
+        _chunk_text_cache.clear()
+        embedding_cache.query_cache.clear()
+        answer_cache.answer_cache.clear()
+        index_dir = self.enterContext(tempfile.TemporaryDirectory())
+        # Chunk-level tests; the MMR and span-merging stage is tested on its own.
+        self.enterContext(override_settings(
+            RAG_INDEX_DIR=index_dir, RAG_MMR_LAMBDA=1.0, RAG_MERGE_ADJACENT_CHUNKS=False
+        ))
+        client_pool.pool.clear()
+        patcher = patch("ai_service.client_pool.genai.Client")
+        self.mock_client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_client_class.return_value.models.embed_content.side_effect = (
+            lambda model, contents, config: _fake_embeddings(contents)
+        )
+        self.mock_client_class.return_value.aio.models.embed_content = AsyncMock(
+            side_effect=lambda model, contents, config: _fake_embeddings(contents)
+        )
+        self.text = " ".join(f"sentence number {i} about retrieval." for i in range(40))
+
+    def test_index_is_shared_and_appended_in_place(self):
+        """add_document should append to the worker's index instead of rebuilding it."""
+        first = RAGIndex(api_key="key")
+        first.add_document("a.pdf", self.text)
+        faiss_index = first.faiss_index
+        added = faiss_index.ntotal
+
+        first.add_document("b.pdf", self.text + " more")
+
+        second = RAGIndex(api_key="key")
+        self.assertIs(second.faiss_index, faiss_index)
+        self.assertEqual(faiss_index.ntotal, RagChunk.objects.count())
+        self.assertGreater(faiss_index.ntotal, added)
+
+    def test_rows_written_elsewhere_are_picked_up(self):
+        """A bumped corpus version should pull in rows another worker wrote."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        faiss_index = rag_index.faiss_index
+        before = faiss_index.ntotal
+
+        chunk = RagChunk.objects.create(
+            namespace=namespace_for("key"),
+            source="other.pdf",
+            text="written elsewhere",
+            embedding=np.full(8, 0.5, dtype=np.float32).tobytes(),
+        )
+        _bump_corpus_version(namespace_for("key"))
+
+        rag_index = RAGIndex(api_key="key")
+        self.assertIs(rag_index.faiss_index, faiss_index)
+        self.assertEqual(faiss_index.ntotal, before + 1)
+        self.assertEqual(int(rag_index.shared.ids[-1]), chunk.id)
+
+    @override_settings(RAG_EMBED_BATCH_MAX_ITEMS=1)
+    def test_ingest_rows_stay_hidden_until_published(self):
+        """Another sync mid-ingest should not index the batches written so far."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        seen = []
+
+        def progress(embedded, written):
+            # An unrelated change makes every worker sync.
+            _bump_corpus_version(namespace_for("key"))
+            seen.append(len(RAGIndex(api_key="key").shared.ids))
+            self.assertTrue(RagChunk.objects.filter(pending=True).exists())
+
+        before = len(rag_index.shared.ids)
+        added = rag_index.add_pages("b.pdf", [self.text + " more"], replace=True, progress=progress)
+
+        self.assertGreater(len(seen), 1)
+        self.assertEqual(set(seen), {before})
+        self.assertFalse(RagChunk.objects.filter(pending=True).exists())
+        self.assertEqual(len(RAGIndex(api_key="key").shared.ids), before + added)
+
+    @override_settings(RAG_EMBEDDING_DTYPE="float16")
+    def test_embeddings_stored_as_packed_bytes(self):
+        """Chunks should be bulk-written as raw vectors in the configured dtype."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+
+        chunk = RagChunk.objects.first()
+        self.assertEqual(chunk.embedding_dtype, "float16")
+        self.assertEqual(len(chunk.embedding), 8 * 2)
+        self.assertEqual(rag_index.faiss_index.ntotal, RagChunk.objects.count())
+
+    def test_startup_uses_snapshot_until_table_changes(self):
+        """A fresh worker should memory-map the snapshot, and rebuild once it is stale."""
+        RAGIndex(api_key="key").add_document("a.pdf", self.text)
+        expected = RagChunk.objects.count()
+
+        _registry.clear()
+        rag_index = RAGIndex(api_key="key")
+        self.assertTrue(rag_index.shared.mmapped)
+        self.assertEqual(rag_index.faiss_index.ntotal, expected)
+        self.assertEqual(len(rag_index.retrieve_documents("retrieval", k=2)), 2)
+
+        rag_index.add_document("b.pdf", self.text + " appended")
+        self.assertFalse(rag_index.shared.mmapped)
+        expected = RagChunk.objects.count()
+        self.assertEqual(rag_index.faiss_index.ntotal, expected)
+
+        RagChunk.objects.create(
+            namespace=namespace_for("key"),
+            source="other.pdf",
+            text="unsnapshotted",
+            embedding=np.full(8, 0.5, dtype=np.float32).tobytes(),
+        )
+        _registry.clear()
+        rag_index = RAGIndex(api_key="key")
+        self.assertFalse(rag_index.shared.mmapped)
+        self.assertEqual(rag_index.faiss_index.ntotal, expected + 1)
+
+    @override_settings(RAG_INDEX_TYPE="ivf_flat", RAG_IVF_NPROBE=4)
+    def test_ivf_index_is_trained_on_ingest(self):
+        """IVF types should be trained on the first batch and keep serving queries."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+
+        self.assertEqual(index_type_of(rag_index.faiss_index), "ivf_flat")
+        self.assertTrue(rag_index.faiss_index.is_trained)
+        self.assertEqual(len(rag_index.retrieve_documents("retrieval", k=2)), 2)
+
+    def test_auto_policy_scales_with_corpus_size(self):
+        self.assertEqual(choose_index_type(1_000), "flat")
+        self.assertEqual(choose_index_type(100_000), "hnsw")
+        self.assertEqual(choose_index_type(1_000_000), "ivf_flat")
+        self.assertEqual(choose_index_type(10_000_000), "ivf_pq")
+
+    def test_namespaces_are_isolated(self):
+        """Each API key should search, replace and delete only its own chunks."""
+        tenant_a = RAGIndex(api_key="key-a")
+        tenant_b = RAGIndex(api_key="key-b")
+        tenant_a.add_document("a.pdf", self.text)
+        tenant_b.add_document("b.pdf", self.text + " tenant b")
+        b_count = RagChunk.objects.filter(namespace=namespace_for("key-b")).count()
+
+        self.assertIsNot(tenant_a.shared, tenant_b.shared)
+        self.assertEqual(tenant_b.faiss_index.ntotal, b_count)
+
+        tenant_a.add_document("a.pdf", self.text[:400], replace=True)
+        tenant_a = RAGIndex(api_key="key-a")
+        a_chunks = RagChunk.objects.filter(namespace=namespace_for("key-a"))
+        self.assertEqual(tenant_a.faiss_index.ntotal, a_chunks.count())
+        self.assertTrue(all(c.source == "a.pdf" for c in a_chunks))
+
+        tenant_a.delete_all_chunks()
+        self.assertEqual(RagChunk.objects.filter(namespace=namespace_for("key-b")).count(), b_count)
+
+    @override_settings(RAG_INDEX_MEMORY_BUDGET_MB=0)
+    def test_least_recently_used_namespace_is_evicted(self):
+        RAGIndex(api_key="key-a").add_document("a.pdf", self.text)
+        RAGIndex(api_key="key-b").add_document("b.pdf", self.text)
+
+        self.assertNotIn(namespace_for("key-a"), _registry.indexes)
+        self.assertIn(namespace_for("key-b"), _registry.indexes)
+        self.assertGreater(RAGIndex(api_key="key-a").faiss_index.ntotal, 0)
+
+    def test_unchanged_chunks_are_not_re_embedded(self):
+        """Re-ingesting the same text should be served from the embedding cache."""
+        embed_content = self.mock_client_class.return_value.models.embed_content
+        RAGIndex(api_key="key-a").add_document("a.pdf", self.text)
+        calls = embed_content.call_count
+
+        RAGIndex(api_key="key-b").add_document("a.pdf", self.text)
+
+        self.assertEqual(embed_content.call_count, calls)
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), RagChunk.objects.filter(namespace=namespace_for("key-a")).count())
+
+    @override_settings(RAG_EMBED_BATCH_MAX_ITEMS=3, RAG_EMBED_RETRY_BACKOFF=0)
+    def test_embedding_batches_keep_order_and_retry_individually(self):
+        """Batches should respect the item limit, keep input order and retry on their own."""
+        texts = [f"text {i}" for i in range(10)]
+        failed = set()
+
+        def embed_batch(batch):
+            if batch[0] == "text 3" and "text 3" not in failed:
+                failed.add("text 3")
+                raise httpx.ConnectError("transient")
+            if batch[0] == "text 6" and "text 6" not in failed:
+                failed.add("text 6")
+                raise genai_errors.ServerError(503, {"error": {"status": "UNAVAILABLE"}})
+            self.assertLessEqual(len(batch), 3)
+            return [[float(t.split()[1])] for t in batch]
+
+        vectors = embed_in_batches(texts, embed_batch)
+
+        self.assertEqual(vectors[:, 0].tolist(), [float(i) for i in range(10)])
+        self.assertEqual(failed, {"text 3", "text 6"})
+
+        # Bad requests and programming errors fail at once.
+        for error in (genai_errors.ClientError(400, {"error": {"status": "INVALID_ARGUMENT"}}), KeyError("values")):
+            calls = []
+
+            def broken(batch):
+                calls.append(batch)
+                raise error
+
+            with self.assertRaises(type(error)):
+                embed_in_batches(["text"], broken)
+            self.assertEqual(len(calls), 1)
+
+    def test_chunker_keeps_sentences_whole_and_the_tail(self):
+        """Chunks should break between sentences, across pages, without dropping the tail."""
+        pages = [
+            "Alpha sentence one. Alpha sentence two spans the",
+            "page break here. " + " ".join(f"Filler sentence {i}." for i in range(30)),
+            "Final short tail.",
+        ]
+        chunks = list(iter_chunks(pages, chunk_tokens=40, overlap_tokens=8, min_tokens=8))
+
+        self.assertIn("Alpha sentence two spans the page break here.", chunks[0])
+        self.assertTrue(chunks[-1].endswith("Final short tail."))
+        self.assertTrue(all(c.endswith(".") for c in chunks))
+        self.assertTrue(all(estimate_tokens(c) <= 40 for c in chunks[:-1]))
+        self.assertLessEqual(estimate_tokens(chunks[-1]), 40 + 8)
+
+    def test_lexical_mode_matches_identifiers_without_embedding(self):
+        """Lexical retrieval should find exact identifiers locally, also after a snapshot load."""
+        embed_content = self.mock_client_class.return_value.models.embed_content
+        RAGIndex(api_key="key").add_document("a.pdf", self.text + " Invoice INV-2024-0042 was paid.")
+        calls = embed_content.call_count
+
+        _registry.clear()
+        rag_index = RAGIndex(api_key="key")
+        self.assertTrue(rag_index.shared.mmapped)
+        results = rag_index.retrieve_documents("inv-2024-0042", k=1, mode="lexical")
+
+        self.assertEqual(len(results), 1)
+        self.assertIn("INV-2024-0042", results[0])
+        self.assertEqual(embed_content.call_count, calls)
+
+        hybrid = rag_index.retrieve_documents("inv-2024-0042", k=2, mode="hybrid")
+        self.assertTrue(any("INV-2024-0042" in chunk for chunk in hybrid))
+
+    def test_filters_restrict_search_to_matching_chunks(self):
+        """Filtered searches should fill k from matching chunks only, in every mode."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text, metadata={"lang": "en"})
+        rag_index.add_document("b.pdf", self.text + " extra", metadata={"lang": "de"})
+        b_texts = set(RagChunk.objects.filter(source="b.pdf").values_list("text", flat=True))
+
+        for mode in ("dense", "lexical", "hybrid"):
+            results = rag_index.retrieve_documents(
+                "retrieval", k=2, mode=mode, filters={"metadata": {"lang": "de"}}
+            )
+            self.assertEqual(len(results), 2)
+            self.assertTrue(set(results) <= b_texts)
+
+        self.assertEqual(
+            rag_index.retrieve_documents("retrieval", k=2, filters={"source": "missing.pdf"}), []
+        )
+        self.assertEqual(
+            rag_index.retrieve_documents(
+                "retrieval", k=2, filters={"created_before": "2000-01-01T00:00:00Z"}
+            ),
+            [],
+        )
+        with self.assertRaises(ValueError):
+            rag_index.retrieve_documents("retrieval", filters={"colour": "red"})
+        for source in (5, ["a.pdf", 1], {"a.pdf": True}):
+            with self.assertRaises(ValueError):
+                rag_index.retrieve_documents("retrieval", filters={"source": source})
+            response = self.client.post(
+                reverse("rag-chat"),
+                {"prompt": "retrieval", "filters": {"source": source}},
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer key",
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_retrieved_texts_are_fetched_lazily_and_cached(self):
+        """Texts should come from one id__in query, then from the hot-chunk cache."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        with rag_index.shared.lock:
+            rag_index._lexical_index()
+
+        with self.assertNumQueries(1):
+            first = rag_index.retrieve_documents("retrieval", k=2, mode="lexical")
+        with self.assertNumQueries(0):
+            second = rag_index.retrieve_documents("retrieval", k=2, mode="lexical")
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(first, second)
+        self.assertFalse(hasattr(rag_index.shared, "documents"))
+
+    def test_cold_load_does_not_read_chunk_texts(self):
+        """A cold load should read plain index columns, leaving chunk texts in the database."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        rag_index.add_document("b.pdf", self.text + " more")
+        expected = sorted(RagChunk.objects.values_list("id", flat=True))
+
+        with override_settings(RAG_BULK_CREATE_BATCH_SIZE=2), CaptureQueriesContext(connection) as queries:
+            rag_index.load_data(from_snapshot=False)
+
+        self.assertEqual(sorted(rag_index.shared.ids.tolist()), expected)
+        selects = [q["sql"] for q in queries.captured_queries if '"core_ragchunk"."embedding"' in q["sql"]]
+        self.assertTrue(selects)
+        self.assertFalse(any('"core_ragchunk"."text"' in sql for sql in selects))
+        self.assertEqual(rag_index.retrieve_documents("sentence number 3", k=1, mode="dense")[0][:8], "sentence")
+
+    def test_bm25_is_built_on_first_lexical_search_in_flat_arrays(self):
+        """Dense retrieval should never build BM25; the lexical index should match a fresh build."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        rag_index.add_document("b.pdf", "Invoice INV-2024-0042 was paid in full.")
+        rag_index.retrieve_documents("retrieval", k=2, mode="dense")
+        self.assertIsNone(rag_index.shared.bm25)
+
+        hits = rag_index.retrieve_documents("inv-2024-0042", k=1, mode="lexical")
+        self.assertEqual(hits, ["Invoice INV-2024-0042 was paid in full."])
+        bm25 = rag_index.shared.bm25
+        self.assertEqual(len(bm25), RagChunk.objects.count())
+
+        # Later changes update the built index in place.
+        rag_index.remove_document("b.pdf")
+        rag_index.add_document("c.pdf", "Another invoice, INV-2024-0043.")
+        self.assertIs(rag_index.shared.bm25, bm25)
+        fresh = BM25Index()
+        rows = list(RagChunk.objects.values_list("id", "text"))
+        fresh.add([i for i, _ in rows], [t for _, t in rows])
+        for query in ("retrieval", "inv-2024-0042", "inv-2024-0043 sentence"):
+            self.assertEqual(bm25.search(query, 5), fresh.search(query, 5))
+
+        arrays = (bm25.indptr, bm25.rows, bm25.tfs, bm25.doc_ids, bm25.doc_lengths)
+        self.assertEqual(bm25.memory_bytes(), sum(a.nbytes for a in arrays) + bm25.vocabulary_bytes)
+        self.assertEqual(len(bm25.rows), len(bm25.tfs))
+        self.assertEqual(bm25.rows.dtype, np.int32)
+
+        # Another worker loads the saved index instead of re-tokenizing.
+        _registry.flush_snapshots()
+        _registry.clear()
+        reloaded = RAGIndex(api_key="key")
+        with self.assertNumQueries(0):
+            with reloaded.shared.lock:
+                self.assertEqual(reloaded._lexical_index().search("retrieval", 5), fresh.search("retrieval", 5))
+
+    def test_retrieve_many_embeds_queries_in_one_call(self):
+        """Several queries should share one embedding call and return their own scored hits."""
+        embed_content = self.mock_client_class.return_value.models.embed_content
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        calls = embed_content.call_count
+
+        queries = ["retrieval", "chunking"]
+        results = rag_index.retrieve_many(queries, k=2, mode="dense")
+
+        self.assertEqual(embed_content.call_count, calls + 1)
+        self.assertEqual(embed_content.call_args.kwargs["contents"], queries)
+        self.assertEqual(len(results), 2)
+        for query, hits in zip(queries, results):
+            self.assertEqual(len(hits), 2)
+            self.assertGreaterEqual(hits[0]["score"], hits[1]["score"])
+            self.assertEqual([hit["text"] for hit in hits], rag_index.retrieve_documents(query, k=2, mode="dense"))
+
+        url = reverse("rag-retrieve-batch")
+        response = self.client.post(
+            url, {"queries": queries, "k": 1}, content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer key",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["query"] for item in response.data["data"]], queries)
+        response = self.client.post(url, {"queries": []}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url, {"queries": queries, "k": settings.RAG_BATCH_MAX_K + 1}, content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer key",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # A k far beyond the corpus is clamped to what the index holds.
+        for mode in ("dense", "lexical", "hybrid"):
+            hits = rag_index.retrieve_many(queries, k=10 ** 9, mode=mode)
+            self.assertTrue(all(len(h) <= RagChunk.objects.count() for h in hits))
+
+    def test_repeated_queries_skip_the_embedding_call(self):
+        """Repeat questions should reuse the cached query vector until its TTL runs out."""
+        embed_content = self.mock_client_class.return_value.models.embed_content
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        calls = embed_content.call_count
+        before = embedding_cache.query_stats.as_dict()
+
+        first = rag_index.retrieve_documents("What is retrieval?", k=2, mode="dense")
+        second = rag_index.retrieve_documents("  what is   RETRIEVAL? ", k=2, mode="dense")
+
+        self.assertEqual(first, second)
+        self.assertEqual(embed_content.call_count, calls + 1)
+        after = embedding_cache.query_stats.as_dict()
+        self.assertEqual(after["hits"] - before["hits"], 1)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+
+        with override_settings(RAG_QUERY_CACHE_TTL=0):
+            embedding_cache.query_cache.clear()
+            rag_index.retrieve_documents("What is retrieval?", k=2, mode="dense")
+            rag_index.retrieve_documents("What is retrieval?", k=2, mode="dense")
+        self.assertEqual(embed_content.call_count, calls + 3)
+
+    @patch("core.views.agenerate_response", new_callable=AsyncMock, return_value="Cached answer.")
+    def test_rag_chat_reuses_answers_until_the_corpus_changes(self, mock_generate_response):
+        """Paraphrases above the similarity threshold should skip the LLM until the corpus version moves."""
+        # Paraphrases embed at a set cosine similarity to the first question,
+        # just either side of RAG_ANSWER_CACHE_THRESHOLD (0.95).
+        base, other = np.eye(8)[0], np.eye(8)[1]
+        questions = {
+            "What is retrieval?": base,
+            "Could you explain retrieval?": 0.96 * base + np.sqrt(1 - 0.96 ** 2) * other,
+            "How does retrieval work?": 0.94 * base + np.sqrt(1 - 0.94 ** 2) * other,
+        }
+
+        def embed(model, contents, config):
+            if contents[0] in questions:
+                return SimpleNamespace(embeddings=[SimpleNamespace(values=questions[contents[0]].tolist())])
+            return _fake_embeddings(contents)
+
+        self.mock_client_class.return_value.models.embed_content.side_effect = embed
+        self.mock_client_class.return_value.aio.models.embed_content.side_effect = embed
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        url = reverse("rag-chat")
+
+        def ask(prompt, **extra):
+            return self.client.post(
+                url, {"prompt": prompt, **extra}, content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer key",
+            )
+
+        with override_settings(RAG_ANSWER_CACHE_THRESHOLD=0.95):
+            self.assertEqual(ask("What is retrieval?").data["data"], "Cached answer.")
+            self.assertEqual(ask("Could you explain retrieval?").data["data"], "Cached answer.")
+            self.assertEqual(mock_generate_response.call_count, 1)
+            miss, hit = ChatRecord.objects.filter(method="rag_chat").order_by("id")
+            self.assertEqual(hit.prompt, miss.prompt.replace("What is retrieval?", "Could you explain retrieval?"))
+            # Only chunk ids are cached; the hit's prompt is rebuilt from them.
+            (cached,) = answer_cache.answer_cache.entries.values()
+            indexed = set(RagChunk.objects.values_list("id", flat=True))
+            self.assertTrue(cached.spans)
+            self.assertTrue(all(set(ids) <= indexed for ids in cached.spans))
+
+            ask("How does retrieval work?")
+            self.assertEqual(mock_generate_response.call_count, 2)
+        mock_generate_response.reset_mock()
+
+        # Lexical questions are never embedded, so they never hit the cache.
+        embed_content = self.mock_client_class.return_value.aio.models.embed_content
+        embeds = embed_content.call_count
+        ask("What is retrieval?", mode="lexical")
+        ask("What is retrieval?", mode="lexical")
+        self.assertEqual(mock_generate_response.call_count, 2)
+        self.assertEqual(embed_content.call_count, embeds)
+
+        rag_index.add_document("b.pdf", "A new document about something else entirely.")
+        ask("What is retrieval?")
+        self.assertEqual(mock_generate_response.call_count, 3)
+
+    def test_mmr_skips_near_duplicates_and_neighbours_merge_into_spans(self):
+        """MMR should trade a near-duplicate for a new chunk; neighbouring chunks become one span."""
+        query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        vectors = np.array([[1.0, 0.0, 0.0], [0.99, 0.14, 0.0], [0.6, 0.0, 0.8]], dtype=np.float32)
+        self.assertEqual(list(mmr_order(query, vectors, 1.0)), [0, 1, 2])
+        self.assertEqual(list(mmr_order(query, vectors, 0.3)), [0, 2, 1])
+
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        rag_index.add_document("b.pdf", "A separate note about a different topic.")
+        chunk_ids = list(RagChunk.objects.filter(source="a.pdf").order_by("id").values_list("id", flat=True))
+
+        with override_settings(RAG_MERGE_ADJACENT_CHUNKS=True, RAG_MMR_LAMBDA=0.7):
+            hits = rag_index.retrieve_many(["retrieval"], k=3, mode="dense")[0]
+
+        self.assertEqual(len(hits), 2)
+        span = next(hit for hit in hits if len(hit["ids"]) > 1)
+        self.assertEqual(span["ids"], chunk_ids)
+        self.assertEqual(span["text"], self.text)
+
+        # k caps the chunks returned, however many of them merge into one span.
+        long_text = " ".join(f"Sentence number {i} about retrieval." for i in range(400))
+        rag_index.add_document("c.pdf", long_text)
+        with override_settings(RAG_MERGE_ADJACENT_CHUNKS=True):
+            for mode in ("lexical", "dense", "hybrid"):
+                hits = rag_index.retrieve_many(["retrieval"], k=3, mode=mode)[0]
+                self.assertLessEqual(sum(len(hit["ids"]) for hit in hits), 3)
+
+    def test_pages_stream_through_the_pipeline_and_failures_roll_back(self):
+        """Pages should be consumed lazily in batches; a failed ingest should leave nothing behind."""
+        self.assertEqual(list(staged(iter(range(50)), lambda items: (i * 2 for i in items))), list(range(0, 100, 2)))
+
+        def broken(items):
+            for item in items:
+                if item == 3:
+                    raise ValueError("bad page")
+                yield item
+
+        with self.assertRaisesMessage(ValueError, "bad page"):
+            list(staged(iter(range(10)), broken))
+
+        pages = [f"Page {p} is about streaming ingestion." for p in range(30)]
+        with override_settings(RAG_EMBED_BATCH_MAX_ITEMS=2, RAG_CHUNK_TOKENS=8, RAG_CHUNK_OVERLAP_TOKENS=0, RAG_CHUNK_MIN_TOKENS=1):
+            rag_index = RAGIndex(api_key="key")
+            added = rag_index.add_pages("stream.pdf", iter(pages))
+            self.assertEqual(added, RagChunk.objects.filter(source="stream.pdf").count())
+            self.assertGreater(added, 2)
+            self.assertEqual(rag_index.faiss_index.ntotal, added)
+
+            embed_content = self.mock_client_class.return_value.models.embed_content
+            calls = []
+
+            def fail_on_third_batch(model, contents, config):
+                calls.append(contents)
+                if len(calls) == 3:
+                    raise ValueError("quota")
+                return _fake_embeddings(contents)
+
+            embed_content.side_effect = fail_on_third_batch
+            with override_settings(RAG_EMBED_MAX_RETRIES=0), self.assertRaises(Exception):
+                rag_index.add_pages("broken.pdf", iter(p + " again" for p in pages))
+
+        self.assertFalse(RagChunk.objects.filter(source="broken.pdf").exists())
+        self.assertEqual(rag_index.faiss_index.ntotal, added)
+
+    def test_pdf_upload_is_ingested_by_the_worker_with_progress(self):
+        """pdf-upload should return 202 and a job that the worker runs, reports on and can cancel."""
+        self.enterContext(override_settings(MEDIA_ROOT=settings.RAG_INDEX_DIR))
+        pages = [f"Page {p} of the quarterly report about retrieval." for p in range(5)]
+        headers = {"HTTP_AUTHORIZATION": "Bearer key"}
+
+        upload = lambda: self.client.post(
+            reverse("pdf-upload"), {"file": SimpleUploadedFile("report.pdf", b"%PDF-1.4 stub")}, **headers
+        )
+        response = upload()
+        queued = upload()
+        self.assertEqual(response.status_code, 202)
+        paths = [IngestionJob.objects.get(id=r.data["job_id"]).file_path for r in (response, queued)]
+        self.assertNotEqual(paths[0], paths[1])
+        for path in paths:
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(os.path.basename(os.path.dirname(path)), namespace_for("key"))
+        job_url = reverse("rag-job", args=[response.data["job_id"]])
+        self.assertEqual(self.client.get(job_url, **headers).data["data"]["status"], "queued")
+        self.assertEqual(self.client.get(job_url).status_code, 404)
+
+        cancel_url = reverse("rag-job-cancel", args=[queued.data["job_id"]])
+        self.assertEqual(self.client.post(cancel_url, **headers).data["data"]["status"], "cancelled")
+        self.assertFalse(os.path.exists(paths[1]))
+
+        with patch("rag_service.jobs.iter_pdf_pages", return_value=iter(pages)):
+            call_command("rag_ingest_worker", "--once", stdout=StringIO())
+
+        job = self.client.get(job_url, **headers).data["data"]
+        self.assertEqual(job["status"], "succeeded")
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertEqual(job["pages_parsed"], len(pages))
+        self.assertEqual(job["chunks_indexed"], RagChunk.objects.filter(source="report.pdf").count())
+        self.assertGreater(job["chunks_indexed"], 0)
+        self.assertEqual(IngestionJob.objects.get(id=queued.data["job_id"]).pages_parsed, 0)
+        self.assertEqual(self.client.post(cancel_url, **headers).status_code, 409)
+
+    def test_worker_survives_database_errors(self):
+        """The worker should refresh its connection each iteration and log errors instead of exiting."""
+        from django.db.utils import OperationalError
+        worker = "core.management.commands.rag_ingest_worker"
+        with patch(f"{worker}.close_old_connections") as close_old, \
+                patch(f"{worker}.time.sleep") as sleep, \
+                patch("rag_service.jobs.claim_next", side_effect=[OperationalError("server closed"), None]), \
+                self.assertLogs(worker, level="ERROR") as logs:
+            call_command("rag_ingest_worker", "--once", stdout=StringIO())
+
+        self.assertEqual(close_old.call_count, 2)
+        sleep.assert_called_once()
+        self.assertIn("server closed", logs.output[0])
+
+    def test_jobs_of_a_dead_worker_are_reclaimed(self):
+        """Running jobs without a recent heartbeat should be requeued, cancelled or failed."""
+        self.enterContext(override_settings(MEDIA_ROOT=settings.RAG_INDEX_DIR))
+        pages = [f"Page {p} of the quarterly report about retrieval." for p in range(3)]
+        stale = lambda: timezone.now() - timedelta(seconds=settings.RAG_INGEST_LEASE_SECONDS + 1)
+
+        def enqueue():
+            path = jobs.save_upload("key", SimpleUploadedFile("report.pdf", b"%PDF-1.4 stub"))
+            return jobs.enqueue("key", "report.pdf", path)
+
+        cancelled = enqueue()
+        jobs.claim_next()
+        IngestionJob.objects.filter(id=cancelled.id).update(heartbeat_at=stale())
+        self.assertTrue(jobs.cancel(cancelled))
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, "cancelled")
+        self.assertFalse(os.path.exists(cancelled.file_path))
+
+        job = enqueue()
+        first = jobs.claim_next()
+        IngestionJob.objects.filter(id=job.id).update(heartbeat_at=stale())
+        second = jobs.claim_next()
+        self.assertEqual((second.id, second.attempts), (job.id, 2))
+
+        with patch("rag_service.jobs.iter_pdf_pages", side_effect=lambda f: iter(pages)):
+            self.assertEqual(jobs.run(first).status, "running")
+            self.assertTrue(os.path.exists(job.file_path))
+            self.assertEqual(jobs.run(second).status, "succeeded")
+
+        with override_settings(RAG_INGEST_MAX_ATTEMPTS=1):
+            doomed = enqueue()
+            jobs.claim_next()
+            IngestionJob.objects.filter(id=doomed.id).update(heartbeat_at=stale())
+            self.assertIsNone(jobs.claim_next())
+        doomed.refresh_from_db()
+        self.assertEqual(doomed.status, "failed")
+
+    def test_gemini_clients_are_pooled_per_api_key(self):
+        """Requests with the same key should share one client until it idles out or is evicted."""
+        first = RAGIndex(api_key="key")
+        second = RAGIndex(api_key="key")
+        self.assertIs(first.client, second.client)
+        self.assertIs(client_pool.get_async_client("key"), first.client.aio)
+        self.assertEqual(self.mock_client_class.call_count, 1)
+
+        with override_settings(GEMINI_CLIENT_POOL_SIZE=1):
+            client_pool.get_client("other")
+            client_pool.get_client("key")
+        self.assertEqual(self.mock_client_class.call_count, 3)
+
+        with override_settings(GEMINI_CLIENT_IDLE_SECONDS=0):
+            client_pool.get_client("key")
+        self.assertEqual(self.mock_client_class.call_count, 4)
+
+    def test_clients_leaving_the_pool_are_closed(self):
+        """Evicted, idled-out and cleared clients should close their sync and async HTTP clients."""
+        from google.genai.client import Client as GenaiClient
+        self.mock_client_class.side_effect = GenaiClient
+
+        def transports(client):
+            return client._api_client._httpx_client, client._api_client._async_httpx_client
+
+        with override_settings(GEMINI_CLIENT_POOL_SIZE=1):
+            evicted = transports(client_pool.get_client("key"))
+            expired = transports(client_pool.get_client("other"))
+
+        async def checkout():
+            # Expiry inside a running event loop, as in the async views.
+            client = client_pool.get_client("key")
+            await asyncio.sleep(0.01)
+            return client
+
+        with override_settings(GEMINI_CLIENT_IDLE_SECONDS=0):
+            cleared = transports(async_to_sync(checkout)())
+        client_pool.pool.clear()
+
+        for sync_client, async_client in (evicted, expired, cleared):
+            self.assertTrue(sync_client.is_closed)
+            self.assertTrue(async_client.is_closed)
+
+    def assert_ids_resolve(self, rag_index):
+        """Every live chunk's own vector should come back under its RagChunk id."""
+        shared = rag_index.shared
+        live = sorted(RagChunk.objects.values_list("id", flat=True))
+        self.assertEqual(sorted(shared.ids.tolist()), live)
+        vectors = _stored_vectors(live)
+        index_factory.configure_search(shared.faiss_index, ef_search=1024, nprobe=1024)
+        try:
+            params = None
+            if len(shared.tombstones):
+                params, keepalive = index_factory.filtered_search_parameters(
+                    shared.faiss_index, excluded=shared.tombstones
+                )
+            _, found = shared.faiss_index.search(np.vstack([vectors[i] for i in live]), 1, params=params)
+        finally:
+            index_factory.configure_search(shared.faiss_index)
+        self.assertEqual(found[:, 0].tolist(), live)
+
+    def test_remove_and_replace_touch_only_that_document(self):
+        """Documents should be removed or replaced in place, for deletable, IVF and HNSW indexes."""
+        def document(name, sentences=40):
+            return " ".join(f"{name} sentence number {i} about retrieval." for i in range(sentences))
+
+        cases = [("flat", "none"), ("hnsw", "none"), ("ivf_flat", "none"), ("ivf_pq", "none"), ("ivf_flat", "pq")]
+        for index_type, codec in cases:
+            # Sentence-sized chunks, so IVF indexes get several inverted lists.
+            with self.subTest(index_type=index_type, codec=codec), override_settings(
+                RAG_INDEX_TYPE=index_type, RAG_VECTOR_CODEC=codec, RAG_TOMBSTONE_REBUILD_RATIO=1.0,
+                RAG_CHUNK_TOKENS=12, RAG_CHUNK_OVERLAP_TOKENS=0, RAG_CHUNK_MIN_TOKENS=1,
+            ):
+                _registry.clear()
+                RagChunk.objects.all().delete()
+                rag_index = RAGIndex(api_key="key")
+                rag_index.add_document("a.pdf", document("Alpha", sentences=120))
+                rag_index.add_document("b.pdf", document("Bravo", sentences=20) + " Bravo quarterly revenue.")
+                rag_index.add_document("c.pdf", document("Delta", sentences=80))
+                faiss_index = rag_index.faiss_index
+
+                self.assertGreater(rag_index.remove_document("b.pdf"), 0)
+                self.assertEqual(rag_index.remove_document("b.pdf"), 0)
+                self.assert_ids_resolve(rag_index)
+                self.assertEqual(rag_index.retrieve_documents("bravo", k=3, mode="lexical"), [])
+
+                rag_index.replace_document("a.pdf", document("Charlie", sentences=120))
+                self.assert_ids_resolve(rag_index)
+                self.assertTrue(rag_index.retrieve_documents("charlie", k=1, mode="lexical"))
+                self.assertIs(rag_index.faiss_index, faiss_index)
+                tombstoned = len(rag_index.shared.tombstones)
+                self.assertEqual(faiss_index.ntotal, len(rag_index.shared.ids) + tombstoned)
+                self.assertEqual(tombstoned > 0, index_type == "hnsw")
+
+                _registry.flush_snapshots()
+                _registry.clear()
+                reloaded = RAGIndex(api_key="key")
+                self.assertTrue(reloaded.shared.mmapped)
+                self.assertEqual(len(reloaded.shared.tombstones), tombstoned)
+                self.assertEqual(
+                    reloaded.retrieve_documents("charlie", k=1, mode="lexical"),
+                    rag_index.retrieve_documents("charlie", k=1, mode="lexical"),
+                )
+
+    @override_settings(RAG_SNAPSHOT_INTERVAL=3600)
+    def test_changes_between_snapshots_are_replayed_from_the_database(self):
+        """Snapshots should be rewritten at most once per interval, and a reload should replay later rows."""
+        namespace = namespace_for("key")
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+        manifest = snapshot.read_manifest(namespace)
+        rag_index.add_document("b.pdf", "Bravo quarterly revenue.")
+        rag_index.add_document("c.pdf", "Charlie annual report.")
+        rag_index.remove_document("b.pdf")
+        self.assertEqual(snapshot.read_manifest(namespace), manifest)
+        self.assertTrue(rag_index.shared.dirty)
+
+        _registry.clear()
+        reloaded = RAGIndex(api_key="key")
+        self.assertTrue(reloaded.shared.dirty)
+        self.assert_ids_resolve(reloaded)
+        self.assertEqual(reloaded.retrieve_documents("bravo", k=1, mode="lexical"), [])
+        self.assertEqual(reloaded.retrieve_documents("charlie", k=1, mode="lexical"), ["Charlie annual report."])
+
+        _registry.flush_snapshots()
+        self.assertFalse(reloaded.shared.dirty)
+        self.assertEqual(snapshot.read_manifest(namespace)["count"], RagChunk.objects.count())
+
+    def test_compressed_codecs_rerank_to_exact_results(self):
+        """SQ/PQ indexes should return the same top-k as the exact cosine index after re-ranking."""
+        text = " ".join(f"Sentence number {i} about retrieval." for i in range(600))
+        results = {}
+        for codec in ("none", "sq8", "pq"):
+            with self.subTest(codec=codec), override_settings(RAG_VECTOR_CODEC=codec, RAG_PQ_M=4):
+                _registry.clear()
+                rag_index = RAGIndex(api_key=f"key-{codec}")
+                rag_index.add_document("a.pdf", text)
+                self.assertEqual(rag_index.shared.codec, codec)
+                self.assertEqual(rag_index.faiss_index.metric_type, faiss.METRIC_INNER_PRODUCT)
+                results[codec] = rag_index.retrieve_documents("retrieval", k=2, mode="dense")
+
+        self.assertEqual(results["sq8"], results["none"])
+        self.assertEqual(results["pq"], results["none"])
+
+    @override_settings(RAG_EMBEDDING_DIMENSION=4)
+    def test_namespace_embedding_dimension_and_reprojection(self):
+        """Vectors should be truncated to the namespace's dimension, and re-projectable offline."""
+        rag_index = RAGIndex(api_key="key")
+        rag_index.add_document("a.pdf", self.text)
+
+        config = self.mock_client_class.return_value.models.embed_content.call_args.kwargs["config"]
+        self.assertEqual(config.output_dimensionality, 4)
+        self.assertEqual(rag_index.faiss_index.d, 4)
+        chunk = RagChunk.objects.first()
+        self.assertEqual(chunk.embedding_dimension, 4)
+        self.assertAlmostEqual(float(np.linalg.norm(np.frombuffer(chunk.embedding, dtype=np.float32))), 1.0, places=5)
+
+        with override_settings(RAG_EMBEDDING_DIMENSION=0):
+            RAGIndex(api_key="other").add_document("b.pdf", self.text)
+            call_command("rag_reproject", dimension=2, namespace=namespace_for("key"), stdout=StringIO())
+            self.assertEqual(RAGIndex(api_key="other").faiss_index.d, 8)
+
+            rag_index = RAGIndex(api_key="key")
+            self.assertEqual(rag_index.embedding_dimension, 2)
+            self.assertEqual(rag_index.faiss_index.d, 2)
+            self.assertEqual(len(rag_index.retrieve_documents("retrieval", k=2, mode="dense")), 2)
+
+            # Without --namespace, each namespace is measured on its own vectors.
+            out = StringIO()
+            call_command("rag_recall", k=1, queries=2, codec=["none"], stdout=out)
+            self.assertIn("dim 2,", out.getvalue())
+            self.assertIn("dim 8,", out.getvalue())
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import PromptView, ProofreaderView, SummarizerView, TranslatorView, WriterView, RewriterView, ApiKeyCheckView, HistoryView
 from .views import CopyWritingView, ImageGeneratorView, ExplainerView, PDFUploadRAGView, RAGChatView, EmailGeneratorView
+from .views import RAGBatchRetrieveView, RAGStatsView, RAGIngestionJobView, RAGIngestionJobCancelView
 
 urlpatterns = [
     path("prompt/", PromptView.as_view(), name="prompt"),
@@ -13,7 +14,11 @@ urlpatterns = [
     path("image/", ImageGeneratorView.as_view(), name="image"),
     path("explainer/", ExplainerView.as_view(), name="explainer"),
     path("pdf-upload/", PDFUploadRAGView.as_view(), name="pdf-upload"),
+    path("rag-jobs/<int:job_id>/", RAGIngestionJobView.as_view(), name="rag-job"),
+    path("rag-jobs/<int:job_id>/cancel/", RAGIngestionJobCancelView.as_view(), name="rag-job-cancel"),
     path("rag-chat/", RAGChatView.as_view(), name="rag-chat"),
+    path("rag-retrieve-batch/", RAGBatchRetrieveView.as_view(), name="rag-retrieve-batch"),
+    path("rag-stats/", RAGStatsView.as_view(), name="rag-stats"),
     path("api-key-check/", ApiKeyCheckView.as_view(), name="api-key-check"),
     path("history/", HistoryView.as_view(), name="history"),
     path("email/", EmailGeneratorView.as_view(), name="email"),
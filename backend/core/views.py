@@ -1,16 +1,23 @@
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 import logging
-from core.helper import strip_authentication_header, extract_text_from_pdf, save_file
-from core.models import ChatRecord
-from rag_service.rag_service import RAGIndex
-from ai_service.gemini_service import test_api_key, generate_response, generate_image
+from django.conf import settings
+from core.helper import strip_authentication_header, bypass_response_cache, rag_chat_prompt
+from core.models import ChatRecord, IngestionJob
+from core.async_views import AsyncAPIView
+from core.streaming import stream_cached, stream_generation, wants_stream
+from rag_service.rag_service import RAGIndex, RETRIEVAL_MODES
+from rag_service.filters import validate_filters
+from rag_service import answer_cache, embedding_cache, jobs
+from ai_service import client_pool, response_cache, single_flight
+from ai_service.gemini_service import atest_api_key, agenerate_response, agenerate_image
 
 logger = logging.getLogger(__name__)
 
-class ApiKeyCheckView(APIView):
-    def get(self, request):
+class ApiKeyCheckView(AsyncAPIView):
+    async def get(self, request):
         api_key = request.headers.get('Authorization')
         if not api_key:
             return Response({
@@ -20,7 +27,7 @@ class ApiKeyCheckView(APIView):
             }, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            response = test_api_key(api_key)
+            response = await atest_api_key(api_key)
             if response and not (isinstance(response, dict) and response.get("error", {}).get("code") == 401 and response.get("error", {}).get("message") == "API key not valid. Please pass a valid API key."):
                 return Response({
                     "status": status.HTTP_200_OK,
@@ -49,12 +56,12 @@ class ApiKeyCheckView(APIView):
                 "data": False
             }, status=status.HTTP_400_BAD_REQUEST)
 
-class PromptView(APIView):
+class PromptView(AsyncAPIView):
     """
     API View for generating a response to a prompt.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate a response from a prompt.
 
@@ -77,8 +84,10 @@ class PromptView(APIView):
             )
 
         try:
-            response_data = generate_response(prompt=prompt, api_key=api_key)
-            ChatRecord.objects.create(method='prompt', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('prompt', api_key, prompt)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, cache_method='prompt', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='prompt', prompt=prompt, response=response_data, api_key=api_key)
             
             return Response({
                 "status": 200,
@@ -91,8 +100,8 @@ class PromptView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class ProofreaderView(APIView):
-    def post(self, request, *args, **kwargs):
+class ProofreaderView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
         prompt = request.data.get("prompt")
         api_key = request.headers.get('Authorization')
         api_key = strip_authentication_header(api_key)
@@ -113,8 +122,10 @@ class ProofreaderView(APIView):
                      And make sure to proofread eventough the text is already perfect
                      """
 
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='proofreader', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('proofreader', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='proofreader', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='proofreader', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -126,14 +137,14 @@ class ProofreaderView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )   
 
-class SummarizerView(APIView):
+class SummarizerView(AsyncAPIView):
     """
     API View for summarizing complex information into clear insights.
     This view now leverages the robust error handling and response structure
     from the PromptView class.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate a summary from a prompt.
 
@@ -158,8 +169,10 @@ class SummarizerView(APIView):
         try:
             system_instruction_string = f"""You are a highly skilled summarizer. Your task is to distill complex information into clear and concise insights."""
 
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='summarizer', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('summarizer', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='summarizer', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='summarizer', prompt=prompt, response=response_data, api_key=api_key)
     
             return Response({
                 "status": 200,
@@ -172,9 +185,9 @@ class SummarizerView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class TranslatorView(APIView):
+class TranslatorView(AsyncAPIView):
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to translate text.
 
@@ -195,8 +208,10 @@ class TranslatorView(APIView):
         try:
 
             system_instruction_string = f"""You are a professional translator. Translate the given text into {target_language} from {source_language}."""
-            translation_text = generate_response(api_key=api_key, prompt=prompt, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='translator', prompt=prompt, response=translation_text, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('translator', api_key, prompt, system_instruction_string=system_instruction_string)
+            translation_text = await agenerate_response(api_key=api_key, prompt=prompt, system_instruction_string=system_instruction_string, cache_method='translator', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='translator', prompt=prompt, response=translation_text, api_key=api_key)
           
             return Response({
                 "status": 200,
@@ -210,13 +225,13 @@ class TranslatorView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class WriterView(APIView):
+class WriterView(AsyncAPIView):
     """
     API View for creating original and engaging text.
     This view now leverages robust error handling and a consistent response structure.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate written text.
 
@@ -236,8 +251,10 @@ class WriterView(APIView):
 
         try:
             system_instruction_string = f"""You are an expert writer. Your goal is to create original, engaging, and high-quality text based on the user's prompt."""
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='writer', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('writer', api_key, prompt, wrap=lambda data: {"written_text": data}, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='writer', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='writer', prompt=prompt, response=response_data, api_key=api_key)
        
             return Response({
                 "status": 200,
@@ -251,13 +268,13 @@ class WriterView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )   
 
-class RewriterView(APIView):
+class RewriterView(AsyncAPIView):
     """
     API View for improving content with alternative options.
     This view now leverages robust error handling and a consistent response structure.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate rewritten text.
 
@@ -277,8 +294,10 @@ class RewriterView(APIView):
 
         try:
             system_instruction_string = f"""You are a skilled rewriter. Your task is to rewrite the given text in a way that is more engaging and persuasive."""
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='rewriter', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('rewriter', api_key, prompt, wrap=lambda data: {"rewritten_text": data}, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='rewriter', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='rewriter', prompt=prompt, response=response_data, api_key=api_key)
           
             return Response({
                 "status": 200,
@@ -292,12 +311,12 @@ class RewriterView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class CopyWritingView(APIView):
+class CopyWritingView(AsyncAPIView):
     """
     API View for generating copywriting based on the prompt.
     """
    
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate copywriting.
         """
@@ -318,8 +337,10 @@ class CopyWritingView(APIView):
             system_instruction_string = f"""
             You are a skilled copywriter. Your task is to create engaging and persuasive copywriting based on the user's prompt.
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='copywriting', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('copywriting', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='copywriting', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='copywriting', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -331,12 +352,12 @@ class CopyWritingView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class ExplainerView(APIView):
+class ExplainerView(AsyncAPIView):
     """
     API View for generating explainer based on the prompt.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate explainer.
         """
@@ -352,8 +373,10 @@ class ExplainerView(APIView):
             system_instruction_string = f"""
             You are a skilled explainer. Your task is to explain the given prompt in a way that is easy to understand.
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='explainer', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('explainer', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='explainer', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='explainer', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -368,8 +391,9 @@ class ExplainerView(APIView):
 
 class PDFUploadRAGView(APIView):
     """
-    API endpoint to upload a PDF, extract its text,
-    and process it through the RAG service.
+    API endpoint to upload a PDF and queue it for ingestion into the RAG
+    service. The job is run by the rag_ingest_worker command; poll
+    rag-jobs/<id>/ for its progress.
     """
 
     def post(self, request):
@@ -381,56 +405,79 @@ class PDFUploadRAGView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            file_path = save_file(pdf_file)
-        except Exception as e:
+        api_key = request.headers.get('Authorization')
+        api_key = strip_authentication_header(api_key)
+        file_path = jobs.save_upload(api_key, pdf_file)
+        if not file_path:
             return Response(
-                {"error": f"Failed to save PDF: {str(e)}"},
+                {"error": "Failed to save PDF."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-        try:
-            api_key = request.headers.get('Authorization')
-            api_key = strip_authentication_header(api_key)
-            text_content = extract_text_from_pdf(pdf_file)
-            rag_index = RAGIndex(api_key=api_key)
-            rag_index.delete_all_chunks()
-            rag_index.add_document(pdf_file.name, text_content)
-            if not text_content:
-                return Response(
-                    {"error": "No text could be extracted from PDF."},
-                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
-                )
-        except Exception as e:
+        job = jobs.enqueue(api_key, pdf_file.name, file_path)
+
+        return Response({
+            "message": "PDF queued for ingestion",
+            "file_path": file_path,
+            "job_id": job.id,
+        }, status=status.HTTP_202_ACCEPTED)
+
+class RAGIngestionJobView(APIView):
+    """
+    API View for the status and progress of a PDF ingestion job.
+    """
+
+    def get(self, request, job_id):
+        api_key = strip_authentication_header(request.headers.get('Authorization'))
+        job = IngestionJob.objects.filter(id=job_id, api_key=api_key or "").first()
+        if job is None:
             return Response(
-                {"error": f"Error extracting PDF text: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Ingestion job not found."},
+                status=status.HTTP_404_NOT_FOUND
             )
+        return Response({
+            "status": 200,
+            "message": "success",
+            "data": jobs.describe(job)
+        }, status=status.HTTP_200_OK)
 
-        try:
-            result = rag_index.retrieve_documents(text_content, k=3)
-        except Exception as e:
+class RAGIngestionJobCancelView(APIView):
+    """
+    API View for cancelling a queued or running PDF ingestion job.
+    """
+
+    def post(self, request, job_id):
+        api_key = strip_authentication_header(request.headers.get('Authorization'))
+        job = IngestionJob.objects.filter(id=job_id, api_key=api_key or "").first()
+        if job is None:
             return Response(
-                {"error": f"RAG service failed: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Ingestion job not found."},
+                status=status.HTTP_404_NOT_FOUND
             )
-
+        if not jobs.cancel(job):
+            return Response(
+                {"error": "Ingestion job has already finished."},
+                status=status.HTTP_409_CONFLICT
+            )
+        job.refresh_from_db()
         return Response({
-            "message": "PDF processed successfully",
-            "file_path": file_path,
-            "rag_result": result
+            "status": 200,
+            "message": "success",
+            "data": jobs.describe(job)
         }, status=status.HTTP_200_OK)
 
-class RAGChatView(APIView):
+class RAGChatView(AsyncAPIView):
     """
     API View for chatting with the RAG service.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to chat with the RAG service.
         """
         prompt = request.data.get("prompt")
+        mode = request.data.get("mode")
+        filters = request.data.get("filters")
         api_key = request.headers.get('Authorization')
         api_key = strip_authentication_header(api_key)
         if not prompt:
@@ -438,21 +485,65 @@ class RAGChatView(APIView):
                 {"error": "A 'prompt' is required in the request body."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if mode and mode not in RETRIEVAL_MODES:
+            return Response(
+                {"error": f"'mode' must be one of: {', '.join(RETRIEVAL_MODES)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         try:
-            rag_index = RAGIndex(api_key=api_key)
-            chunks = rag_index.retrieve_documents(prompt, k=3)
-            
-            prompt = (
-                f"User Question: {prompt}\n"        
-                "Context Information:\n"
-                + "\n".join(f"Document {i+1}: {chunk}" for i, chunk in enumerate(chunks))
+            validate_filters(filters)
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
-
+        try:
+            rag_index = await sync_to_async(RAGIndex)(api_key=api_key)
+            question = prompt
             system_instruction_string = f"""
             You are a helpful assistant. Your task is to answer the user's question based on the given context.
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='rag_chat', prompt=prompt, response=response_data, api_key=api_key)
+            # Cached answers are found by question embedding; lexical retrieval
+            # works without embeddings, so lexical questions skip the cache.
+            use_answer_cache = (mode or settings.RAG_RETRIEVAL_MODE) != "lexical"
+            if use_answer_cache:
+                query_vector = await rag_index.aembed_query(question)
+                version = rag_index.shared.version
+                context = answer_cache.context_key(mode, filters)
+                cached = answer_cache.answer_cache.lookup(rag_index.namespace, version, context, query_vector)
+                if cached is not None:
+                    response_data, spans = cached
+                    chunks = await sync_to_async(rag_index.span_texts)(spans)
+                    prompt = rag_chat_prompt(question, chunks)
+                    await ChatRecord.objects.acreate(method='rag_chat', prompt=prompt, response=response_data, api_key=api_key)
+                    if wants_stream(request):
+                        return stream_cached(response_data)
+                    return Response({
+                        "status": 200,
+                        "message": "success",
+                        "data": response_data
+                    }, status=status.HTTP_200_OK)
+
+            hits = (await sync_to_async(rag_index.retrieve_many)([question], k=3, mode=mode, filters=filters))[0]
+            chunks = [hit["text"] for hit in hits]
+            prompt = rag_chat_prompt(question, chunks)
+
+            def remember(data):
+                if use_answer_cache:
+                    answer_cache.answer_cache.store(
+                        rag_index.namespace, version, context, query_vector,
+                        [hit["ids"] for hit in hits], data
+                    )
+
+            if wants_stream(request):
+                return stream_generation(
+                    'rag_chat', api_key, prompt,
+                    system_instruction_string=system_instruction_string,
+                    on_complete=remember,
+                )
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
+            await ChatRecord.objects.acreate(method='rag_chat', prompt=prompt, response=response_data, api_key=api_key)
+            remember(response_data)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -465,12 +556,96 @@ class RAGChatView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
        
-class ImageGeneratorView(APIView):
+class RAGBatchRetrieveView(APIView):
     """
-    API View for generating an image from a text prompt using the Gemini API.
+    API View for retrieving ranked chunks for several queries in one request.
     """
 
     def post(self, request, *args, **kwargs):
+        """
+        Handles POST requests with a list of 'queries' and returns, for each,
+        the top 'k' chunks with their scores.
+        """
+        queries = request.data.get("queries")
+        k = request.data.get("k", 3)
+        mode = request.data.get("mode")
+        filters = request.data.get("filters")
+        api_key = request.headers.get('Authorization')
+        api_key = strip_authentication_header(api_key)
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+            return Response(
+                {"error": "A non-empty list of 'queries' is required in the request body."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(queries) > settings.RAG_BATCH_MAX_QUERIES:
+            return Response(
+                {"error": f"At most {settings.RAG_BATCH_MAX_QUERIES} queries are allowed per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            return Response(
+                {"error": "'k' must be a positive integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if k > settings.RAG_BATCH_MAX_K:
+            return Response(
+                {"error": f"'k' must be at most {settings.RAG_BATCH_MAX_K}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if mode and mode not in RETRIEVAL_MODES:
+            return Response(
+                {"error": f"'mode' must be one of: {', '.join(RETRIEVAL_MODES)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            validate_filters(filters)
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            rag_index = RAGIndex(api_key=api_key)
+            results = rag_index.retrieve_many(queries, k=k, mode=mode, filters=filters)
+            return Response({
+                "status": 200,
+                "message": "success",
+                "data": [
+                    {"query": query, "results": hits}
+                    for query, hits in zip(queries, results)
+                ]
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({
+                "status": 500,
+                "message": "error",
+                "data": "An unexpected error occurred while processing your request." + str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class RAGStatsView(APIView):
+    """
+    API View for the cache and client-pool counters of this worker process.
+    """
+
+    def get(self, request):
+        return Response({
+            "status": 200,
+            "message": "success",
+            "data": {
+                "embedding_cache": embedding_cache.stats.as_dict(),
+                "query_embedding_cache": embedding_cache.query_stats.as_dict(),
+                "response_cache": response_cache.stats.as_dict(),
+                "request_coalescing": single_flight.stats.as_dict(),
+                "gemini_clients": client_pool.stats.as_dict(),
+            }
+        }, status=status.HTTP_200_OK)
+
+class ImageGeneratorView(AsyncAPIView):
+    """
+    API View for generating an image from a text prompt using the Gemini API.
+    """
+
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate an image.
         """
@@ -491,8 +666,8 @@ class ImageGeneratorView(APIView):
             )
 
         try:
-            image_info = generate_image(prompt=prompt, api_key=api_key)
-            ChatRecord.objects.create(
+            image_info = await agenerate_image(prompt=prompt, api_key=api_key)
+            await ChatRecord.objects.acreate(
                 method="image_generation",
                 prompt=prompt,
                 response=f"[Image generated: {image_info['extension']}]",
@@ -517,12 +692,12 @@ class ImageGeneratorView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-class EmailGeneratorView(APIView):
+class EmailGeneratorView(AsyncAPIView):
     """
     API View for generating an email from a text prompt using the Gemini API.
     """
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate an email.
         """
@@ -569,8 +744,10 @@ class EmailGeneratorView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         try:
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='email_generation', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('email_generation', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='email_generation', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='email_generation', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -583,11 +760,11 @@ class EmailGeneratorView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CodeGeneratorView(APIView):
+class CodeGeneratorView(AsyncAPIView):
     """
     API View for generating code from a text prompt using the Gemini API.
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate code.
         """
@@ -610,8 +787,10 @@ class CodeGeneratorView(APIView):
             The code should be generated based on the following prompt:
             """
 
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='code_generation', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('code_generation', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='code_generation', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='code_generation', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -624,11 +803,11 @@ class CodeGeneratorView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CodeReviewerView(APIView):
+class CodeReviewerView(AsyncAPIView):
     """
     API View for reviewing code from a text prompt using the Gemini API.
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to review code.
         """
@@ -652,8 +831,10 @@ class CodeReviewerView(APIView):
             The code should be reviewed based on the following prompt:
             {prompt}
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='code_reviewer', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('code_reviewer', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='code_reviewer', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='code_reviewer', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -666,11 +847,11 @@ class CodeReviewerView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class MeetingSummaryView(APIView):
+class MeetingSummaryView(AsyncAPIView):
     """
     API View for summarizing a meeting from a text prompt using the Gemini API.
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to summarize a meeting.
         """
@@ -693,8 +874,10 @@ class MeetingSummaryView(APIView):
             The meeting should be summarized based on the following prompt:
             {prompt}
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='meeting_summary', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('meeting_summary', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='meeting_summary', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='meeting_summary', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -707,11 +890,11 @@ class MeetingSummaryView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class SocialMediaPostGeneratorView(APIView):
+class SocialMediaPostGeneratorView(AsyncAPIView):
     """
     API View for generating a social media post from a text prompt using the Gemini API.
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to generate a social media post.
         """
@@ -734,8 +917,10 @@ class SocialMediaPostGeneratorView(APIView):
             The social media post should be generated based on the following prompt:
             {prompt}
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='social_media_post_generation', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('social_media_post_generation', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='social_media_post_generation', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='social_media_post_generation', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -748,11 +933,11 @@ class SocialMediaPostGeneratorView(APIView):
                 "data": "An unexpected error occurred while processing your request." + str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class SentimentAnalyzerView(APIView):
+class SentimentAnalyzerView(AsyncAPIView):
     """
     API View for analyzing the sentiment of a text prompt using the Gemini API.
     """
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handles POST requests to analyze the sentiment of a text prompt.
         """
@@ -775,8 +960,10 @@ class SentimentAnalyzerView(APIView):
             The sentiment should be analyzed based on the following prompt:
             {prompt}
             """
-            response_data = generate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string)
-            ChatRecord.objects.create(method='sentiment_analysis', prompt=prompt, response=response_data, api_key=api_key)
+            if wants_stream(request):
+                return stream_generation('sentiment_analysis', api_key, prompt, system_instruction_string=system_instruction_string)
+            response_data = await agenerate_response(prompt=prompt, api_key=api_key, system_instruction_string=system_instruction_string, cache_method='sentiment_analysis', bypass_cache=bypass_response_cache(request))
+            await ChatRecord.objects.acreate(method='sentiment_analysis', prompt=prompt, response=response_data, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -791,11 +978,11 @@ class SentimentAnalyzerView(APIView):
 
 
 
-class HistoryView(APIView):
+class HistoryView(AsyncAPIView):
     """
     API View for retrieving history of prompts.
     """
-    def get(self, request):
+    async def get(self, request):
         try:
             
             api_key = strip_authentication_header(request.headers.get('Authorization'))
@@ -808,7 +995,7 @@ class HistoryView(APIView):
                     "response": record.response[:100],
                     "created_at": record.created_at,
                 }
-                for record in history
+                async for record in history
             ]
             return Response({
                 "status": 200,
@@ -1,14 +1,15 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from core.async_views import AsyncAPIView
 from core.helper import strip_authentication_header, extract_text_from_pdf, save_file
-from ai_service.gemini_service import generate_response, process_text_with_function_calling_vertex
+from ai_service.gemini_service import agenerate_response, aprocess_text_with_function_calling_vertex
 from core.models import ChatRecord
 from io import StringIO
 import pandas as pd
 
-class DirectExtractionView(APIView):
+class DirectExtractionView(AsyncAPIView):
     """
     API endpoint to upload a PDF or CSV and ask a question about it in a single request.
     The document text is chunked and processed iteratively, with responses combined.
@@ -17,7 +18,7 @@ class DirectExtractionView(APIView):
     CHUNK_SIZE = 4000
     SUPPORTED_FILE_TYPES = ['pdf', 'csv']
     
-    def post(self, request):
+    async def post(self, request):
         uploaded_file = request.FILES.get("file")
         prompt = request.data.get("prompt")
         api_key = self._extract_api_key(request)
@@ -27,7 +28,8 @@ class DirectExtractionView(APIView):
             return validation_error
 
         try:
-            text_content = self._extract_file_content(uploaded_file)
+            # PDF and CSV parsing is blocking work; keep it off the event loop.
+            text_content = await sync_to_async(self._extract_file_content)(uploaded_file)
             
             if not text_content:
                 return Response(
@@ -35,10 +37,10 @@ class DirectExtractionView(APIView):
                     status=status.HTTP_422_UNPROCESSABLE_ENTITY
                 )
 
-            combined_response = self._process_chunks(text_content, prompt, api_key)
+            combined_response = await self._process_chunks(text_content, prompt, api_key)
             
-            adjusted_response = self._adjust_response(combined_response, api_key)
-            self._save_chat_record(prompt, adjusted_response, api_key)
+            adjusted_response = await self._adjust_response(combined_response, api_key)
+            await self._save_chat_record(prompt, adjusted_response, api_key)
             return Response({
                 "status": 200,
                 "message": "success",
@@ -51,7 +53,7 @@ class DirectExtractionView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    def _adjust_response(self, response, api_key):
+    async def _adjust_response(self, response, api_key):
         """Adjust the response to the user's request."""
         prompt = f"""
         You are helpful assistant that will adjust the response to the user's request.
@@ -60,7 +62,7 @@ class DirectExtractionView(APIView):
         Return the adjusted response only.
         """
 
-        answer = generate_response(prompt=prompt, api_key=api_key)
+        answer = await agenerate_response(prompt=prompt, api_key=api_key)
         return answer
 
     def _extract_api_key(self, request):
@@ -131,13 +133,13 @@ class DirectExtractionView(APIView):
         
         return buffer.getvalue()
 
-    def _process_chunks(self, text_content, prompt, api_key):
+    async def _process_chunks(self, text_content, prompt, api_key):
         """Process text content in chunks and combine responses."""
         chunks = self._create_chunks(text_content)
         combined_response = ""
         
         for idx, chunk in enumerate(chunks):
-            chunk_response = self._process_single_chunk(
+            chunk_response = await self._process_single_chunk(
                 chunk, idx, len(chunks), prompt, api_key
             )
             combined_response = self._combine_responses(
@@ -153,7 +155,7 @@ class DirectExtractionView(APIView):
             for i in range(0, len(text_content), self.CHUNK_SIZE)
         ]
 
-    def _process_single_chunk(self, chunk, chunk_index, total_chunks, prompt, api_key):
+    async def _process_single_chunk(self, chunk, chunk_index, total_chunks, prompt, api_key):
         """Process a single chunk and return the response."""
         chunk_prompt = self._build_chunk_prompt(
             chunk, chunk_index, total_chunks, prompt
@@ -164,7 +166,7 @@ class DirectExtractionView(APIView):
             "in a structured format based on user prompt."
         )
         
-        answer = generate_response(
+        answer = await agenerate_response(
             prompt=chunk_prompt,
             api_key=api_key,
             system_instruction_string=system_instruction
@@ -192,21 +194,21 @@ class DirectExtractionView(APIView):
         combined_response += f"Chunk {chunk_index + 1}:\n{new_response}"
         return combined_response
 
-    def _save_chat_record(self, prompt, response, api_key):
+    async def _save_chat_record(self, prompt, response, api_key):
         """Save chat record to database."""
-        ChatRecord.objects.create(
+        await ChatRecord.objects.acreate(
             method='direct_extraction',
             prompt=prompt,
             response=response,
             api_key=api_key
         )
 
-class AnalyzeTextView(APIView):
+class AnalyzeTextView(AsyncAPIView):
     """
     This is function calling gemini api to analyze the text and return the analysis.
     """
 
-    def post(self, request):
+    async def post(self, request):
         text = request.data.get("text")
         api_key = request.headers.get("Authorization")
         api_key = strip_authentication_header(api_key)
@@ -222,8 +224,8 @@ class AnalyzeTextView(APIView):
             )
 
         try:
-            response = process_text_with_function_calling_vertex(prompt=text, api_key=api_key)
-            ChatRecord.objects.create(method='analyze_text', prompt=text, response=response, api_key=api_key)
+            response = await aprocess_text_with_function_calling_vertex(prompt=text, api_key=api_key)
+            await ChatRecord.objects.acreate(method='analyze_text', prompt=text, response=response, api_key=api_key)
             return Response({
                 "status": 200,
                 "message": "success",
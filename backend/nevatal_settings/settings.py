@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 import dj_database_url
@@ -84,12 +85,20 @@ CORS_ALLOW_HEADERS = [
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
+    "x-cache-bypass",
+    "cache-control",
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS':'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Generation views stream server-sent events for ?stream=1 or Accept: text/event-stream.
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'core.streaming.EventStreamRenderer',
+    ],
 }
 
 MIDDLEWARE = [
@@ -190,4 +199,129 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / "media"
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / "media"
+
+# RAG service
+# https://faiss.ai/
+# Embeddings are stored as raw bytes; "float16" halves the column size again
+# at a small precision cost. Vectors are always searched as float32.
+RAG_EMBEDDING_DTYPE = os.getenv("RAG_EMBEDDING_DTYPE", "float32")
+RAG_BULK_CREATE_BATCH_SIZE = int(os.getenv("RAG_BULK_CREATE_BATCH_SIZE", "500"))
+# Snapshots of the FAISS index are written here after ingestion and
+# memory-mapped on startup instead of rebuilding from the RagChunk table.
+RAG_INDEX_SNAPSHOTS = os.getenv("RAG_INDEX_SNAPSHOTS", "True") == "True"
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(MEDIA_ROOT, "rag_index"))
+# Rebuilds write a snapshot straight away; after incremental changes it is
+# rewritten at most every RAG_SNAPSHOT_INTERVAL seconds and on shutdown. A
+# worker loading an older snapshot replays later changes from the RagChunk
+# table, so nothing is lost in between. 0 writes after every change.
+RAG_SNAPSHOT_INTERVAL = float(os.getenv("RAG_SNAPSHOT_INTERVAL", "300"))
+# Index type: "flat" (exact), "hnsw", "ivf_flat", "ivf_pq", or "auto" to pick
+# one from the corpus size. efSearch / nprobe trade recall for latency; see
+# `python manage.py rag_recall` for measured numbers on the current corpus.
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto")
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+RAG_PQ_M = int(os.getenv("RAG_PQ_M", "64"))
+# Vectors are normalized and searched by inner product (cosine similarity).
+# A codec other than "none" ("sq8", "sq4", or "pq" with RAG_PQ_M bytes per
+# vector) compresses them in the index; dense results are then re-ranked
+# exactly from the stored embeddings of the top k * RAG_RERANK_FACTOR.
+RAG_VECTOR_CODEC = os.getenv("RAG_VECTOR_CODEC", "none")
+RAG_RERANK_FACTOR = int(os.getenv("RAG_RERANK_FACTOR", "4"))
+# Each API key gets its own index; least recently used ones are evicted from
+# worker memory past this budget and reloaded from their snapshot on demand.
+RAG_INDEX_MEMORY_BUDGET_MB = int(os.getenv("RAG_INDEX_MEMORY_BUDGET_MB", "1024"))
+# Document embeddings are cached by (model, task type, dimension, SHA-256 of
+# the normalized chunk text) so re-uploads only embed chunks that changed.
+RAG_EMBEDDING_CACHE = os.getenv("RAG_EMBEDDING_CACHE", "True") == "True"
+# Query embeddings are kept in an LRU of this many entries (0 disables it),
+# keyed by case-folded normalized query text, model, task type and dimension,
+# for RAG_QUERY_CACHE_TTL seconds. Set RAG_QUERY_CACHE_BACKEND to a CACHES
+# alias to share them between workers.
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1000"))
+RAG_QUERY_CACHE_TTL = int(os.getenv("RAG_QUERY_CACHE_TTL", "600"))
+RAG_QUERY_CACHE_BACKEND = os.getenv("RAG_QUERY_CACHE_BACKEND", "")
+# Embedding requests are split to stay under the provider's per-request item
+# and token limits and sent on a bounded thread pool; failed batches are
+# retried individually with exponential backoff (seconds).
+RAG_EMBED_BATCH_MAX_ITEMS = int(os.getenv("RAG_EMBED_BATCH_MAX_ITEMS", "100"))
+RAG_EMBED_BATCH_MAX_TOKENS = int(os.getenv("RAG_EMBED_BATCH_MAX_TOKENS", "20000"))
+RAG_EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+RAG_EMBED_MAX_RETRIES = int(os.getenv("RAG_EMBED_MAX_RETRIES", "3"))
+RAG_EMBED_RETRY_BACKOFF = float(os.getenv("RAG_EMBED_RETRY_BACKOFF", "1.0"))
+# Chunk sizes are in estimated tokens. Chunks break between sentences, and a
+# short document tail is merged into the previous chunk rather than dropped.
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "256"))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "32"))
+RAG_CHUNK_MIN_TOKENS = int(os.getenv("RAG_CHUNK_MIN_TOKENS", "32"))
+# Ingestion runs page extraction, chunking and embedding as overlapping
+# stages; each may run this many pages or chunk batches ahead of the next.
+RAG_INGEST_QUEUE_SIZE = int(os.getenv("RAG_INGEST_QUEUE_SIZE", "4"))
+# pdf-upload/ queues an ingestion job in the database and returns 202; jobs
+# are run by `python manage.py rag_ingest_worker`, which checks an empty
+# queue again after this many seconds.
+RAG_INGEST_POLL_SECONDS = float(os.getenv("RAG_INGEST_POLL_SECONDS", "2"))
+# A running job whose worker has not reported progress for this many
+# seconds is presumed dead and requeued, up to RAG_INGEST_MAX_ATTEMPTS runs.
+RAG_INGEST_LEASE_SECONDS = float(os.getenv("RAG_INGEST_LEASE_SECONDS", "600"))
+RAG_INGEST_MAX_ATTEMPTS = int(os.getenv("RAG_INGEST_MAX_ATTEMPTS", "3"))
+# Retrieval mode: "dense" (vector search), "lexical" (BM25, answered locally
+# without an embedding call) or "hybrid" (both, fused by reciprocal rank).
+# Hybrid fetches k * RAG_HYBRID_OVERFETCH candidates from each side. A worker
+# only loads or builds a namespace's BM25 index once it serves a lexical or
+# hybrid search.
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+RAG_HYBRID_OVERFETCH = int(os.getenv("RAG_HYBRID_OVERFETCH", "4"))
+# Largest number of queries, and largest k, accepted by one
+# rag-retrieve-batch/ request.
+RAG_BATCH_MAX_QUERIES = int(os.getenv("RAG_BATCH_MAX_QUERIES", "100"))
+RAG_BATCH_MAX_K = int(os.getenv("RAG_BATCH_MAX_K", "100"))
+# Retrieval over-fetches k * RAG_MMR_OVERFETCH candidates and picks k of them
+# by maximal marginal relevance, trading relevance (1.0 = off) for diversity.
+# Neighbouring chunks of one document are merged into a single span.
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_MMR_OVERFETCH = int(os.getenv("RAG_MMR_OVERFETCH", "4"))
+RAG_MERGE_ADJACENT_CHUNKS = os.getenv("RAG_MERGE_ADJACENT_CHUNKS", "True") == "True"
+# rag-chat/ reuses the answer to an earlier question whose embedding has at
+# least this cosine similarity, asked of the same corpus version with the same
+# mode and filters. Up to RAG_ANSWER_CACHE_SIZE answers are kept (0 disables).
+# Lexical questions are never embedded, so they always skip this cache.
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1000"))
+RAG_ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+# Only chunk ids are kept in worker memory; retrieved texts are fetched by id
+# and the most recently retrieved ones kept in an LRU of this many chunks.
+RAG_CHUNK_TEXT_CACHE_SIZE = int(os.getenv("RAG_CHUNK_TEXT_CACHE_SIZE", "1000"))
+# HNSW graphs cannot delete vectors, so removed chunks are tombstoned and
+# skipped at search time; the index is rebuilt past this tombstoned fraction.
+RAG_TOMBSTONE_REBUILD_RATIO = float(os.getenv("RAG_TOMBSTONE_REBUILD_RATIO", "0.2"))
+# Embedding size for new namespaces (e.g. 256, 768, 1536); 0 keeps the
+# model's full 3072. Smaller vectors are the model's leading (Matryoshka)
+# components, renormalized. Existing namespaces keep the size they were
+# created with until `python manage.py rag_reproject --dimension N`.
+RAG_EMBEDDING_DIMENSION = int(os.getenv("RAG_EMBEDDING_DIMENSION", "0"))
+
+# Gemini clients
+# One client (and HTTP connection pool) is kept per API key and reused across
+# requests; idle clients are dropped after GEMINI_CLIENT_IDLE_SECONDS and at
+# most GEMINI_CLIENT_POOL_SIZE are kept. Connections stay open between calls
+# for GEMINI_CLIENT_KEEPALIVE_SECONDS.
+GEMINI_CLIENT_POOL_SIZE = int(os.getenv("GEMINI_CLIENT_POOL_SIZE", "64"))
+GEMINI_CLIENT_IDLE_SECONDS = float(os.getenv("GEMINI_CLIENT_IDLE_SECONDS", "600"))
+GEMINI_CLIENT_MAX_CONNECTIONS = int(os.getenv("GEMINI_CLIENT_MAX_CONNECTIONS", "20"))
+GEMINI_CLIENT_KEEPALIVE_SECONDS = float(os.getenv("GEMINI_CLIENT_KEEPALIVE_SECONDS", "60"))
+# Responses of the view methods listed here ({method: TTL in seconds}, e.g.
+# '{"translator": 3600}'; none by default) are cached by their full request
+# (API key, model, system instruction, prompt, schema). Up to
+# GEMINI_RESPONSE_CACHE_SIZE are kept in process; set
+# GEMINI_RESPONSE_CACHE_BACKEND to a CACHES alias to share them. Requests
+# with `X-Cache-Bypass: 1` or `Cache-Control: no-cache` skip the lookup.
+GEMINI_RESPONSE_CACHE_TTLS = json.loads(os.getenv("GEMINI_RESPONSE_CACHE_TTLS", "{}"))
+GEMINI_RESPONSE_CACHE_SIZE = int(os.getenv("GEMINI_RESPONSE_CACHE_SIZE", "1000"))
+GEMINI_RESPONSE_CACHE_BACKEND = os.getenv("GEMINI_RESPONSE_CACHE_BACKEND", "")
+# Identical generation requests (same API key and request) made while one
+# is already in flight wait for its answer instead of calling Gemini again.
+GEMINI_COALESCE_REQUESTS = os.getenv("GEMINI_COALESCE_REQUESTS", "True") == "True"
@@ -0,0 +1,96 @@
+import json
+import threading
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+from django.conf import settings
+
+
+def context_key(mode, filters):
+    """Retrieval settings an answer depends on besides the question itself"""
+    return json.dumps(
+        {"mode": mode or settings.RAG_RETRIEVAL_MODE, "filters": filters or None},
+        sort_keys=True,
+        default=str,
+    )
+
+
+class _Answer:
+    __slots__ = ("namespace", "version", "context", "vector", "spans", "response")
+
+    def __init__(self, namespace, version, context, vector, spans, response):
+        self.namespace = namespace
+        self.version = version
+        self.context = context
+        self.vector = vector
+        self.spans = spans
+        self.response = response
+
+
+class AnswerCache:
+    """
+    Bounded LRU of generated RAG answers, looked up by the cosine similarity
+    of the question's (normalized) embedding to earlier questions asked of
+    the same namespace, corpus version and retrieval settings.
+
+    An answer is only valid for the corpus version it was generated from; a
+    namespace's answers are dropped as soon as a different version is seen.
+    Each answer keeps the RagChunk ids of the spans it was generated from,
+    not their texts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.keys = count()
+
+    def _evict_stale(self, namespace, version):
+        if self.versions.get(namespace, version) != version:
+            for key in [k for k, e in self.entries.items() if e.namespace == namespace]:
+                del self.entries[key]
+        self.versions[namespace] = version
+
+    def lookup(self, namespace, version, context, vector):
+        """
+        The cached answer closest to `vector` as (response, spans), or
+        None if none reaches RAG_ANSWER_CACHE_THRESHOLD
+        """
+        if settings.RAG_ANSWER_CACHE_SIZE <= 0:
+            return None
+        with self.lock:
+            self._evict_stale(namespace, version)
+            keys = [
+                k for k, e in self.entries.items()
+                if e.namespace == namespace and e.context == context
+            ]
+            if not keys:
+                return None
+            scores = np.vstack([self.entries[k].vector for k in keys]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < settings.RAG_ANSWER_CACHE_THRESHOLD:
+                return None
+            self.entries.move_to_end(keys[best])
+            answer = self.entries[keys[best]]
+            return answer.response, answer.spans
+
+    def store(self, namespace, version, context, vector, spans, response):
+        size = settings.RAG_ANSWER_CACHE_SIZE
+        if size <= 0:
+            return
+        with self.lock:
+            self._evict_stale(namespace, version)
+            self.entries[next(self.keys)] = _Answer(
+                namespace, version, context, vector, [list(ids) for ids in spans], response
+            )
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+answer_cache = AnswerCache()
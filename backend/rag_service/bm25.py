@@ -0,0 +1,190 @@
+import math
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+
+
+_TOKEN = re.compile(r"\w+(?:[.\-/]\w+)*", re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercased word tokens; identifiers like 'v1.2', 'ISO-9001' or '2024/25' stay whole"""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index keyed by RagChunk.id, held in flat numpy
+    arrays. Postings are stored CSR-style by term: `indptr[t]:indptr[t + 1]`
+    slices the parallel `rows` and `tfs` arrays, and `rows` index the
+    per-chunk `doc_ids` and `doc_lengths`, so a posting costs 8 bytes.
+
+    Added chunks are buffered and merged into the arrays on the next search,
+    removal or save, so appending batch after batch does not re-sort the
+    postings each time.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.int32)
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.doc_lengths = np.empty(0, dtype=np.int32)
+        self.total_length = 0
+        self.vocabulary_bytes = 0
+        self.pending = []
+
+    def __len__(self):
+        return len(self.doc_ids) + sum(len(batch[0]) for batch in self.pending)
+
+    def add(self, chunk_ids, texts):
+        ids, lengths, terms, rows, tfs = [], [], [], [], []
+        for row, (chunk_id, text) in enumerate(zip(chunk_ids, texts)):
+            tokens = tokenize(text)
+            ids.append(int(chunk_id))
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = self.vocabulary.get(term)
+                if term_id is None:
+                    term_id = self.vocabulary[term] = len(self.vocabulary)
+                    self.vocabulary_bytes += sys.getsizeof(term) + 100
+                terms.append(term_id)
+                rows.append(row)
+                tfs.append(tf)
+        if not ids:
+            return
+        self.pending.append((
+            np.array(ids, dtype=np.int64),
+            np.array(lengths, dtype=np.int32),
+            np.array(terms, dtype=np.int32),
+            np.array(rows, dtype=np.int32),
+            np.array(tfs, dtype=np.int32),
+        ))
+        self.total_length += sum(lengths)
+
+    def _posting_terms(self):
+        """The term id of every posting, in posting order"""
+        return np.repeat(
+            np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr)
+        )
+
+    def _set_postings(self, terms, rows, tfs):
+        order = np.argsort(terms, kind="stable")
+        self.rows = rows[order]
+        self.tfs = tfs[order]
+        counts = np.bincount(terms, minlength=len(self.vocabulary))
+        self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _flush(self):
+        """Merge buffered chunks into the posting arrays"""
+        if not self.pending:
+            return
+        doc_ids, doc_lengths = [self.doc_ids], [self.doc_lengths]
+        terms, rows, tfs = [self._posting_terms()], [self.rows], [self.tfs]
+        offset = len(self.doc_ids)
+        for batch_ids, batch_lengths, batch_terms, batch_rows, batch_tfs in self.pending:
+            doc_ids.append(batch_ids)
+            doc_lengths.append(batch_lengths)
+            terms.append(batch_terms)
+            rows.append(batch_rows + offset)
+            tfs.append(batch_tfs)
+            offset += len(batch_ids)
+        self.pending = []
+        self.doc_ids = np.concatenate(doc_ids)
+        self.doc_lengths = np.concatenate(doc_lengths)
+        self._set_postings(np.concatenate(terms), np.concatenate(rows), np.concatenate(tfs))
+
+    def remove(self, chunk_ids):
+        self._flush()
+        drop = np.isin(self.doc_ids, np.asarray(chunk_ids, dtype=np.int64))
+        if not drop.any():
+            return
+        keep = ~drop[self.rows]
+        renumbered = (np.cumsum(~drop) - 1).astype(np.int32)
+        self.total_length -= int(self.doc_lengths[drop].sum())
+        self.doc_ids = self.doc_ids[~drop]
+        self.doc_lengths = self.doc_lengths[~drop]
+        self._set_postings(
+            self._posting_terms()[keep], renumbered[self.rows[keep]], self.tfs[keep]
+        )
+
+    def search(self, query, k, allowed=None):
+        """
+        Return [(chunk_id, score)] for the top `k` chunks matching any query
+        term, optionally only among the chunk ids in `allowed`.
+        """
+        self._flush()
+        count = len(self.doc_ids)
+        if not count or k <= 0:
+            return []
+
+        avg_length = self.total_length / count or 1.0
+        scores = np.zeros(count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            if start == end:
+                continue
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = int(end - start)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[rows] / avg_length)
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if allowed is not None:
+            scores[~np.isin(self.doc_ids, np.asarray(allowed, dtype=np.int64))] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(self.doc_ids[row]), float(scores[row])) for row in matched]
+
+    def memory_bytes(self):
+        """Resident size: the posting and document arrays plus the vocabulary dict"""
+        arrays = [self.indptr, self.rows, self.tfs, self.doc_ids, self.doc_lengths]
+        arrays += [array for batch in self.pending for array in batch]
+        return sum(array.nbytes for array in arrays) + self.vocabulary_bytes
+
+    def to_state(self):
+        self._flush()
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "terms": list(self.vocabulary),
+            "indptr": self.indptr,
+            "rows": self.rows,
+            "tfs": self.tfs,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild an index from to_state(); raises KeyError for states of another layout"""
+        index = cls(k1=state["k1"], b=state["b"])
+        index.vocabulary = {term: i for i, term in enumerate(state["terms"])}
+        index.vocabulary_bytes = sum(sys.getsizeof(term) + 100 for term in state["terms"])
+        index.indptr = state["indptr"]
+        index.rows = state["rows"]
+        index.tfs = state["tfs"]
+        index.doc_ids = state["doc_ids"]
+        index.doc_lengths = state["doc_lengths"]
+        index.total_length = int(index.doc_lengths.sum())
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of chunk ids; returns [(chunk_id, score)] best first"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] += 1.0 / (k + rank + 1)
+    return scores.most_common()
@@ -0,0 +1,112 @@
+import re
+
+from rag_service.embedder import estimate_tokens
+
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+_TERMINATED = re.compile(r"[.!?][\"')\]]*$")
+
+
+def _split_long(sentence, max_tokens):
+    """Split a sentence longer than `max_tokens` on word boundaries"""
+    piece = []
+    tokens = 0
+    for word in sentence.split():
+        size = estimate_tokens(word + " ")
+        if piece and tokens + size > max_tokens:
+            yield " ".join(piece)
+            piece = []
+            tokens = 0
+        piece.append(word)
+        tokens += size
+    if piece:
+        yield " ".join(piece)
+
+
+def _pieces(sentence, ends_paragraph, max_tokens):
+    pieces = list(_split_long(sentence, max_tokens))
+    for i, piece in enumerate(pieces):
+        yield piece, ends_paragraph and i == len(pieces) - 1
+
+
+def iter_sentences(pages, max_tokens):
+    """
+    Yield (sentence, ends_paragraph) from an iterable of page texts. An
+    unterminated sentence at the end of a page is joined with the start of
+    the next page, unless it is already longer than `max_tokens`.
+    """
+    carry = ""
+    for page in pages:
+        paragraphs = [" ".join(p.split()) for p in _PARAGRAPH_BREAK.split(page or "")]
+        paragraphs[0] = f"{carry} {paragraphs[0]}".strip()
+        carry = ""
+
+        last = len(paragraphs) - 1
+        for p, paragraph in enumerate(paragraphs):
+            if not paragraph:
+                continue
+            sentences = _SENTENCE_END.split(paragraph)
+            tail = sentences[-1]
+            if p == last and not _TERMINATED.search(tail) and estimate_tokens(tail) < max_tokens:
+                carry = sentences.pop()
+            for i, sentence in enumerate(sentences):
+                ends_paragraph = i == len(sentences) - 1 and not carry
+                yield from _pieces(sentence, ends_paragraph, max_tokens)
+
+    if carry:
+        yield from _pieces(carry, True, max_tokens)
+
+
+def iter_chunks(pages, chunk_tokens=256, overlap_tokens=32, min_tokens=32):
+    """
+    Yield text chunks of about `chunk_tokens` estimated tokens from an
+    iterable of page texts, breaking only between sentences and preferring
+    paragraph ends. Each chunk starts with up to `overlap_tokens` of trailing
+    sentences from the previous one. A final chunk shorter than `min_tokens`
+    is merged into the previous chunk instead of being dropped.
+    """
+    buffer = []          # [(sentence, tokens)]
+    buffered = 0
+    fresh = 0            # sentences in buffer not carried over as overlap
+    pending = None       # last chunk, held back in case the tail is merged into it
+
+    def emit():
+        nonlocal buffer, buffered, fresh
+        text = " ".join(s for s, _ in buffer)
+        overlap = []
+        size = 0
+        for sentence, tokens in reversed(buffer):
+            if size + tokens > overlap_tokens:
+                break
+            overlap.insert(0, (sentence, tokens))
+            size += tokens
+        buffer, buffered, fresh = overlap, size, 0
+        return text
+
+    max_sentence_tokens = max(1, chunk_tokens - overlap_tokens)
+    for sentence, ends_paragraph in iter_sentences(pages, max_sentence_tokens):
+        tokens = estimate_tokens(sentence + " ")
+        if fresh and buffered + tokens > chunk_tokens:
+            if pending is not None:
+                yield pending
+            pending = emit()
+        buffer.append((sentence, tokens))
+        buffered += tokens
+        fresh += 1
+        if ends_paragraph and buffered >= chunk_tokens // 2:
+            if pending is not None:
+                yield pending
+            pending = emit()
+
+    if fresh:
+        tail = buffer[len(buffer) - fresh:]
+        tail_tokens = sum(tokens for _, tokens in tail)
+        if pending is not None and tail_tokens < min_tokens:
+            pending = f"{pending} " + " ".join(s for s, _ in tail)
+        else:
+            if pending is not None:
+                yield pending
+            pending = " ".join(s for s, _ in buffer)
+    if pending is not None:
+        yield pending
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def mmr_order(query_vector, vectors, lambda_):
+    """
+    Yield row indices of `vectors` (normalized) in maximal marginal relevance
+    order: each pick maximises lambda * sim(query, doc) - (1 - lambda) *
+    max sim(doc, already picked). lambda = 1 is plain relevance order.
+    """
+    relevance = vectors @ query_vector
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    remaining = np.ones(len(vectors), dtype=bool)
+    for picked in range(len(vectors)):
+        scores = lambda_ * relevance - (1.0 - lambda_) * redundancy
+        scores[~remaining] = -np.inf
+        row = int(np.argmax(scores))
+        yield row
+        remaining[row] = False
+        redundancy = similarity[row] if picked == 0 else np.maximum(redundancy, similarity[row])
+
+
+def merge_text(first, second):
+    """Join two consecutive chunks, dropping the words the second repeats from the first"""
+    head, tail = first.split(), second.split()
+    for size in range(min(len(head), len(tail)), 0, -1):
+        if head[-size:] == tail[:size]:
+            return " ".join(head + tail[size:])
+    return " ".join(head + tail)
+
+
+def spans(picked, positions):
+    """
+    Group picked chunk ids into runs of consecutive chunks of one document.
+
+    `positions` maps a chunk id to (source code, row) where consecutive rows
+    of one source are neighbouring chunks; ids without a position stand
+    alone. Spans keep the order of their best-ranked chunk and list their
+    ids in document order.
+    """
+    runs = []
+    run_of = {}
+    for chunk_id in picked:
+        position = positions.get(chunk_id)
+        run = None
+        if position is not None:
+            source, row = position
+            before = run_of.get((source, row - 1))
+            after = run_of.get((source, row + 1))
+            run = before or after
+            if before is not None and after is not None and before is not after:
+                before.extend(after)
+                runs.remove(after)
+                for key in list(run_of):
+                    if run_of[key] is after:
+                        run_of[key] = before
+        if run is None:
+            run = []
+            runs.append(run)
+        run.append(chunk_id)
+        if position is not None:
+            run_of[position] = run
+
+    return [
+        sorted(run, key=lambda c: positions[c][1] if c in positions else 0)
+        for run in runs
+    ]
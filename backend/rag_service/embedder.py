@@ -0,0 +1,147 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+from django.conf import settings
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for size limits"""
+    return max(1, -(-len(text) // 4))
+
+
+def project(vectors, dimension):
+    """
+    Matryoshka projection: keep the leading `dimension` components of each
+    vector and renormalize to unit length. A `dimension` of 0 keeps the
+    vectors as they are.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimension:
+        return vectors
+    if vectors.shape[-1] < dimension:
+        raise ValueError(f"Cannot project {vectors.shape[-1]}-dimensional vectors up to {dimension}")
+    vectors = vectors[..., :dimension]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def plan_batches(texts, max_items, max_tokens):
+    """
+    Group consecutive texts into batches of at most `max_items` texts and
+    `max_tokens` estimated tokens. A single text over the token limit gets a
+    batch of its own. Returns a list of (start, end) slices.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        size = estimate_tokens(text)
+        full = i - start >= max_items or (i > start and tokens + size > max_tokens)
+        if full:
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += size
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+# Failures to reach the API at all, as opposed to an answer from it.
+_TRANSPORT_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError)
+
+
+def _is_retryable(error):
+    """Transport errors, timeouts, rate limits and server errors; not bad requests or bugs"""
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and (code in (408, 429) or code >= 500)
+
+
+def _with_retries(embed_batch, texts):
+    attempts = settings.RAG_EMBED_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            return np.asarray(embed_batch(texts), dtype=np.float32)
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_retryable(e):
+                raise
+            delay = settings.RAG_EMBED_RETRY_BACKOFF * (2 ** attempt)
+            print(f"⚠️ Embedding batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s.")
+            time.sleep(delay + random.uniform(0, delay))
+
+
+async def _awith_retries(embed_batch, texts):
+    attempts = settings.RAG_EMBED_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            return np.asarray(await embed_batch(texts), dtype=np.float32)
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_retryable(e):
+                raise
+            delay = settings.RAG_EMBED_RETRY_BACKOFF * (2 ** attempt)
+            print(f"⚠️ Embedding batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+
+def embed_in_batches(texts, embed_batch):
+    """
+    Embed `texts` with `embed_batch(list_of_texts)`, split into batches within
+    the configured item and token limits and run on a bounded thread pool.
+    Each batch is retried on its own with exponential backoff; the result
+    keeps the input order.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    batches = plan_batches(
+        texts, settings.RAG_EMBED_BATCH_MAX_ITEMS, settings.RAG_EMBED_BATCH_MAX_TOKENS
+    )
+    if len(batches) == 1:
+        return _with_retries(embed_batch, texts)
+
+    workers = max(1, min(settings.RAG_EMBED_CONCURRENCY, len(batches)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-embed")
+    try:
+        futures = [
+            pool.submit(_with_retries, embed_batch, texts[start:end]) for start, end in batches
+        ]
+        return np.vstack([future.result() for future in futures])
+    finally:
+        # On failure, drop batches that have not started instead of waiting for them.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def aembed_in_batches(texts, embed_batch):
+    """
+    Async embed_in_batches: `embed_batch` is a coroutine function, and at most
+    RAG_EMBED_CONCURRENCY batches are awaited at once on the event loop.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    batches = plan_batches(
+        texts, settings.RAG_EMBED_BATCH_MAX_ITEMS, settings.RAG_EMBED_BATCH_MAX_TOKENS
+    )
+    if len(batches) == 1:
+        return await _awith_retries(embed_batch, texts)
+
+    slots = asyncio.Semaphore(max(1, settings.RAG_EMBED_CONCURRENCY))
+
+    async def run(start, end):
+        async with slots:
+            return await _awith_retries(embed_batch, texts[start:end])
+
+    tasks = [asyncio.ensure_future(run(start, end)) for start, end in batches]
+    try:
+        return np.vstack(await asyncio.gather(*tasks))
+    finally:
+        # gather leaves the other batches running when one fails, or when
+        # this coroutine is cancelled; stop them here.
+        for task in tasks:
+            task.cancel()
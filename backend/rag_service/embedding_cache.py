@@ -0,0 +1,249 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from core.models import EmbeddingCacheEntry
+
+
+# Keeps IN (...) lookups under SQLite's bound-parameter limit.
+_LOOKUP_BATCH_SIZE = 500
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def as_dict(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+stats = _Stats()
+query_stats = _Stats()
+
+
+def normalize_text(text):
+    """Canonical form of a chunk for hashing: NFC with collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def lookup(texts, model_name, task_type, dimension=0):
+    """
+    Split `texts` into cached vectors and texts still to embed. Returns
+    (hashes, {hash: vector}, {hash: text}), with one hash per text.
+    """
+    hashes = [text_hash(t) for t in texts]
+    if not settings.RAG_EMBEDDING_CACHE:
+        return hashes, {}, dict(zip(hashes, texts))
+
+    entries = EmbeddingCacheEntry.objects.filter(
+        model_name=model_name, task_type=task_type, dimension=dimension
+    )
+
+    cached = {}
+    unique_hashes = list(dict.fromkeys(hashes))
+    for start in range(0, len(unique_hashes), _LOOKUP_BATCH_SIZE):
+        batch = unique_hashes[start:start + _LOOKUP_BATCH_SIZE]
+        for h, blob in entries.filter(text_hash__in=batch).values_list("text_hash", "embedding"):
+            cached[h] = np.frombuffer(blob, dtype=np.float32)
+
+    missing = {}
+    for text, h in zip(texts, hashes):
+        if h not in cached and h not in missing:
+            missing[h] = text
+
+    stats.record(hits=len(texts) - len(missing), misses=len(missing))
+    return hashes, cached, missing
+
+
+def store(vectors, model_name, task_type, dimension=0):
+    """Cache freshly computed vectors given as {hash: vector}"""
+    if not settings.RAG_EMBEDDING_CACHE or not vectors:
+        return
+    EmbeddingCacheEntry.objects.bulk_create(
+        [
+            EmbeddingCacheEntry(
+                model_name=model_name,
+                task_type=task_type,
+                dimension=dimension,
+                text_hash=h,
+                embedding=np.asarray(vector, dtype=np.float32).tobytes(),
+            )
+            for h, vector in vectors.items()
+        ],
+        batch_size=settings.RAG_BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def get_or_embed(texts, embed, model_name, task_type, dimension=0):
+    """
+    Return one float32 vector per text, calling `embed(missing_texts)` only
+    for texts whose (model, task type, dimension, content hash) is not cached.
+    """
+    if not settings.RAG_EMBEDDING_CACHE or not texts:
+        return embed(texts)
+
+    hashes, cached, missing = lookup(texts, model_name, task_type, dimension)
+    if missing:
+        vectors = dict(zip(missing, np.asarray(embed(list(missing.values())), dtype=np.float32)))
+        store(vectors, model_name, task_type, dimension)
+        cached.update(vectors)
+
+    return np.vstack([cached[h] for h in hashes])
+
+
+def query_key(query, model_name, task_type, dimension=0):
+    """Cache key of a search query: its case-folded normalized text plus the embedding setup"""
+    text = normalize_text(query).casefold()
+    digest = hashlib.sha256(f"{model_name}|{task_type}|{dimension}|{text}".encode("utf-8"))
+    return f"rag-query-embedding:{digest.hexdigest()}"
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query embeddings whose entries expire after
+    RAG_QUERY_CACHE_TTL seconds. When RAG_QUERY_CACHE_BACKEND names a Django
+    cache, local misses are looked up there, so workers share their vectors.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            found = {}
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, vector = entry
+                if expires_at <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = vector
+            return found
+
+    def put_many(self, vectors):
+        size = settings.RAG_QUERY_CACHE_SIZE
+        if size <= 0:
+            return
+        expires_at = time.monotonic() + settings.RAG_QUERY_CACHE_TTL
+        with self.lock:
+            for key, vector in vectors.items():
+                self.entries[key] = (expires_at, vector)
+                self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _shared(self):
+        alias = settings.RAG_QUERY_CACHE_BACKEND
+        return caches[alias] if alias else None
+
+    def _missing(self, queries, keys, found):
+        """The queries still to embed, once per key, keyed like `found`"""
+        missing = {}
+        for query, key in zip(queries, keys):
+            if key not in found and key not in missing:
+                missing[key] = query
+        query_stats.record(hits=len(queries) - len(missing), misses=len(missing))
+        return missing
+
+    def get_or_embed(self, queries, embed, model_name, task_type, dimension=0):
+        """
+        Return one float32 vector per query, calling `embed(missing_queries)`
+        only for queries not cached locally or in the shared backend.
+        """
+        if settings.RAG_QUERY_CACHE_SIZE <= 0 or not queries:
+            return embed(queries)
+
+        keys = [query_key(q, model_name, task_type, dimension) for q in queries]
+        found = self.get_many(keys)
+
+        shared = self._shared()
+        if shared is not None:
+            absent = [k for k in dict.fromkeys(keys) if k not in found]
+            if absent:
+                fetched = {
+                    k: np.frombuffer(blob, dtype=np.float32)
+                    for k, blob in shared.get_many(absent).items()
+                }
+                self.put_many(fetched)
+                found.update(fetched)
+
+        missing = self._missing(queries, keys, found)
+        if missing:
+            vectors = dict(zip(missing, np.asarray(embed(list(missing.values())), dtype=np.float32)))
+            self.put_many(vectors)
+            if shared is not None:
+                shared.set_many(
+                    {k: v.tobytes() for k, v in vectors.items()},
+                    timeout=settings.RAG_QUERY_CACHE_TTL,
+                )
+            found.update(vectors)
+
+        return np.vstack([found[k] for k in keys])
+
+    async def aget_or_embed(self, queries, embed, model_name, task_type, dimension=0):
+        """Async get_or_embed, for a coroutine function `embed`"""
+        if settings.RAG_QUERY_CACHE_SIZE <= 0 or not queries:
+            return await embed(queries)
+
+        keys = [query_key(q, model_name, task_type, dimension) for q in queries]
+        found = self.get_many(keys)
+
+        shared = self._shared()
+        if shared is not None:
+            absent = [k for k in dict.fromkeys(keys) if k not in found]
+            if absent:
+                fetched = {
+                    k: np.frombuffer(blob, dtype=np.float32)
+                    for k, blob in (await shared.aget_many(absent)).items()
+                }
+                self.put_many(fetched)
+                found.update(fetched)
+
+        missing = self._missing(queries, keys, found)
+        if missing:
+            embedded = await embed(list(missing.values()))
+            vectors = dict(zip(missing, np.asarray(embedded, dtype=np.float32)))
+            self.put_many(vectors)
+            if shared is not None:
+                await shared.aset_many(
+                    {k: v.tobytes() for k, v in vectors.items()},
+                    timeout=settings.RAG_QUERY_CACHE_TTL,
+                )
+            found.update(vectors)
+
+        return np.vstack([found[k] for k in keys])
+
+
+query_cache = QueryEmbeddingCache()
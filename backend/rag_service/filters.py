@@ -0,0 +1,137 @@
+import json
+from datetime import datetime
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+FILTER_KEYS = ("source", "metadata", "created_after", "created_before")
+
+_MISSING = -1
+
+
+def _to_micros(value):
+    """Epoch microseconds of a datetime or ISO 8601 string"""
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid datetime: {value}")
+        value = parsed
+    if not isinstance(value, datetime):
+        raise ValueError(f"Invalid datetime: {value!r}")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return int(value.timestamp() * 1_000_000)
+
+
+def _encode_value(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def validate_filters(filters):
+    """Raise ValueError for a malformed filter expression"""
+    if not filters:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError("Filters must be an object.")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter keys: {', '.join(sorted(unknown))}")
+    sources = filters.get("source")
+    if sources is not None and not isinstance(sources, str) and not (
+        isinstance(sources, list) and all(isinstance(s, str) for s in sources)
+    ):
+        raise ValueError("The 'source' filter must be a string or a list of strings.")
+    if "metadata" in filters and not isinstance(filters["metadata"], dict):
+        raise ValueError("The 'metadata' filter must be an object.")
+    for key in ("created_after", "created_before"):
+        if filters.get(key) is not None:
+            _to_micros(filters[key])
+
+
+class ColumnStore:
+    """
+    Chunk metadata as dictionary-encoded numpy columns, one row per entry of
+    the shared index's id array, so a filter expression becomes a few
+    vectorised comparisons.
+
+    Filters are a dict of any of:
+        source          a source name or list of names
+        metadata        {key: value} that must all match exactly
+        created_after   datetime or ISO string, inclusive
+        created_before  datetime or ISO string, exclusive
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.source_codes = np.empty(0, dtype=np.int32)
+        self.source_dict = {}
+        self.created_at = np.empty(0, dtype=np.int64)
+        self.metadata_codes = {}
+        self.metadata_dicts = {}
+
+    def append(self, sources, created_ats, metadatas):
+        count = len(sources)
+        codes = [self.source_dict.setdefault(s, len(self.source_dict)) for s in sources]
+        self.source_codes = np.concatenate([self.source_codes, np.array(codes, dtype=np.int32)])
+        self.created_at = np.concatenate([
+            self.created_at,
+            np.array([_to_micros(c) for c in created_ats], dtype=np.int64),
+        ])
+
+        new_codes = {key: np.full(count, _MISSING, dtype=np.int32) for key in self.metadata_codes}
+        for row, metadata in enumerate(metadatas):
+            for key, value in (metadata or {}).items():
+                if key not in new_codes:
+                    self.metadata_codes[key] = np.full(self.size, _MISSING, dtype=np.int32)
+                    self.metadata_dicts[key] = {}
+                    new_codes[key] = np.full(count, _MISSING, dtype=np.int32)
+                values = self.metadata_dicts[key]
+                new_codes[key][row] = values.setdefault(_encode_value(value), len(values))
+        for key, column in new_codes.items():
+            self.metadata_codes[key] = np.concatenate([self.metadata_codes[key], column])
+        self.size += count
+
+    def take(self, keep):
+        """Keep only the rows where the boolean array `keep` is set"""
+        self.source_codes = self.source_codes[keep]
+        self.created_at = self.created_at[keep]
+        for key, column in self.metadata_codes.items():
+            self.metadata_codes[key] = column[keep]
+        self.size = int(np.count_nonzero(keep))
+
+    def mask(self, filters):
+        """Boolean array over rows that match `filters`, or None if there are none"""
+        validate_filters(filters)
+        if not filters:
+            return None
+
+        mask = np.ones(self.size, dtype=bool)
+
+        sources = filters.get("source")
+        if sources is not None:
+            if isinstance(sources, str):
+                sources = [sources]
+            codes = [self.source_dict[s] for s in sources if s in self.source_dict]
+            mask &= np.isin(self.source_codes, codes)
+
+        for key, value in (filters.get("metadata") or {}).items():
+            code = self.metadata_dicts.get(key, {}).get(_encode_value(value))
+            if code is None:
+                mask[:] = False
+                break
+            mask &= self.metadata_codes[key] == code
+
+        if filters.get("created_after") is not None:
+            mask &= self.created_at >= _to_micros(filters["created_after"])
+        if filters.get("created_before") is not None:
+            mask &= self.created_at < _to_micros(filters["created_before"])
+        return mask
+
+    def memory_bytes(self):
+        return (
+            self.source_codes.nbytes
+            + self.created_at.nbytes
+            + sum(c.nbytes for c in self.metadata_codes.values())
+        )
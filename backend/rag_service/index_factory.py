@@ -0,0 +1,313 @@
+import math
+import time
+
+import numpy as np
+import faiss
+from django.conf import settings
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# How vectors are stored inside the index; anything but "none" is lossy and
+# is followed by an exact re-rank of a small candidate set.
+CODECS = ("none", "sq8", "sq4", "pq")
+
+# Corpus sizes at which the "auto" policy moves to the next index type.
+AUTO_FLAT_MAX = 20_000
+AUTO_HNSW_MAX = 200_000
+AUTO_IVF_FLAT_MAX = 2_000_000
+
+# Trained indexes (IVF, SQ, PQ) are retrained once the corpus outgrows their training set by this factor.
+IVF_RETRAIN_GROWTH = 4
+
+# k-means wants ~39 points per centroid, PQ needs 2**8 points per codebook.
+_MIN_POINTS_PER_LIST = 39
+_PQ_NBITS = 8
+
+# Upper bound for efSearch when it is widened for a selective filter.
+_FILTERED_EF_SEARCH_MAX = 1024
+
+
+def choose_index_type(count):
+    """Pick the index type for a corpus of `count` vectors"""
+    configured = settings.RAG_INDEX_TYPE
+    if configured != "auto":
+        if configured not in INDEX_TYPES:
+            raise ValueError(f"Unknown RAG_INDEX_TYPE: {configured}")
+        return configured
+
+    if count <= AUTO_FLAT_MAX:
+        return "flat"
+    if count <= AUTO_HNSW_MAX:
+        return "hnsw"
+    if count <= AUTO_IVF_FLAT_MAX:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def configured_codec():
+    codec = settings.RAG_VECTOR_CODEC
+    if codec not in CODECS:
+        raise ValueError(f"Unknown RAG_VECTOR_CODEC: {codec}")
+    return codec
+
+
+def is_lossy(index_type, codec):
+    """Whether search scores from this index are approximate and worth re-ranking"""
+    return codec != "none" or index_type == "ivf_pq"
+
+
+def needs_rebuild(index_type, codec, trained_on, count):
+    """Whether an index built as `index_type` / `codec` should be rebuilt for `count` vectors"""
+    if index_type != choose_index_type(count) or codec != configured_codec():
+        return True
+    trained = codec != "none" or index_type in ("ivf_flat", "ivf_pq")
+    return trained and count > IVF_RETRAIN_GROWTH * trained_on
+
+
+def normalize(vectors):
+    """Unit-length float32 copy of `vectors`, so inner product equals cosine similarity"""
+    vectors = np.array(vectors, dtype=np.float32, order="C", copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _base_index(index):
+    """The index behind an IndexIDMap wrapper (if any), downcast to its concrete type"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index):
+    """Name of the index type behind a FAISS index"""
+    index = _base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def estimate_bytes(index):
+    """Approximate resident size of a FAISS index"""
+    index = faiss.downcast_index(index)
+    size = 0
+    if isinstance(index, faiss.IndexIDMap):
+        size += 8 * index.ntotal
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        return size + index.ntotal * (storage.code_size + 4 * index.hnsw.nb_neighbors(0))
+    if isinstance(index, faiss.IndexIVF):
+        return size + index.ntotal * (index.code_size + 8) + index.quantizer.ntotal * 4 * index.d
+    return size + index.ntotal * index.sa_code_size()
+
+
+def _storage_string(codec, dim, count):
+    if codec == "sq8":
+        return "SQ8"
+    if codec == "sq4":
+        return "SQ4"
+    if codec == "pq" and count >= 2 ** _PQ_NBITS:
+        pq_m = max(m for m in range(1, settings.RAG_PQ_M + 1) if dim % m == 0)
+        return f"PQ{pq_m}x{_PQ_NBITS}"
+    return "Flat"
+
+
+def _factory_string(index_type, dim, count, codec="none"):
+    storage = _storage_string("pq" if index_type == "ivf_pq" else codec, dim, count)
+
+    if index_type == "hnsw":
+        if storage == "Flat":
+            return f"HNSW{settings.RAG_HNSW_M}"
+        return f"HNSW{settings.RAG_HNSW_M},{storage}"
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = settings.RAG_IVF_NLIST or int(4 * math.sqrt(count))
+        nlist = max(1, min(nlist, count // _MIN_POINTS_PER_LIST))
+        return f"IVF{nlist},{storage}"
+
+    return storage
+
+
+def supports_removal(index):
+    """Whether vectors can be removed from the index in place (HNSW graphs cannot)"""
+    return index_type_of(index) != "hnsw"
+
+
+def with_ids(index):
+    """
+    Index that stores vectors under caller-given ids. IVF indexes keep ids
+    in their inverted lists and remove them natively; other types get an
+    IndexIDMap. An IndexIDMap must not wrap an IVF index: IVF removal does
+    not renumber the sub-index, so the map's ids drift after a removal.
+    """
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        return index
+    return faiss.IndexIDMap(index)
+
+
+def has_valid_ids(index):
+    """False for an IndexIDMap wrapped around an IVF index (see with_ids)"""
+    index = faiss.downcast_index(index)
+    return not (
+        isinstance(index, faiss.IndexIDMap)
+        and isinstance(faiss.downcast_index(index.index), faiss.IndexIVF)
+    )
+
+
+def build_index(index_type, vectors, codec="none"):
+    """
+    Create an empty inner-product index of the given type and codec,
+    training it on `vectors` (normalized) when required
+    """
+    count, dim = vectors.shape
+    index = faiss.index_factory(
+        dim, _factory_string(index_type, dim, count, codec), faiss.METRIC_INNER_PRODUCT
+    )
+
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = settings.RAG_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vectors)
+
+    configure_search(index)
+    return index
+
+
+def configure_search(index, ef_search=None, nprobe=None):
+    """Apply the efSearch / nprobe search-time parameters to an index"""
+    index_type = index_type_of(index)
+    params = faiss.ParameterSpace()
+    if index_type == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search or settings.RAG_HNSW_EF_SEARCH)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        params.set_index_parameter(index, "nprobe", nprobe or settings.RAG_IVF_NPROBE)
+
+
+def filtered_search_parameters(index, allowed=None, excluded=None):
+    """
+    SearchParameters that restrict a search on an ID-mapped index to the ids
+    in `allowed`, or away from the ids in `excluded`. efSearch / nprobe are
+    widened in proportion to how selective the filter is, since graph and
+    IVF searches otherwise run out of matching candidates.
+
+    Returns (params, keepalive); `keepalive` must outlive the search call.
+    """
+    ids = np.ascontiguousarray(allowed if allowed is not None else excluded, dtype=np.int64)
+    batch = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+    if allowed is not None:
+        selector = batch
+        widen = index.ntotal / max(1, len(ids))
+    else:
+        selector = faiss.IDSelectorNot(batch)
+        widen = index.ntotal / max(1, index.ntotal - len(ids))
+
+    base = _base_index(index)
+    index_type = index_type_of(index)
+    if index_type == "hnsw":
+        params = faiss.SearchParametersHNSW()
+        ef_search = base.hnsw.efSearch
+        params.efSearch = max(ef_search, min(int(ef_search * widen), _FILTERED_EF_SEARCH_MAX))
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF()
+        nprobe = base.nprobe
+        params.nprobe = max(nprobe, min(math.ceil(nprobe * widen), base.nlist))
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params, (ids, batch, selector)
+
+
+def recall_at_k(index, queries, ground_truth, k, vectors=None, rerank_factor=1):
+    """
+    Measure an index against exact neighbours. With `vectors`, the top
+    k * `rerank_factor` candidates are re-ranked by exact inner product.
+
+    Returns (recall@k, mean milliseconds per query).
+    """
+    start = time.perf_counter()
+    _, found = index.search(queries, k * rerank_factor)
+    if vectors is not None:
+        reranked = []
+        for query, row in zip(queries, found):
+            row = row[row >= 0]
+            order = np.argsort(-(vectors[row] @ query))
+            reranked.append(row[order[:k]])
+        found = reranked
+    elapsed = time.perf_counter() - start
+
+    hits = sum(
+        len(set(row[row >= 0][:k].tolist()) & set(truth.tolist()))
+        for row, truth in zip(found, ground_truth[:, :k])
+    )
+    recall = hits / float(len(queries) * k)
+    return recall, 1000.0 * elapsed / len(queries)
+
+
+def recall_report(
+    vectors,
+    queries,
+    k=10,
+    codecs=CODECS,
+    rerank_factor=4,
+    ef_search_values=(16, 32, 64, 128),
+    nprobe_values=(1, 4, 16, 64),
+):
+    """
+    Build every index type and codec over `vectors` and report recall@k and
+    latency against exact cosine search, sweeping efSearch and nprobe. Lossy
+    indexes are also measured with an exact re-rank of k * `rerank_factor`
+    candidates.
+    """
+    vectors = normalize(vectors)
+    queries = normalize(queries)
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in INDEX_TYPES:
+        for codec in codecs:
+            if index_type == "ivf_pq" and codec != "none":
+                continue
+            start = time.perf_counter()
+            index = build_index(index_type, vectors, codec)
+            index.add(vectors)
+            build_seconds = time.perf_counter() - start
+            size_bytes = faiss.serialize_index(index).nbytes
+
+            if index_type == "hnsw":
+                sweep = [("efSearch", v, {"ef_search": v}) for v in ef_search_values]
+            elif index_type in ("ivf_flat", "ivf_pq"):
+                sweep = [("nprobe", v, {"nprobe": v}) for v in nprobe_values]
+            else:
+                sweep = [("-", "-", {})]
+
+            for name, value, params in sweep:
+                configure_search(index, **params)
+                recall, latency_ms = recall_at_k(index, queries, ground_truth, k)
+                if is_lossy(index_type, codec):
+                    reranked, _ = recall_at_k(
+                        index, queries, ground_truth, k, vectors, rerank_factor
+                    )
+                else:
+                    reranked = recall
+                rows.append({
+                    "index_type": index_type,
+                    "codec": codec,
+                    "factory": _factory_string(index_type, vectors.shape[1], len(vectors), codec),
+                    "param": name,
+                    "value": value,
+                    "recall": recall,
+                    "reranked_recall": reranked,
+                    "latency_ms": latency_ms,
+                    "build_seconds": build_seconds,
+                    "size_bytes": size_bytes,
+                    "bytes_per_vector": size_bytes / len(vectors),
+                })
+    return rows
@@ -0,0 +1,191 @@
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from core.helper import iter_pdf_pages, save_file
+from core.models import IngestionJob
+from rag_service.rag_service import RAGIndex, namespace_for
+
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+# Uploads wait for the worker here, under <namespace>/<random name>.pdf.
+UPLOAD_DIR = "rag_uploads"
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def save_upload(api_key, upload):
+    """
+    Save an uploaded PDF under a path of its own inside the caller's
+    namespace directory, so uploads with the same name never overwrite each
+    other before the worker reads them. Returns the path, or None on failure.
+    """
+    directory = os.path.join(UPLOAD_DIR, namespace_for(api_key))
+    return save_file(upload, directory=directory, file_name=f"{uuid.uuid4().hex}.pdf")
+
+
+def _discard_upload(job):
+    """Delete a job's saved PDF once it is no longer needed"""
+    try:
+        os.remove(job.file_path)
+    except OSError:
+        pass
+
+
+def enqueue(api_key, source, file_path):
+    """Queue a saved PDF for ingestion into the caller's RAG namespace"""
+    return IngestionJob.objects.create(api_key=api_key or "", source=source, file_path=file_path)
+
+
+def describe(job):
+    """Public view of a job's state and progress"""
+    return {
+        "id": job.id,
+        "source": job.source,
+        "status": job.status,
+        "cancel_requested": job.cancel_requested,
+        "pages_parsed": job.pages_parsed,
+        "chunks_embedded": job.chunks_embedded,
+        "chunks_indexed": job.chunks_indexed,
+        "error": job.error,
+        "created_at": job.created_at,
+        "attempts": job.attempts,
+        "started_at": job.started_at,
+        "heartbeat_at": job.heartbeat_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _lease_expired():
+    """Running jobs whose worker has not reported progress within RAG_INGEST_LEASE_SECONDS"""
+    cutoff = timezone.now() - timedelta(seconds=settings.RAG_INGEST_LEASE_SECONDS)
+    return IngestionJob.objects.filter(status="running").filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+
+
+def reclaim_stale():
+    """
+    Take back running jobs whose worker died: cancel those that were asked
+    to stop, fail those out of attempts and requeue the rest. Returns how
+    many jobs were reclaimed.
+    """
+    reclaimed = 0
+    for job in _lease_expired():
+        stale = IngestionJob.objects.filter(id=job.id, status="running", attempts=job.attempts)
+        if job.cancel_requested:
+            finished = stale.update(status="cancelled", finished_at=timezone.now())
+        elif job.attempts >= settings.RAG_INGEST_MAX_ATTEMPTS:
+            finished = stale.update(
+                status="failed",
+                error=f"The worker stopped responding {job.attempts} times.",
+                finished_at=timezone.now(),
+            )
+        else:
+            reclaimed += stale.update(status="queued", heartbeat_at=None)
+            continue
+        if finished:
+            _discard_upload(job)
+            reclaimed += 1
+    return reclaimed
+
+
+def cancel(job):
+    """
+    Cancel a job: a queued job is cancelled at once, a running one stops
+    after its current batch. Returns False if the job already finished.
+    """
+    if IngestionJob.objects.filter(id=job.id, status="queued").update(
+        status="cancelled", cancel_requested=True, finished_at=timezone.now()
+    ):
+        _discard_upload(job)
+        return True
+    if not IngestionJob.objects.filter(id=job.id, status="running").update(cancel_requested=True):
+        return False
+    # A job whose worker died can be cancelled right away.
+    reclaim_stale()
+    return True
+
+
+def claim_next():
+    """
+    Mark the oldest queued job as running and return it, or None if there
+    is none. Jobs left running by a dead worker are requeued first.
+    """
+    reclaim_stale()
+    while True:
+        job = IngestionJob.objects.filter(status="queued").order_by("id").first()
+        if job is None:
+            return None
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = IngestionJob.objects.filter(id=job.id, status="queued").update(
+                status="running", started_at=now, heartbeat_at=now, attempts=F("attempts") + 1
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run(job):
+    """
+    Ingest a claimed job's PDF page by page, recording progress after each
+    batch and stopping if the job is cancelled meanwhile.
+
+    Each progress report renews the job's lease. If the lease was lost
+    meanwhile (the job was reclaimed and handed to another worker), this run
+    is abandoned without touching the job or its file.
+    """
+    pages_parsed = 0
+    # This run's hold on the job; reclaiming the job bumps attempts or its status.
+    held = IngestionJob.objects.filter(id=job.id, status="running", attempts=job.attempts)
+
+    def counted(pages):
+        nonlocal pages_parsed
+        for page in pages:
+            pages_parsed += 1
+            yield page
+
+    def progress(chunks_embedded, chunks_written):
+        renewed = held.update(
+            pages_parsed=pages_parsed,
+            chunks_embedded=chunks_embedded,
+            chunks_indexed=chunks_written,
+            heartbeat_at=timezone.now(),
+        )
+        if not renewed:
+            raise LeaseLost(f"Ingestion job {job.id} was reclaimed by another worker.")
+        if IngestionJob.objects.filter(id=job.id, cancel_requested=True).exists():
+            raise IngestionCancelled(f"Ingestion job {job.id} was cancelled.")
+
+    try:
+        with open(job.file_path, "rb") as pdf_file:
+            rag_index = RAGIndex(api_key=job.api_key)
+            added = rag_index.add_pages(
+                job.source, counted(iter_pdf_pages(pdf_file)), replace=True, progress=progress
+            )
+        if not added:
+            raise ValueError("No text could be extracted from PDF.")
+        outcome = {"status": "succeeded", "chunks_embedded": added, "chunks_indexed": added}
+    except Exception as e:
+        job.refresh_from_db(fields=["cancel_requested"])
+        if job.cancel_requested:
+            outcome = {"status": "cancelled", "chunks_indexed": 0}
+        else:
+            outcome = {"status": "failed", "error": str(e), "chunks_indexed": 0}
+
+    if held.update(pages_parsed=pages_parsed, finished_at=timezone.now(), **outcome):
+        _discard_upload(job)
+    job.refresh_from_db()
+    return job
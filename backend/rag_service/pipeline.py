@@ -0,0 +1,78 @@
+import queue
+import threading
+
+
+# How often a blocked stage checks whether the pipeline was abandoned.
+_POLL_SECONDS = 0.1
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(source, stop):
+    while not stop.is_set():
+        try:
+            item = source.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def _feed(iterable, out, stop):
+    try:
+        for item in iterable:
+            if not _put(out, item, stop):
+                return
+    except BaseException as e:
+        _put(out, _Failure(e), stop)
+        return
+    _put(out, _END, stop)
+
+
+def staged(source, *stages, maxsize=2, name="rag-pipeline"):
+    """
+    Run `source` and each stage on its own thread, connected by queues of
+    at most `maxsize` items, and yield the last stage's output.
+
+    A stage is a function from an iterator to an iterator, e.g. a generator
+    that turns pages into chunk batches. Bounded queues keep each stage at
+    most `maxsize` items ahead of the next, so memory stays proportional to
+    a few items however long the source is. An exception in any stage is
+    re-raised to the consumer; abandoning the generator stops every stage.
+    """
+    stop = threading.Event()
+    threads = []
+    iterable = source
+    for position, stage in enumerate((*stages, None)):
+        out = queue.Queue(maxsize=maxsize)
+        threads.append(threading.Thread(
+            target=_feed, args=(iterable, out, stop), name=f"{name}-{position}", daemon=True
+        ))
+        iterable = _drain(out, stop) if stage is None else stage(_drain(out, stop))
+
+    for thread in threads:
+        thread.start()
+    try:
+        yield from iterable
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
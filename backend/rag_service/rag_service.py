@@ -1,126 +1,1129 @@
+import atexit
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
 import numpy as np
 import faiss
-from google import genai
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from google.genai import types
-from langchain_core.documents import Document
-from core.models import RagChunk
+from ai_service.client_pool import get_client
+from core.models import RagChunk, RagCorpusVersion
+from rag_service import chunker, diversity, embedder, embedding_cache, index_factory, pipeline, snapshot
+from rag_service.bm25 import BM25Index, reciprocal_rank_fusion
+from rag_service.filters import ColumnStore, validate_filters
+
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+
+def namespace_for(api_key):
+    """Namespace that partitions a tenant's chunks: a hash of their API key"""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:32]
+
+
+def _current_corpus_version(namespace):
+    """Return the namespace's corpus version counter stored in the database"""
+    version = (
+        RagCorpusVersion.objects.filter(namespace=namespace)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+def _corpus_state(namespace):
+    """Return the namespace's (corpus version, embedding dimension)"""
+    state = (
+        RagCorpusVersion.objects.filter(namespace=namespace)
+        .values_list("version", "embedding_dimension")
+        .first()
+    )
+    return state or (0, settings.RAG_EMBEDDING_DIMENSION)
+
+
+def _bump_corpus_version(namespace):
+    """Increment the namespace's corpus version counter and return the new value"""
+    _, created = RagCorpusVersion.objects.get_or_create(
+        namespace=namespace,
+        defaults={"version": 1, "embedding_dimension": settings.RAG_EMBEDDING_DIMENSION},
+    )
+    if not created:
+        RagCorpusVersion.objects.filter(namespace=namespace).update(version=F("version") + 1)
+    return _current_corpus_version(namespace)
+
+
+def _encode_embedding(vector, dtype):
+    """Pack one embedding into the raw bytes stored on RagChunk"""
+    return np.asarray(vector, dtype=dtype).tobytes()
+
+
+def _decode_embeddings(blobs, dtypes):
+    """Unpack stored embeddings into one contiguous float32 matrix"""
+    if len(set(dtypes)) == 1:
+        matrix = np.frombuffer(b"".join(blobs), dtype=dtypes[0]).reshape(len(blobs), -1)
+    else:
+        matrix = np.vstack([np.frombuffer(b, dtype=d) for b, d in zip(blobs, dtypes)])
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
+
+class _ChunkTextCache:
+    """Bounded LRU of RagChunk.id -> text for chunks that keep being retrieved"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = OrderedDict()
+
+    def get_many(self, chunk_ids):
+        with self.lock:
+            found = {}
+            for chunk_id in chunk_ids:
+                text = self.texts.get(chunk_id)
+                if text is not None:
+                    self.texts.move_to_end(chunk_id)
+                    found[chunk_id] = text
+            return found
+
+    def put_many(self, texts):
+        size = settings.RAG_CHUNK_TEXT_CACHE_SIZE
+        if size <= 0:
+            return
+        with self.lock:
+            self.texts.update(texts)
+            for chunk_id in texts:
+                self.texts.move_to_end(chunk_id)
+            while len(self.texts) > size:
+                self.texts.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.texts.clear()
+
+
+_chunk_text_cache = _ChunkTextCache()
+
+
+def _chunk_texts(chunk_ids):
+    """RagChunk id -> text, from the hot-chunk cache or one id__in query; unknown ids are left out"""
+    texts = _chunk_text_cache.get_many(chunk_ids)
+    missing = [c for c in set(chunk_ids) if c not in texts]
+    if missing:
+        fetched = dict(RagChunk.objects.filter(id__in=missing).values_list("id", "text"))
+        _chunk_text_cache.put_many(fetched)
+        texts.update(fetched)
+    return texts
+
+
+def _span_text(ids, texts):
+    """The text of a span of neighbouring chunks, given in document order"""
+    text = texts[ids[0]]
+    for i in ids[1:]:
+        text = diversity.merge_text(text, texts[i])
+    return text
+
+
+def _stored_vectors(chunk_ids):
+    """Normalized stored vectors of the given chunks as {chunk_id: vector}, read in one query"""
+    rows = list(
+        RagChunk.objects.filter(id__in=set(chunk_ids)).values_list("id", "embedding", "embedding_dtype")
+    )
+    if not rows:
+        return {}
+    ids, blobs, dtypes = zip(*rows)
+    return dict(zip(ids, index_factory.normalize(_decode_embeddings(blobs, dtypes))))
+
+
+def _exact_rerank(query_vector, hits, vectors):
+    """Re-order [(chunk_id, score)] candidates by exact cosine similarity to the query"""
+    chunk_ids = [c for c, _ in hits if c in vectors]
+    if not chunk_ids:
+        return []
+    scores = np.vstack([vectors[c] for c in chunk_ids]) @ query_vector
+    order = np.argsort(-scores, kind="stable")
+    return [(chunk_ids[i], float(scores[i])) for i in order]
+
+
+def _diversify(hits, k, query_vector=None, vectors=None, positions=None):
+    """
+    Pick up to k chunks from ranked [(chunk_id, score)] candidates. With a
+    query vector, candidates are taken in maximal marginal relevance order
+    (RAG_MMR_LAMBDA); with `positions`, picked chunks that neighbour each
+    other in one document are then grouped into a single span, so the
+    result never carries more than k chunks. Returns [(chunk_ids, score)].
+    """
+    scores = dict(hits)
+    order = [c for c, _ in hits]
+    if query_vector is not None:
+        order = [c for c in order if c in vectors]
+        if order:
+            matrix = np.vstack([vectors[c] for c in order])
+            order = [
+                order[row]
+                for row in diversity.mmr_order(query_vector, matrix, settings.RAG_MMR_LAMBDA)
+            ]
+
+    picked = order[:k]
+    runs = diversity.spans(picked, positions) if positions is not None else [[c] for c in picked]
+    return [(run, max(scores[c] for c in run)) for run in runs]
+
+
+class _SharedIndex:
+    """FAISS index over one namespace's RagChunk rows, shared by every RAGIndex in this worker"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.faiss_index = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.tombstones = np.empty(0, dtype=np.int64)
+        # Built on the first lexical or hybrid search; see RAGIndex._lexical_index.
+        self.bm25 = None
+        self.columns = ColumnStore()
+        self.version = None
+        self.last_id = 0
+        self.mmapped = False
+        self.index_type = None
+        self.codec = None
+        self.trained_on = 0
+        self.dirty = False
+        self.saved_at = float("-inf")
+
+    def memory_bytes(self):
+        """Rough resident size of the index and its id, lexical and metadata columns"""
+        size = self.ids.nbytes + self.tombstones.nbytes
+        size += self.columns.memory_bytes()
+        if self.bm25 is not None:
+            size += self.bm25.memory_bytes()
+        if self.faiss_index is not None:
+            size += index_factory.estimate_bytes(self.faiss_index)
+        return size
+
+    def save_snapshot(self):
+        """Persist the index to disk; caller holds the lock"""
+        try:
+            snapshot.write_snapshot(
+                self.namespace,
+                self.faiss_index,
+                self.ids,
+                self.version,
+                tombstones=self.tombstones,
+                bm25=self.bm25,
+                index_type=self.index_type,
+                codec=self.codec,
+                trained_on=self.trained_on,
+            )
+        except OSError as e:
+            print(f"⚠️ Could not write RAG index snapshot: {e}")
+            return
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def changed(self):
+        """
+        Note an incremental change; caller holds the lock. The snapshot is
+        rewritten at most every RAG_SNAPSHOT_INTERVAL seconds: a worker that
+        loads an older one replays the rows changed since from the database.
+        """
+        self.dirty = True
+        if time.monotonic() - self.saved_at >= settings.RAG_SNAPSHOT_INTERVAL:
+            self.save_snapshot()
+
+
+class _IndexRegistry:
+    """
+    Namespace -> _SharedIndex map for this worker. Indexes are loaded lazily
+    and the least recently used ones are dropped once the total goes over
+    RAG_INDEX_MEMORY_BUDGET_MB; a dropped namespace reloads from its snapshot.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+
+    def get(self, namespace):
+        with self.lock:
+            shared = self.indexes.get(namespace)
+            if shared is None:
+                shared = self.indexes[namespace] = _SharedIndex(namespace)
+            self.indexes.move_to_end(namespace)
+            return shared
+
+    def enforce_budget(self, keep=None):
+        budget = settings.RAG_INDEX_MEMORY_BUDGET_MB * 2 ** 20
+        evicted = []
+        with self.lock:
+            sizes = {namespace: s.memory_bytes() for namespace, s in self.indexes.items()}
+            total = sum(sizes.values())
+            for namespace in list(self.indexes):
+                if total <= budget:
+                    break
+                if namespace == keep:
+                    continue
+                evicted.append(self.indexes.pop(namespace))
+                total -= sizes[namespace]
+                print(f"♻️ Evicted RAG index for namespace {namespace}.")
+        _flush_snapshots(evicted)
+
+    def flush_snapshots(self):
+        """Write the snapshots of indexes changed since their last one, e.g. on shutdown"""
+        with self.lock:
+            indexes = list(self.indexes.values())
+        _flush_snapshots(indexes)
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+
+def _flush_snapshots(indexes):
+    for shared in indexes:
+        with shared.lock:
+            if shared.dirty:
+                shared.save_snapshot()
+
+
+_registry = _IndexRegistry()
+atexit.register(_registry.flush_snapshots)
 
 
 class RAGIndex:
+    """
+    Per-request handle on the caller's RAG namespace.
+
+    Each API key gets its own namespace of RagChunk rows and its own FAISS
+    index, loaded once per worker and then kept in sync with the namespace's
+    corpus version counter, so building a RAGIndex only costs a version lookup
+    unless another worker has written chunks.
+    """
+
     def __init__(self, api_key: str):
-        self.client = genai.Client(api_key=api_key)
+        self.client = get_client(api_key)
         self.model_name = "gemini-embedding-001"
+        self.task_type = "SEMANTIC_SIMILARITY"
+        self.embedding_dtype = settings.RAG_EMBEDDING_DTYPE
+        # Set per namespace when its first chunks are stored; 0 = full model output.
+        self.embedding_dimension = settings.RAG_EMBEDDING_DIMENSION
 
-        self.faiss_index = None
-        self.documents = []
+        self.namespace = namespace_for(api_key)
+        self.shared = _registry.get(self.namespace)
+
+        self.chunk_tokens = settings.RAG_CHUNK_TOKENS
+        self.chunk_overlap_tokens = settings.RAG_CHUNK_OVERLAP_TOKENS
+        self.chunk_min_tokens = settings.RAG_CHUNK_MIN_TOKENS
+
+        self.sync()
 
-        self.chunk_size = 200        
-        self.chunk_overlap = 50       
+    @property
+    def faiss_index(self):
+        return self.shared.faiss_index
 
-        self.load_data()
+    def _chunks(self):
+        """The namespace's published rows"""
+        return RagChunk.objects.filter(namespace=self.namespace, pending=False)
 
-    def _chunk_text(self, text):
-        """Split one long text into overlapping chunks"""
-        chunks = []
-        for i in range(0, len(text), self.chunk_size - self.chunk_overlap):
-            chunk = text[i:i + self.chunk_size]
-            if len(chunk.strip()) >= 100:
-                chunks.append(chunk)
-        return chunks
+    def _chunk_pages(self, pages):
+        """Lazily split a stream of page texts into overlapping sentence-aligned chunks"""
+        return chunker.iter_chunks(
+            pages,
+            chunk_tokens=self.chunk_tokens,
+            overlap_tokens=self.chunk_overlap_tokens,
+            min_tokens=self.chunk_min_tokens,
+        )
 
     def _embed_texts(self, texts):
-        """Embed multiple texts using Gemini"""
+        """Embed multiple texts using Gemini, reusing cached vectors for unchanged chunks"""
         try:
-            response = self.client.models.embed_content(
-                model=self.model_name,
-                contents=texts,
-                config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY"),
+            return embedding_cache.get_or_embed(
+                texts,
+                self._request_embeddings,
+                self.model_name,
+                self.task_type,
+                dimension=self.embedding_dimension,
             )
-            return [np.array(e.values) for e in response.embeddings]
         except Exception as e:
             raise Exception(f"Embedding failed: {e}")
 
-    def add_document(self, source_name, full_text, metadata=None):
-        """Chunk, embed, and store document text into RagChunk table"""
-        try:
-            chunks = self._chunk_text(full_text)
-            if not chunks:
-                print("⚠️ No valid chunks extracted from text.")
+    def _request_embeddings(self, texts):
+        """Embed texts that are not cached, in concurrent size-limited batches"""
+        return embedder.embed_in_batches(texts, self._embed_batch)
+
+    def _embed_batch(self, texts):
+        """Call the Gemini embedding API for one batch of texts"""
+        response = self.client.models.embed_content(
+            model=self.model_name,
+            contents=texts,
+            config=self._embed_config(),
+        )
+        vectors = np.array([e.values for e in response.embeddings], dtype=np.float32)
+        return embedder.project(vectors, self.embedding_dimension)
+
+    def _embed_queries(self, queries):
+        """Embed search queries like the namespace's documents, batched and normalized"""
+        vectors = embedding_cache.query_cache.get_or_embed(
+            queries,
+            self._request_embeddings,
+            self.model_name,
+            self.task_type,
+            dimension=self.embedding_dimension,
+        )
+        return index_factory.normalize(vectors)
+
+    def embed_query(self, query):
+        """Normalized embedding of one search query, as used for retrieval"""
+        return self._embed_queries([query])[0]
+
+    async def _aembed_batch(self, texts):
+        """Call the Gemini embedding API for one batch of texts, on the async client"""
+        response = await self.client.aio.models.embed_content(
+            model=self.model_name,
+            contents=texts,
+            config=self._embed_config(),
+        )
+        vectors = np.array([e.values for e in response.embeddings], dtype=np.float32)
+        return embedder.project(vectors, self.embedding_dimension)
+
+    async def _arequest_embeddings(self, texts):
+        return await embedder.aembed_in_batches(texts, self._aembed_batch)
+
+    async def aembed_query(self, query):
+        """
+        embed_query without blocking the event loop. The vector lands in the
+        query cache, so a retrieval for the same query right after is free.
+        """
+        vectors = await embedding_cache.query_cache.aget_or_embed(
+            [query],
+            self._arequest_embeddings,
+            self.model_name,
+            self.task_type,
+            dimension=self.embedding_dimension,
+        )
+        return index_factory.normalize(vectors)[0]
+
+    def _embed_config(self):
+        return types.EmbedContentConfig(
+            task_type=self.task_type,
+            output_dimensionality=self.embedding_dimension or None,
+        )
+
+    def _make_writable(self):
+        """Replace a memory-mapped snapshot with a private copy; caller holds the lock"""
+        shared = self.shared
+        if shared.mmapped:
+            # A memory-mapped snapshot is a read-only view.
+            shared.faiss_index = faiss.deserialize_index(faiss.serialize_index(shared.faiss_index))
+            index_factory.configure_search(shared.faiss_index)
+            shared.mmapped = False
+
+    def _append_vectors(self, embeddings, ids, texts, sources, created_ats, metadatas):
+        """
+        Append normalized vectors to the shared FAISS index under their
+        RagChunk ids; caller holds the lock. Chunk texts only feed the BM25 index, if it
+        has been built, and are not kept.
+        """
+        shared = self.shared
+        if shared.faiss_index is None:
+            shared.index_type = index_factory.choose_index_type(len(embeddings))
+            shared.codec = index_factory.configured_codec()
+            shared.faiss_index = index_factory.with_ids(
+                index_factory.build_index(shared.index_type, embeddings, shared.codec)
+            )
+            shared.trained_on = len(embeddings)
+        else:
+            self._make_writable()
+        shared.faiss_index.add_with_ids(embeddings, ids)
+        if shared.bm25 is not None:
+            shared.bm25.add(ids, texts)
+        shared.columns.append(sources, created_ats, metadatas)
+        shared.ids = np.concatenate([shared.ids, ids])
+        shared.last_id = max(shared.last_id, int(ids.max()))
+
+    def _append_chunks(self, chunks):
+        """Append RagChunk rows to the shared FAISS index; caller holds the lock"""
+        chunks = list(chunks)
+        if not chunks:
+            return
+        embeddings = index_factory.normalize(_decode_embeddings(
+            [c.embedding for c in chunks], [c.embedding_dtype for c in chunks]
+        ))
+        ids = np.array([c.id for c in chunks], dtype=np.int64)
+        self._append_vectors(
+            embeddings,
+            ids,
+            [c.text for c in chunks],
+            [c.source for c in chunks],
+            [c.created_at for c in chunks],
+            [c.metadata for c in chunks],
+        )
+
+    def _append_new_chunks(self):
+        """Append rows written after the last indexed id; caller holds the lock"""
+        self._append_rows(self._chunks().filter(id__gt=self.shared.last_id))
+
+    def _append_rows(self, chunks):
+        """
+        Append the RagChunk rows of the `chunks` queryset to the shared FAISS
+        index, reading them a batch at a time as plain values. Texts are only
+        read when the BM25 index has been built. Caller holds the lock;
+        returns the number of rows appended.
+        """
+        columns = ("id", "embedding", "embedding_dtype", "source", "created_at", "metadata")
+        with_text = self.shared.bm25 is not None
+        if with_text:
+            columns += ("text",)
+
+        embeddings, ids, texts, sources, created_ats, metadatas = [], [], [], [], [], []
+
+        def decode(batch):
+            if not batch:
                 return
+            batch_ids, blobs, dtypes, batch_sources, batch_created_ats, batch_metadatas, *rest = zip(*batch)
+            # Raw blobs are dropped per batch; only the float32 matrix is kept.
+            embeddings.append(_decode_embeddings(blobs, dtypes))
+            ids.extend(batch_ids)
+            sources.extend(batch_sources)
+            created_ats.extend(batch_created_ats)
+            metadatas.extend(batch_metadatas)
+            if with_text:
+                texts.extend(rest[0])
 
-            embeddings = self._embed_texts(chunks)
+        rows = chunks.order_by("id").values_list(*columns)
+        batch = []
+        for row in rows.iterator(chunk_size=settings.RAG_BULK_CREATE_BATCH_SIZE):
+            batch.append(row)
+            if len(batch) >= settings.RAG_BULK_CREATE_BATCH_SIZE:
+                decode(batch)
+                batch = []
+        decode(batch)
 
-            for chunk, emb in zip(chunks, embeddings):
-                RagChunk.objects.create(
-                    source=source_name,
-                    text=chunk,
-                    embedding=emb.tolist(),
-                    metadata=metadata or {},
-                )
+        if not ids:
+            return 0
+        # One append, so a new index is typed and trained on the whole set.
+        self._append_vectors(
+            index_factory.normalize(np.vstack(embeddings)),
+            np.array(ids, dtype=np.int64),
+            texts,
+            sources,
+            created_ats,
+            metadatas,
+        )
+        return len(ids)
+
+    def _remove_vectors(self, chunk_ids):
+        """
+        Drop RagChunk ids and their BM25 postings from the shared index;
+        caller holds the lock. HNSW graphs cannot delete vectors, so there
+        the ids are tombstoned and skipped at search time until a rebuild.
+        """
+        shared = self.shared
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        chunk_ids = chunk_ids[np.isin(chunk_ids, shared.ids)]
+        if shared.faiss_index is None or not len(chunk_ids):
+            return
+
+        self._make_writable()
+        if index_factory.supports_removal(shared.faiss_index):
+            shared.faiss_index.remove_ids(chunk_ids)
+        else:
+            shared.tombstones = np.union1d(shared.tombstones, chunk_ids)
+
+        keep = ~np.isin(shared.ids, chunk_ids)
+        shared.ids = shared.ids[keep]
+        shared.columns.take(keep)
+        if shared.bm25 is not None:
+            shared.bm25.remove(chunk_ids)
+
+    def _load_snapshot(self):
+        """
+        Adopt the on-disk snapshot, then replay the RagChunk rows deleted or
+        added since it was written; caller holds the lock. Returns False if
+        the snapshot cannot be used.
+        """
+        if not settings.RAG_INDEX_SNAPSHOTS:
+            return False
+
+        loaded = snapshot.read_snapshot(self.namespace)
+        if loaded is None:
+            return False
+        faiss_index, ids, tombstones, manifest = loaded
+
+        chunks = self._chunks()
+        count = chunks.count()
+        if index_factory.needs_rebuild(
+            manifest.get("index_type"), manifest.get("codec"), manifest.get("trained_on", 0), count
+        ):
+            print("⚠️ RAG index snapshot has the wrong index type, rebuilding from the database.")
+            return False
+        if not index_factory.has_valid_ids(faiss_index):
+            print("⚠️ RAG index snapshot maps ids over an IVF index, rebuilding from the database.")
+            return False
+        if self.embedding_dimension and faiss_index.d != self.embedding_dimension:
+            print("⚠️ RAG index snapshot has another embedding dimension, rebuilding from the database.")
+            return False
+        index_factory.configure_search(faiss_index)
+
+        rows = {
+            row[0]: row[1:]
+            for row in chunks.filter(id__lte=manifest["max_id"])
+            .values_list("id", "source", "created_at", "metadata")
+            .iterator()
+        }
+        deleted = ids[~np.isin(ids, np.fromiter(rows, dtype=np.int64, count=len(rows)))]
+        if len(rows) != len(ids) - len(deleted):
+            # Rows the snapshot never saw, committed below its newest id.
+            print("⚠️ RAG index snapshot is stale, rebuilding from the database.")
+            return False
+        if len(deleted) == len(ids):
+            return False
+        if len(deleted):
+            faiss_index = faiss.deserialize_index(faiss.serialize_index(faiss_index))
+            index_factory.configure_search(faiss_index)
+            if index_factory.supports_removal(faiss_index):
+                faiss_index.remove_ids(deleted)
+            else:
+                tombstones = np.union1d(tombstones, deleted)
+            ids = ids[~np.isin(ids, deleted)]
+        columns = ColumnStore()
+        columns.append(*zip(*[rows.pop(i) for i in ids.tolist()]))
+        del rows
+
+        shared = self.shared
+        shared.faiss_index = faiss_index
+        shared.ids = ids
+        shared.tombstones = tombstones
+        shared.columns = columns
+        shared.last_id = manifest["max_id"]
+        shared.mmapped = not len(deleted)
+        shared.index_type = manifest["index_type"]
+        shared.codec = manifest["codec"]
+        shared.trained_on = manifest["trained_on"]
+
+        self._append_new_chunks()
+        replayed = len(deleted) + len(shared.ids) - len(ids)
+        if replayed:
+            shared.dirty = True
+            print(f"✅ Replayed {replayed} RAG chunk changes onto the snapshot.")
+        return True
+
+    def _lexical_index(self):
+        """
+        The shared BM25 index, read from the snapshot or built from the
+        database on first use; caller holds the lock. Workers that only
+        serve dense retrieval never hold one.
+        """
+        shared = self.shared
+        if shared.bm25 is None:
+            shared.bm25 = self._load_bm25() or self._build_bm25()
+        return shared.bm25
+
+    def _load_bm25(self):
+        """
+        The snapshot's BM25 index, brought up to the indexed chunks by
+        dropping deleted ones and tokenizing newer ones; caller holds the lock
+        """
+        manifest = snapshot.read_manifest(self.namespace) if settings.RAG_INDEX_SNAPSHOTS else None
+        state = snapshot.read_bm25(self.namespace, manifest) if manifest else None
+        if state is None:
+            return None
+        try:
+            bm25 = BM25Index.from_state(state)
+        except KeyError:
+            return None
+        shared = self.shared
+        bm25.remove(bm25.doc_ids[~np.isin(bm25.doc_ids, shared.ids)])
+        missing = shared.ids[~np.isin(shared.ids, bm25.doc_ids)]
+        if len(missing):
+            self._tokenize_chunks(bm25, missing)
+        return bm25
+
+    def _build_bm25(self):
+        """Tokenize the indexed chunks' texts into a new BM25 index; caller holds the lock"""
+        bm25 = BM25Index()
+        self._tokenize_chunks(bm25, self.shared.ids)
+        return bm25
+
+    def _tokenize_chunks(self, bm25, chunk_ids):
+        """Add the texts of the given indexed chunks to `bm25`, a batch at a time"""
+        def add(rows):
+            ids = np.array([chunk_id for chunk_id, _ in rows], dtype=np.int64)
+            wanted = np.isin(ids, chunk_ids)
+            bm25.add(ids[wanted], [text for (_, text), keep in zip(rows, wanted) if keep])
+
+        rows = self._chunks().filter(
+            id__gte=int(chunk_ids.min()), id__lte=self.shared.last_id
+        ).values_list("id", "text")
+        batch = []
+        for row in rows.iterator(chunk_size=settings.RAG_BULK_CREATE_BATCH_SIZE):
+            batch.append(row)
+            if len(batch) >= settings.RAG_BULK_CREATE_BATCH_SIZE:
+                add(batch)
+                batch = []
+        add(batch)
+
+    def _needs_rebuild(self):
+        """
+        Whether the corpus has outgrown the shared index's type or IVF
+        training, or too much of the index is tombstoned
+        """
+        shared = self.shared
+        if shared.faiss_index is None:
+            return False
+        if len(shared.tombstones) > settings.RAG_TOMBSTONE_REBUILD_RATIO * shared.faiss_index.ntotal:
+            return True
+        return index_factory.needs_rebuild(
+            shared.index_type, shared.codec, shared.trained_on, len(shared.ids)
+        )
+
+    def _dimension_changed(self):
+        """Whether the namespace's vectors were re-projected to another dimension"""
+        faiss_index = self.shared.faiss_index
+        return (
+            faiss_index is not None
+            and self.embedding_dimension
+            and faiss_index.d != self.embedding_dimension
+        )
 
-            print(f"✅ Added {len(chunks)} chunks from {source_name}")
+    def add_document(self, source_name, full_text, metadata=None, replace=False):
+        """
+        Chunk, embed, and store document text into RagChunk table. With
+        `replace`, chunks previously stored for the same source are removed.
+        """
+        return self.add_pages(source_name, [full_text], metadata=metadata, replace=replace)
 
-            self.load_data()
+    def add_pages(self, source_name, pages, metadata=None, replace=False, progress=None):
+        """
+        Like add_document, for a document given as an iterable of page texts,
+        e.g. a lazy PDF page reader. Returns the number of chunks added.
+
+        Pages are chunked on a pipeline of threads connected by bounded
+        queues (see rag_service.pipeline), and each batch of chunks is
+        embedded while the previous batch is written, so only a few pages of
+        text and vectors are held at a time. Batches are written as pending
+        rows, which no worker indexes; once every batch is written, they are
+        published together with the removal of the source's old chunks and
+        one corpus version bump, in a single transaction.
+
+        `progress(chunks_embedded, chunks_written)` is called on the calling
+        thread after each batch is written; an exception it raises aborts
+        the ingest like any other failure.
+        """
+        written = []
+        embedded = 0
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-ingest")
+        try:
+            batches = pipeline.staged(
+                pages, self._chunk_batches, maxsize=settings.RAG_INGEST_QUEUE_SIZE
+            )
+            pending = None
+            # A trailing None flushes the last batch.
+            for batch in chain(batches, [None]):
+                embedding = None if batch is None else self._embed_in_background(batch, pool)
+                if pending is not None:
+                    texts, embeddings = pending()
+                    embedded += len(texts)
+                    written.extend(self._write_chunks(source_name, texts, embeddings, metadata))
+                    if progress is not None:
+                        progress(embedded, len(written))
+                pending = embedding
+
+            if not written:
+                print("⚠️ No valid chunks extracted from text.")
+                return 0
+
+            removed = []
+            with transaction.atomic():
+                if replace:
+                    removed = self._delete_source(source_name, before_id=min(written))
+                self._publish_chunks(written)
+                version = _bump_corpus_version(self.namespace)
+
+            print(f"✅ Added {len(written)} chunks from {source_name}")
+            self._apply_change(version, removed=removed, added=None)
+            return len(written)
 
         except Exception as e:
+            if written:
+                self._discard_chunks(written)
             raise Exception(f"Error adding document: {e}")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _chunk_batches(self, pages):
+        """Group the chunks of a page stream into embedding-sized batches"""
+        batch = []
+        for chunk in self._chunk_pages(pages):
+            batch.append(chunk)
+            if len(batch) >= settings.RAG_EMBED_BATCH_MAX_ITEMS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _embed_in_background(self, texts, pool):
+        """
+        Look up cached vectors for `texts` and start embedding the rest on
+        `pool`. Returns a callable that waits for (texts, embeddings) and
+        caches the new vectors; database access stays on the calling thread.
+        """
+        dimension = self.embedding_dimension
+        hashes, cached, missing = embedding_cache.lookup(
+            texts, self.model_name, self.task_type, dimension
+        )
+        future = pool.submit(self._request_embeddings, list(missing.values())) if missing else None
+
+        def result():
+            if future is not None:
+                try:
+                    vectors = dict(zip(missing, np.asarray(future.result(), dtype=np.float32)))
+                except Exception as e:
+                    raise Exception(f"Embedding failed: {e}")
+                embedding_cache.store(vectors, self.model_name, self.task_type, dimension)
+                cached.update(vectors)
+            return texts, np.vstack([cached[h] for h in hashes])
+
+        return result
+
+    def _write_chunks(self, source_name, texts, embeddings, metadata):
+        """Insert one batch of chunks as pending rows and return their ids"""
+        rows = [
+            RagChunk(
+                namespace=self.namespace,
+                pending=True,
+                source=source_name,
+                text=chunk,
+                embedding=_encode_embedding(emb, self.embedding_dtype),
+                embedding_dtype=self.embedding_dtype,
+                embedding_dimension=len(emb),
+                metadata=metadata or {},
+            )
+            for chunk, emb in zip(texts, embeddings)
+        ]
+        RagChunk.objects.bulk_create(rows, batch_size=settings.RAG_BULK_CREATE_BATCH_SIZE)
+        return [row.id for row in rows]
+
+    def _publish_chunks(self, chunk_ids):
+        """Make an ingest's pending rows visible; run inside the publishing transaction"""
+        size = settings.RAG_BULK_CREATE_BATCH_SIZE
+        for start in range(0, len(chunk_ids), size):
+            RagChunk.objects.filter(id__in=chunk_ids[start:start + size]).update(pending=False)
+
+    def _discard_chunks(self, chunk_ids):
+        """Delete the rows of an ingest that failed part-way, published or not"""
+        size = settings.RAG_BULK_CREATE_BATCH_SIZE
+        with transaction.atomic():
+            for start in range(0, len(chunk_ids), size):
+                RagChunk.objects.filter(
+                    namespace=self.namespace, id__in=chunk_ids[start:start + size]
+                ).delete()
+            _bump_corpus_version(self.namespace)
+        self.sync()
+
+    def replace_document(self, source_name, full_text, metadata=None):
+        """Re-chunk a document, swapping only its own vectors in the index"""
+        return self.add_document(source_name, full_text, metadata=metadata, replace=True)
+
+    def remove_document(self, source_name):
+        """Delete a document's chunks from the database and the index; returns how many"""
+        try:
+            with transaction.atomic():
+                removed = self._delete_source(source_name)
+                if not removed:
+                    return 0
+                version = _bump_corpus_version(self.namespace)
 
-    def load_data(self):
-        """Load RagChunk data from DB and rebuild FAISS index"""
+            print(f"✅ Removed {len(removed)} chunks from {source_name}")
+            self._apply_change(version, removed=removed)
+            return len(removed)
+
+        except Exception as e:
+            raise Exception(f"Error removing document: {e}")
+
+    def _delete_source(self, source_name, before_id=None):
+        """
+        Delete a source's rows, or only those older than `before_id`, and
+        return their ids; run inside a transaction
+        """
+        rows = self._chunks().filter(source=source_name)
+        if before_id is not None:
+            rows = rows.filter(id__lt=before_id)
+        removed = list(rows.values_list("id", flat=True))
+        if removed:
+            rows.delete()
+        return removed
+
+    def _apply_change(self, version, removed=(), added=()):
+        """
+        Apply a change this worker just committed as `version`. If it is the
+        only change since the last sync, only the affected vectors are
+        touched; otherwise the index is resynced from the database.
+        `added=None` means the new rows are read back from the database.
+        """
+        shared = self.shared
+        with shared.lock:
+            in_sync = shared.version is not None and shared.version == version - 1
+            if in_sync and (added is None or all(row.id is not None for row in added)):
+                if removed:
+                    self._remove_vectors(removed)
+                if added is None:
+                    self._append_new_chunks()
+                else:
+                    self._append_chunks(added)
+                shared.version = version
+            else:
+                self.sync()
+
+            if self._needs_rebuild():
+                self.load_data(from_snapshot=False)
+            else:
+                shared.changed()
+
+        _registry.enforce_budget(keep=self.namespace)
+
+    def sync(self):
+        """Bring the shared index up to date with the corpus version in the DB"""
+        from django.db.utils import OperationalError, ProgrammingError
+
+        shared = self.shared
+        try:
+            with shared.lock:
+                version, self.embedding_dimension = _corpus_state(self.namespace)
+                if shared.version == version:
+                    return
+
+                stale = (
+                    shared.version is None
+                    or self._dimension_changed()
+                    or self._chunks().filter(id__lte=shared.last_id).count()
+                    != len(shared.ids)
+                )
+                if stale:
+                    self.load_data()
+                else:
+                    self._append_new_chunks()
+                    shared.version = version
+                    if self._needs_rebuild():
+                        self.load_data(from_snapshot=False)
+            _registry.enforce_budget(keep=self.namespace)
+        except (OperationalError, ProgrammingError):
+            print("⚠️ Skipping RAG index sync — database not ready yet.")
+
+    def load_data(self, from_snapshot=True):
+        """
+        Load the namespace's RagChunk data from DB and rebuild its FAISS
+        index, starting from the snapshot unless `from_snapshot` is False
+        """
         try:
             from django.db.utils import OperationalError, ProgrammingError
-            chunks = RagChunk.objects.all()
-            if not chunks.exists():
-                print("⚠️ No RAG chunks found in the database.")
-                return
+            shared = self.shared
+            with shared.lock:
+                version, self.embedding_dimension = _corpus_state(self.namespace)
+                shared.reset()
+                shared.version = version
 
-            self.documents = [
-                Document(page_content=c.text, metadata=c.metadata) for c in chunks
-            ]
-            embeddings = [np.array(c.embedding, dtype=np.float32) for c in chunks]
+                if from_snapshot and self._load_snapshot():
+                    if not self._needs_rebuild():
+                        print(f"✅ RAG index loaded from snapshot with {len(shared.ids)} chunks.")
+                        return
+                    shared.reset()
+                    shared.version = version
 
-            embedding_dim = len(embeddings[0])
-            self.faiss_index = faiss.IndexFlatL2(embedding_dim)
-            self.faiss_index.add(np.array(embeddings, dtype=np.float32))
+                count = self._append_rows(self._chunks())
+                if not count:
+                    print("⚠️ No RAG chunks found in the database.")
+                    return
 
-            print(f"✅ RAG index loaded with {len(chunks)} chunks.")
+                shared.save_snapshot()
+
+            print(f"✅ RAG index loaded with {count} chunks.")
         except (OperationalError, ProgrammingError):
             print("⚠️ Skipping RAG index load — database not ready yet.")
         except Exception as e:
             raise Exception(f"Error loading RAG data: {e}")
 
-    def retrieve_documents(self, query, k=3):
-        """Retrieve most relevant chunks for a given query"""
+    def retrieve_documents(self, query, k=3, mode=None, filters=None):
+        """
+        Retrieve most relevant chunks for a given query.
+
+        `mode` is "dense" (vector search), "lexical" (BM25 only, no embedding
+        call) or "hybrid" (both, fused by reciprocal rank); it defaults to
+        RAG_RETRIEVAL_MODE. `filters` restricts the search to matching chunks,
+        e.g. {"source": ["a.pdf"], "metadata": {"lang": "en"},
+        "created_after": "2025-01-01T00:00:00Z"}; see filters.ColumnStore.
+        """
+        return [hit["text"] for hit in self.retrieve_many([query], k, mode, filters)[0]]
+
+    def retrieve_many(self, queries, k=3, mode=None, filters=None):
+        """
+        Retrieve chunks for several queries at once, with one batched
+        embedding call and one FAISS search over the query matrix.
+
+        k * RAG_MMR_OVERFETCH candidates are re-ranked by maximal marginal
+        relevance (except in "lexical" mode) and neighbouring chunks of one
+        document are merged into a single span (RAG_MERGE_ADJACENT_CHUNKS).
+
+        Returns one list per query of up to k {"id", "ids", "text", "score"}
+        dicts, best first; "ids" are the span's chunks in document order and
+        "id" is the first of them. Scores are cosine similarities in "dense"
+        mode, BM25 scores in "lexical" mode and reciprocal-rank fusion scores
+        in "hybrid" mode.
+        """
+        mode = mode or settings.RAG_RETRIEVAL_MODE
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        validate_filters(filters)
+        queries = list(queries)
+        empty = [[] for _ in queries]
+
         try:
+            if not queries:
+                return []
             if not self.faiss_index:
                 print("⚠️ FAISS index not initialized.")
-                return []
+                return empty
 
-            query_embedding = self.client.models.embed_content(
-                model=self.model_name,
-                contents=[query],
-                config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY"),
-            ).embeddings[0].values
+            mmr = mode != "lexical" and settings.RAG_MMR_LAMBDA < 1
+            merge = settings.RAG_MERGE_ADJACENT_CHUNKS
+            fetch = k * settings.RAG_HYBRID_OVERFETCH if mode == "hybrid" else k
+            if mmr or merge:
+                fetch = max(fetch, k * settings.RAG_MMR_OVERFETCH)
 
-            query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+            if mode != "lexical":
+                query_vectors = self._embed_queries(queries)
 
-            distances, indices = self.faiss_index.search(query_embedding, k)
+            shared = self.shared
+            dense = lexical = positions = None
+            builds_bm25 = mode != "dense" and shared.bm25 is None
+            with shared.lock:
+                mask = shared.columns.mask(filters)
+                if mask is not None and not mask.any():
+                    return empty
 
-            results = []
-            for i in indices[0]:
-                if 0 <= i < len(self.documents):
-                    results.append(self.documents[i].page_content)
+                allowed = None if mask is None else shared.ids[mask]
+                rerank = index_factory.is_lossy(shared.index_type, shared.codec)
+
+                if mode != "lexical":
+                    candidates = max(fetch, k * settings.RAG_RERANK_FACTOR) if rerank else fetch
+                    # FAISS allocates k results per query, however few vectors there are.
+                    candidates = max(1, min(candidates, self.faiss_index.ntotal))
+                    if allowed is not None or len(shared.tombstones):
+                        params, keepalive = index_factory.filtered_search_parameters(
+                            self.faiss_index,
+                            allowed=allowed,
+                            excluded=None if allowed is not None else shared.tombstones,
+                        )
+                        distances, indices = self.faiss_index.search(
+                            query_vectors, candidates, params=params
+                        )
+                    else:
+                        distances, indices = self.faiss_index.search(query_vectors, candidates)
+                    dense = [
+                        [(int(i), float(d)) for i, d in zip(row, scores) if i >= 0]
+                        for row, scores in zip(indices, distances)
+                    ]
+                if mode != "dense":
+                    bm25 = self._lexical_index()
+                    lexical = [bm25.search(q, min(fetch, len(bm25)), allowed) for q in queries]
+
+                if merge:
+                    positions = self._positions(
+                        i for hits in (dense or []) + (lexical or []) for i, _ in hits
+                    )
+
+            if builds_bm25:
+                _registry.enforce_budget(keep=self.namespace)
+
+            # Stored vectors for the exact re-rank and MMR, read in one query.
+            vectors = None
+            if dense is not None and (rerank or mmr):
+                wanted = [i for hits in dense for i, _ in hits]
+                if mmr and lexical is not None:
+                    wanted += [i for hits in lexical for i, _ in hits]
+                vectors = _stored_vectors(wanted)
+
+            if dense is not None and rerank:
+                dense = [
+                    _exact_rerank(query_vector, hits, vectors)[:fetch]
+                    for query_vector, hits in zip(query_vectors, dense)
+                ]
 
+            if mode == "hybrid":
+                ranked = [
+                    reciprocal_rank_fusion([[i for i, _ in d], [i for i, _ in l]])
+                    for d, l in zip(dense, lexical)
+                ]
+            else:
+                ranked = dense if mode == "dense" else lexical
+
+            spans = [
+                _diversify(
+                    hits,
+                    k,
+                    query_vector=query_vectors[q] if mmr else None,
+                    vectors=vectors,
+                    positions=positions,
+                )
+                for q, hits in enumerate(ranked)
+            ]
+
+            texts = _chunk_texts([i for query_spans in spans for ids, _ in query_spans for i in ids])
+            results = []
+            for query_spans in spans:
+                hits = []
+                for ids, score in query_spans:
+                    ids = [i for i in ids if i in texts]
+                    if ids:
+                        hits.append({"id": ids[0], "ids": ids, "text": _span_text(ids, texts), "score": score})
+                results.append(hits)
             return results
 
         except Exception as e:
             raise Exception(f"Error retrieving documents: {e}")
 
+    def span_texts(self, spans):
+        """
+        Texts of spans of chunk ids, as retrieve_many returns them in "ids";
+        chunks deleted since are left out
+        """
+        texts = _chunk_texts([i for ids in spans for i in ids])
+        spans = [[i for i in ids if i in texts] for ids in spans]
+        return [_span_text(ids, texts) for ids in spans if ids]
+
+    def _positions(self, chunk_ids):
+        """
+        Chunk id -> (source code, row of the shared id array) for indexed
+        chunks, so consecutive rows of one source are neighbouring chunks;
+        caller holds the lock
+        """
+        shared = self.shared
+        ids = np.fromiter(set(chunk_ids), dtype=np.int64)
+        if not len(ids) or not len(shared.ids):
+            return {}
+        rows = np.minimum(np.searchsorted(shared.ids, ids), len(shared.ids) - 1)
+        found = shared.ids[rows] == ids
+        codes = shared.columns.source_codes[rows]
+        return {
+            int(i): (int(code), int(row))
+            for i, code, row in zip(ids[found], codes[found], rows[found])
+        }
+
     def delete_all_chunks(self):
-        """Delete all chunks from the database"""
+        """Delete all of the namespace's chunks from the database"""
         try:
-            RagChunk.objects.all().delete()
-            print("✅ All chunks deleted from the database.")
+            with transaction.atomic():
+                self._chunks().delete()
+                version = _bump_corpus_version(self.namespace)
+
+            with self.shared.lock:
+                self.shared.reset()
+                self.shared.version = version
+                snapshot.clear_snapshots(self.namespace)
+            print(f"✅ All chunks deleted for namespace {self.namespace}.")
         except Exception as e:
             raise Exception(f"Error deleting chunks: {e}")
-
@@ -0,0 +1,177 @@
+import json
+import os
+import pickle
+import re
+
+import numpy as np
+import faiss
+from django.conf import settings
+
+
+MANIFEST_NAME = "manifest.json"
+# Bumped when the index layout changes; snapshots of another format are rebuilt.
+SNAPSHOT_FORMAT = 3
+_SNAPSHOT_FILE = re.compile(r"^index-v(\d+)\.(faiss|ids\.npy|tombstones\.npy|bm25\.pkl)$")
+
+
+def _snapshot_dir(namespace):
+    return os.path.join(str(settings.RAG_INDEX_DIR), namespace or "default")
+
+
+def _atomic_write(path, write):
+    """Write a file through a temporary name and move it into place"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_manifest(namespace):
+    """Return the manifest of the namespace's current snapshot, or None if there is none"""
+    try:
+        with open(os.path.join(_snapshot_dir(namespace), MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(namespace, faiss_index, ids, version, tombstones=None, bm25=None, **extra):
+    """
+    Persist the ID-mapped FAISS index, the RagChunk ids it serves, the ids
+    of vectors still in the index but deleted (`tombstones`) and, if given,
+    the BM25 index. Any `extra` keyword arguments are recorded in the
+    manifest.
+
+    Files are versioned by corpus version and the manifest is swapped last,
+    so readers only ever see a complete snapshot. A newer snapshot written by
+    another worker is never overwritten.
+    """
+    if not settings.RAG_INDEX_SNAPSHOTS or faiss_index is None or not len(ids):
+        return
+
+    directory = _snapshot_dir(namespace)
+    os.makedirs(directory, exist_ok=True)
+
+    current = read_manifest(namespace)
+    if current and current["version"] > version:
+        return
+
+    name = f"index-v{version}"
+    index_path = os.path.join(directory, f"{name}.faiss")
+    ids_path = os.path.join(directory, f"{name}.ids.npy")
+    ids = np.asarray(ids, dtype=np.int64)
+
+    _atomic_write(index_path, lambda p: faiss.write_index(faiss_index, p))
+
+    def save_array(array):
+        def save(p):
+            with open(p, "wb") as f:
+                np.save(f, array)
+        return save
+
+    _atomic_write(ids_path, save_array(ids))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "index": os.path.basename(index_path),
+        "ids": os.path.basename(ids_path),
+        "count": int(len(ids)),
+        "max_id": int(ids.max()),
+        **extra,
+    }
+
+    if tombstones is not None and len(tombstones):
+        tombstones_path = os.path.join(directory, f"{name}.tombstones.npy")
+        _atomic_write(tombstones_path, save_array(np.asarray(tombstones, dtype=np.int64)))
+        manifest["tombstones"] = os.path.basename(tombstones_path)
+
+    if bm25 is not None:
+        bm25_path = os.path.join(directory, f"{name}.bm25.pkl")
+
+        def save_bm25(p):
+            with open(p, "wb") as f:
+                pickle.dump(bm25.to_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        _atomic_write(bm25_path, save_bm25)
+        manifest["bm25"] = os.path.basename(bm25_path)
+
+    def dump(p):
+        with open(p, "w") as f:
+            json.dump(manifest, f)
+
+    _atomic_write(os.path.join(directory, MANIFEST_NAME), dump)
+    _remove_older_than(namespace, version)
+
+
+def read_snapshot(namespace):
+    """
+    Load the current snapshot, memory-mapping the index and id files so that
+    worker processes on one host share their pages through the OS cache.
+
+    Returns (faiss_index, ids, tombstones, manifest) or None.
+    """
+    manifest = read_manifest(namespace)
+    if not manifest:
+        return None
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        print("⚠️ RAG index snapshot has an old format, ignoring it.")
+        return None
+
+    directory = _snapshot_dir(namespace)
+    try:
+        faiss_index = faiss.read_index(
+            os.path.join(directory, manifest["index"]),
+            faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY,
+        )
+        ids = np.load(os.path.join(directory, manifest["ids"]), mmap_mode="r")
+        tombstones = np.empty(0, dtype=np.int64)
+        if manifest.get("tombstones"):
+            tombstones = np.load(os.path.join(directory, manifest["tombstones"]))
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"⚠️ Could not read RAG index snapshot: {e}")
+        return None
+
+    if faiss_index.ntotal != len(ids) + len(tombstones):
+        return None
+    return faiss_index, ids, tombstones, manifest
+
+
+def read_bm25(namespace, manifest):
+    """Load the BM25 index state saved with a snapshot, or None if it has none"""
+    if not manifest.get("bm25"):
+        return None
+    try:
+        with open(os.path.join(_snapshot_dir(namespace), manifest["bm25"]), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        print(f"⚠️ Could not read BM25 snapshot: {e}")
+        return None
+
+
+def clear_snapshots(namespace):
+    """Remove the namespace's manifest and every snapshot file"""
+    directory = _snapshot_dir(namespace)
+    try:
+        os.remove(os.path.join(directory, MANIFEST_NAME))
+    except OSError:
+        pass
+    _remove_older_than(namespace, None)
+
+
+def _remove_older_than(namespace, version):
+    directory = _snapshot_dir(namespace)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        match = _SNAPSHOT_FILE.match(name)
+        if match and (version is None or int(match.group(1)) < version):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
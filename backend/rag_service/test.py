@@ -13,7 +13,7 @@ def test_rag_index():
         print("❌ FAISS index not built.")
         return
 
-    print(f"✅ FAISS index built with {len(rag_index.documents)} chunks.")
+    print(f"✅ FAISS index built with {rag_index.faiss_index.ntotal} chunks.")
 
     test_query = "What are the impacts of AI on education?"
     print(f"\n🔹 Testing retrieval for query: {test_query}")
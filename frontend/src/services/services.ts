@@ -172,6 +172,26 @@ const handleResponseData = (response: string) => {
     return response;
 }
 
+const INGESTION_POLL_MS = 2000;
+
+const waitForIngestion = async (jobId: number) => {
+  for (;;) {
+    const response = await axios.get(`${API_URL}/rag-jobs/${jobId}/`, {
+      headers: {
+        Authorization: localStorage.getItem("apiKey"),
+      },
+    });
+    const job = response.data.data;
+    if (job.status === "succeeded") {
+      return job;
+    }
+    if (job.status === "failed" || job.status === "cancelled") {
+      throw new Error(job.error || `Ingestion job ${job.status}`);
+    }
+    await new Promise((resolve) => setTimeout(resolve, INGESTION_POLL_MS));
+  }
+};
+
 const insertFile = async (file: File) => {
   const formData = new FormData();
   formData.append("file", file);
@@ -181,10 +201,11 @@ const insertFile = async (file: File) => {
       Authorization: localStorage.getItem("apiKey"),
     },
   });
+  if (response.status === 202) {
+    // The PDF is ingested by a background worker; wait until it is searchable.
+    const job = await waitForIngestion(response.data.job_id);
     console.log("File inserted successfully");
-  if (response.status === 200) {
-    console.log("File inserted successfully");
-    return response.data;
+    return { ...response.data, job };
   } else {
     console.log("Failed to insert file");
     throw new Error("Failed to insert file");